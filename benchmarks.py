@@ -0,0 +1,1142 @@
+"""Бенчмарки подсистем бота.
+
+Запуск: python benchmarks.py <имя> (без имени — список доступных)
+"""
+import asyncio
+import csv
+import heapq
+import os
+import re
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+from aiogram import Bot, Dispatcher, F, Router
+from aiogram.client.session.base import BaseSession
+from aiogram.fsm.storage.base import StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+from callbacks import FormCallback, CallbackRouter, PREFIX as CALLBACK_PREFIX, unpack
+from config import PROJECTS, STATUSES, PRIORITIES, RESOURCE_TYPES, Catalog
+from keyboards import KeyboardRegistry, build_keyboard
+from aiogram.exceptions import TelegramNetworkError
+from aiogram.methods import SendMessage
+from outbox import Outbox, OutboxJob, percentile
+from outbox_store import OutboxStore
+from sqlite_storage import SQLiteStorage
+from reminders import ReminderScheduler
+from reports import ReportEngine, period_range
+from task_store import TaskStore, new_task
+from tenants import TenantRegistry
+from sharding import Supervisor
+from metrics import Metrics, Histogram, HandlerMetricsMiddleware
+from quick import QuickParser
+from importer import Importer
+from search import SearchIndex
+from board import StatusBoard
+from deadlines import DeadlineIndex
+from people import PeopleDirectory
+from flood import FloodControl
+from scheduler import UpdateScheduler
+
+
+# ==================== ОЧЕРЕДЬ ОТПРАВКИ ====================
+class FakeSendBot:
+    """Бот, который "отправляет" сообщение за latency секунд"""
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.calls = 0
+
+    async def send_message(self, chat_id, message_thread_id, text, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        return None
+
+
+async def bench_outbox(posts=2000, topics=7, chats=50):
+    """Всплеск постов в chats форумов: время ответа обработчику и задержка доставки"""
+    outbox = Outbox(workers=16, rate_per_minute=600, burst=20)
+    outbox.start(FakeSendBot())
+
+    enqueue = []
+    started = time.perf_counter()
+    for i in range(posts):
+        t = time.perf_counter()
+        await outbox.put(-1000 - i % chats, i % topics, f"post {i}")
+        enqueue.append(time.perf_counter() - t)
+    await outbox.stop(timeout=600)
+    elapsed = time.perf_counter() - started
+
+    stats = outbox.stats()
+    enqueue.sort()
+    print(f"outbox: {posts} постов за {elapsed:.2f} с, {stats['sent'] / elapsed:.0f} постов/с")
+    print(f"  ответ обработчику: p99 {percentile(enqueue, 99) * 1e6:.1f} мкс")
+    print(f"  доставка: p50 {stats['p50'] * 1000:.0f} мс, p99 {stats['p99'] * 1000:.0f} мс")
+
+
+class OutageBot(FakeSendBot):
+    """Бот, у которого первые outage секунд все отправки падают с ошибкой сети"""
+
+    def __init__(self, outage=1.0, latency=0.005):
+        super().__init__(latency)
+        self.down_until = time.monotonic() + outage
+        self.texts = []
+        self.sent_at = []
+
+    async def send_message(self, chat_id, message_thread_id, text, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        if time.monotonic() < self.down_until:
+            raise TelegramNetworkError(SendMessage(chat_id=chat_id, text=text), "outage")
+        self.texts.append(text)
+        self.sent_at.append(time.monotonic())
+
+
+async def bench_retry(posts=300, chats=30, outage=1.0, retry_rate=50):
+    """Сбой сети на outage секунд: все посты доходят ровно один раз, повторы не быстрее retry_rate/с"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = OutboxStore(os.path.join(tmp, 'outbox.db'))
+        outbox = Outbox(workers=16, rate_per_minute=6000, burst=100, global_rate=10000, store=store,
+                        retry_rate=retry_rate, retry_base=0.2, retry_cap=2.0)
+        bot = OutageBot(outage)
+        outbox.start(bot)
+        started = time.monotonic()
+        for i in range(posts):
+            await outbox.put(-1000 - i % chats, 4, f"post {i}", key=f"task:{i}")
+        while len(bot.texts) < posts and time.monotonic() - started < 60:
+            await asyncio.sleep(0.05)
+        elapsed = time.monotonic() - started
+        await outbox.stop()
+        await store.close()
+
+    recovered = bot.sent_at[0] if bot.sent_at else started
+    peak = max((sum(1 for t in bot.sent_at if second <= t - recovered < second + 1)
+                for second in range(int(elapsed) + 1)), default=0)
+    print(f"retry: сбой {outage:g} с, {posts} постов в {chats} чатов")
+    print(f"  доставлено {len(bot.texts)} (уникальных {len(set(bot.texts))}) за {elapsed:.2f} с, "
+          f"вызовов API {bot.calls}, повторов {outbox.retried}, ошибок {outbox.failed}")
+    print(f"  пик после восстановления: {peak} отправок/с (лимит повторов {retry_rate}/с)")
+
+    # Остановка посреди отправки: прерванные сообщения остаются в журнале и уходят после перезапуска
+    with tempfile.TemporaryDirectory() as tmp:
+        store = OutboxStore(os.path.join(tmp, 'outbox.db'))
+        outbox = Outbox(workers=4, rate_per_minute=6000, burst=100, store=store)
+        outbox.start(FakeSendBot(latency=60))
+        for i in range(8):
+            await outbox.put(-1000, 4, f"post {i}", key=f"task:{i}")
+        await asyncio.sleep(0.1)
+        await outbox.stop(timeout=0.2)
+        bot = OutageBot(outage=0)
+        outbox = Outbox(workers=4, rate_per_minute=6000, burst=100, store=store)
+        await outbox.load()
+        outbox.start(bot)
+        started = time.monotonic()
+        while len(bot.texts) < 8 and time.monotonic() - started < 30:
+            await asyncio.sleep(0.05)
+        await outbox.stop()
+        await store.close()
+    print(f"  остановка посреди отправки: после перезапуска дошло {len(set(bot.texts))} из 8")
+    assert sorted(bot.texts) == [f"post {i}" for i in range(8)], "прерванные отправки потеряны"
+
+
+async def bench_digest(posts=500, topics=7, window=2.0):
+    """Всплеск постов в темы одного форума со склейкой и без: число вызовов API"""
+    coalesce = {'window': window, 'max_chars': 3500}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, rule, store in (('без склейки', None, None), (f'склейка {window:g} с', coalesce, None),
+                                  (f'склейка {window:g} с, журнал', coalesce,
+                                   OutboxStore(os.path.join(tmp, 'outbox.db')))):
+            fake = OutageBot(outage=0, latency=0.01)
+            outbox = Outbox(workers=8, rate_per_minute=6000, burst=100, store=store)
+            outbox.start(fake)
+            started = time.perf_counter()
+            for i in range(posts):
+                text = f"💡 <b>ИДЕЯ:</b> идея номер {i}\n#Boost_Moto #Низкий\n📈 <b>Польза:</b> польза"
+                await outbox.put(-100, i % topics, text, coalesce=rule, key=f"task:{i}")
+            await outbox.stop(timeout=600)
+            delivered = sum(text.count("ИДЕЯ:") for text in fake.texts)
+            line = (f"{name}: {posts} постов -> {fake.calls} вызовов sendMessage "
+                    f"(сэкономлено {outbox.stats()['saved_calls']}), дошло постов {delivered} "
+                    f"за {time.perf_counter() - started:.1f} с")
+            if store is not None:
+                marked = await store.delivered([f"task:{i}" for i in range(posts)])
+                line += f", в журнале отправленных {len(marked)}"
+                await store.close()
+            print(line)
+
+        # Повтор после частичной отправки: посты с уже отправленными ключами вырезаются, остальные уходят
+        store = OutboxStore(os.path.join(tmp, 'partial.db'))
+        now = time.time()
+        await store._run(store._execute_many, [("INSERT INTO delivered VALUES (?, ?, ?)", (f"task:{i}", 1, now))
+                                               for i in range(0, posts, 5)])
+        restored = OutboxJob(-100, 0, Outbox.DIGEST_SEPARATOR.join(f"пост {i}" for i in range(3)),
+                             keys=['task:0', 'task:1', 'task:2'])
+        await store.save(restored)
+        fake = OutageBot(outage=0, latency=0.01)
+        # Один воркер: пачки с общими ключами идут по очереди, а не наперегонки
+        outbox = Outbox(workers=1, rate_per_minute=6000, burst=100, store=store)
+        await outbox.load()
+        sent_keys = []
+
+        async def on_sent(message, keys):
+            sent_keys.extend(keys)
+
+        outbox.start(fake)
+        for start in range(0, posts, 50):
+            batch = range(start, start + 50)
+            await outbox.put(-100, start % topics, Outbox.DIGEST_SEPARATOR.join(f"пост {i}" for i in batch),
+                             on_sent=on_sent, keys=[f"task:{i}" for i in batch])
+        await outbox.stop(timeout=600)
+        texts = [part for text in fake.texts for part in text.split(Outbox.DIGEST_SEPARATOR)]
+        marked = await store.delivered([f"task:{i}" for i in range(posts)])
+        await store.close()
+        expected = posts - len(range(0, posts, 5))
+        print(f"частично отправленные пачки: дошло постов {len(set(texts))} из {expected} неотправленных "
+              f"(повторов {len(texts) - len(set(texts))}), on_sent получил {len(sent_keys)} ключей, "
+              f"в журнале {len(marked)}")
+        assert set(texts) == {f"пост {i}" for i in range(posts) if i % 5} and len(marked) == posts, \
+            "часть неотправленных постов потеряна или уже отправленные ушли повторно"
+
+
+# ==================== ХРАНИЛИЩЕ FSM ====================
+async def drive_form_steps(storage, users, steps=6):
+    """Проводит users пользователей через форму из steps шагов, возвращает задержки шага"""
+    latencies = []
+    for step in range(steps):
+        for user in range(users):
+            key = StorageKey(bot_id=1, chat_id=user, user_id=user)
+            t = time.perf_counter()
+            await storage.set_state(key, f"DeadlineForm:step{step}")
+            await storage.update_data(key, {f"field{step}": "x" * 40})
+            latencies.append(time.perf_counter() - t)
+    return sorted(latencies)
+
+
+async def bench_storage(users=5000):
+    """Задержка шага формы: MemoryStorage против SQLiteStorage, и загрузка после рестарта"""
+    memory = await drive_form_steps(MemoryStorage(), users)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'fsm.db')
+        storage = SQLiteStorage(path)
+        sqlite = await drive_form_steps(storage, users)
+        t = time.perf_counter()
+        await storage.close()
+        close_time = time.perf_counter() - t
+
+        t = time.perf_counter()
+        reloaded = SQLiteStorage(path)
+        load_time = time.perf_counter() - t
+        restored = len(reloaded._records)
+        await reloaded.close()
+
+    for name, values in (('MemoryStorage', memory), ('SQLiteStorage', sqlite)):
+        print(f"{name}: шаг формы p50 {percentile(values, 50) * 1e6:.1f} мкс, "
+              f"p99 {percentile(values, 99) * 1e6:.1f} мкс")
+    print(f"SQLiteStorage: финальная запись {close_time * 1000:.1f} мс, "
+          f"загрузка {restored} диалогов после рестарта {load_time * 1000:.1f} мс")
+
+
+async def bench_fsm_soak(seconds=8, per_second=4000, abandon=0.7, ttl=1.0):
+    """Долгий поток пользователей, abandon из них бросают форму: память без TTL и с TTL"""
+    form = {'project': '#Boost_Marine', 'date': '15.03', 'task': "Сдать макет", 'priority': '#Высокий'}
+    for name, options in (('без TTL', {}),
+                          (f'TTL {ttl:g} с', {'ttl': {'default': ttl}, 'sweep_interval': ttl / 4})):
+        with tempfile.TemporaryDirectory() as tmp:
+            storage = SQLiteStorage(os.path.join(tmp, 'fsm.db'), **options)
+            storage.start()
+            tracemalloc.start()
+            samples = []
+            user = 0
+            started = time.monotonic()
+            for second in range(seconds):
+                tick = time.monotonic()
+                for _ in range(per_second):
+                    user += 1
+                    key = StorageKey(bot_id=1, chat_id=user, user_id=user)
+                    await storage.set_state(key, 'DeadlineForm:task')
+                    await storage.set_data(key, dict(form, user=user))
+                    if user % 100 >= abandon * 100:
+                        # Дошел до конца формы
+                        await storage.set_state(key, None)
+                        await storage.set_data(key, {})
+                await asyncio.sleep(max(0.0, 1 - (time.monotonic() - tick)))
+                samples.append((len(storage._records), tracemalloc.get_traced_memory()[0]))
+            tracemalloc.stop()
+            await storage.close()
+        print(f"{name}: {user} пользователей за {time.monotonic() - started:.0f} с, "
+              f"{abandon:.0%} бросают форму, удалено {storage.expired}")
+        for second, (records, memory) in enumerate(samples, 1):
+            print(f"  {second:>2} с: диалогов в памяти {records:>6}, {memory / 1024 / 1024:6.1f} МБ")
+
+
+# ==================== КНОПКИ ФОРМ ====================
+async def bench_callbacks(forms=10, fields=6, presses=20000):
+    """Маршрутизация нажатия через aiogram: цепочка startswith-фильтров против CallbackRouter"""
+    legacy = Router()
+    for f in range(forms):
+        for field in range(fields):
+            prefix = f"form{f}_field{field}_"
+            legacy.callback_query(lambda c, prefix=prefix: c.data.startswith(prefix))(noop_handler)
+
+    routed = Router()
+    router = CallbackRouter()
+    for f in range(forms):
+        for field in range(fields):
+            router.register(f"form{f}", f"field{field}")(noop_route)
+
+    async def entry(callback):
+        form, field, value = unpack(callback.data)
+        router.resolve(form, field)
+    routed.callback_query(F.data.startswith(CALLBACK_PREFIX))(entry)
+
+    def press(data):
+        return CallbackQuery(id='1', from_user=User(id=1, is_bot=False, first_name='U'),
+                             chat_instance='1', data=data)
+
+    # Худший случай для цепочки — кнопка последней зарегистрированной формы
+    last = (f"form{forms - 1}", f"field{fields - 1}")
+    for name, observer, callback in (
+            ('цепочка startswith', legacy, press(f"{last[0]}_{last[1]}_bm")),
+            ('CallbackRouter', routed, press(FormCallback(form=last[0], field=last[1], value='bm').pack()))):
+        t = time.perf_counter()
+        for _ in range(presses):
+            await observer.propagate_event('callback_query', callback)
+        print(f"{name}: {(time.perf_counter() - t) / presses * 1e6:.1f} мкс на нажатие "
+              f"({forms * fields} зарегистрированных кнопок)")
+
+
+async def noop_handler(callback):
+    pass
+
+
+async def noop_route(callback, value, state):
+    pass
+
+
+# ==================== КЛАВИАТУРЫ ====================
+REPORT_PERIODS = Catalog({'day': "📅 За день", 'week': "📅 За неделю",
+                          'month': "📅 За месяц", 'custom': "📅 Другой период"})
+
+# Клавиатуры, которые показывают шесть форм: (справочник, форма, поле, ключи)
+FORM_KEYBOARDS = [
+    (PROJECTS, 'deadline', 'project', None), (PRIORITIES, 'deadline', 'priority', None),
+    (STATUSES, 'deadline', 'status', None),
+    (PROJECTS, 'question', 'project', None), (PRIORITIES, 'question', 'priority', None),
+    (PROJECTS, 'done', 'project', None), (STATUSES, 'done', 'status', ('done', 'review')),
+    (PROJECTS, 'idea', 'project', None), (PRIORITIES, 'idea', 'priority', None),
+    (PROJECTS, 'resource', 'project', None), (RESOURCE_TYPES, 'resource', 'resource_type', None),
+    (REPORT_PERIODS, 'report', 'period', None),
+]
+
+
+def build_uncached(source, form, field, keys):
+    items = source.items() if keys is None else [(key, source[key]) for key in keys]
+    return build_keyboard(items, form, field)
+
+
+def bench_keyboards(runs=2000):
+    """Клавиатуры шести форм: сборка на каждом шаге против KeyboardRegistry"""
+    registry = KeyboardRegistry()
+    for name, make in (('сборка на каждом шаге', build_uncached), ('KeyboardRegistry', registry.get)):
+        kept = []
+        tracemalloc.start()
+        t = time.perf_counter()
+        for _ in range(runs):
+            for source, form, field, keys in FORM_KEYBOARDS:
+                kept.append(make(source, form, field, keys))
+        elapsed = time.perf_counter() - t
+        snapshot = tracemalloc.take_snapshot()
+        tracemalloc.stop()
+        blocks = sum(stat.count for stat in snapshot.statistics('filename'))
+        print(f"{name}: {elapsed / runs * 1e6:.0f} мкс и {blocks / runs:.1f} живых аллокаций "
+              f"на прогон шести форм ({len(FORM_KEYBOARDS)} клавиатур)")
+
+    PROJECTS['bench'] = '#Bench'
+    registry.get(PROJECTS, 'deadline', 'project')
+    del PROJECTS['bench']
+    print(f"KeyboardRegistry: {registry.builds} сборок за {runs} прогонов "
+          f"(+1 после изменения PROJECTS)")
+
+
+# ==================== ХРАНИЛИЩЕ ЗАДАЧ ====================
+def fake_deadline(i):
+    """Данные формы дедлайна для i-й синтетической задачи"""
+    projects, statuses, priorities = list(PROJECTS.values()), list(STATUSES.values()), list(PRIORITIES.values())
+    return {
+        'project': projects[i % len(projects)],
+        'date': f"{i % 28 + 1:02d}.{i % 12 + 1:02d}",
+        'task': f"Задача номер {i}",
+        'priority': priorities[i % len(priorities)],
+        'responsible': f"@user{i % 40}",
+        'status': statuses[i % len(statuses)],
+    }
+
+
+async def fill_tasks(store, rows):
+    for i in range(rows):
+        await store.add('deadline', fake_deadline(i), chat_id=-100, thread_id=4, created_by=i % 40)
+
+
+async def bench_tasks(rows=50000, queries=200):
+    """Запросы /list по индексу (project, status) на rows задачах"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = TaskStore(os.path.join(tmp, 'tasks.db'))
+        t = time.perf_counter()
+        await fill_tasks(store, rows)
+        print(f"tasks: {rows} задач записано за {time.perf_counter() - t:.1f} с")
+
+        open_statuses = [name for key, name in STATUSES.items() if key != 'done']
+        latencies = []
+        for i in range(queries):
+            project = list(PROJECTS.values())[i % len(PROJECTS)]
+            t = time.perf_counter()
+            await store.list(-100, project, open_statuses)
+            latencies.append(time.perf_counter() - t)
+        await store.close()
+
+    latencies.sort()
+    print(f"  /list проект: p50 {percentile(latencies, 50) * 1000:.2f} мс, "
+          f"p99 {percentile(latencies, 99) * 1000:.2f} мс")
+
+
+# ==================== ОТЧЕТЫ ====================
+async def bench_reports(per_day=200, days=365, runs=200, forums=2):
+    """Сборка отчетов за день/неделю/месяц из дневных счетчиков за год; отчеты форумов не смешиваются"""
+    engine = ReportEngine()
+    today = date.today()
+    kinds = ['deadline', 'question', 'done', 'idea', 'resource']
+    i = 0
+    for offset in range(days):
+        day = today - timedelta(days=offset)
+        for _ in range(per_day):
+            data = fake_deadline(i)
+            engine.record({
+                'kind': kinds[i % len(kinds)],
+                'project': data['project'],
+                'status': data['status'],
+                'title': data['task'],
+                'due_date': (day + timedelta(days=i % 20)).isoformat(),
+                'chat_id': -100 - i % forums,
+                'created_at': day.isoformat() + 'T12:00:00',
+            })
+            i += 1
+
+    print(f"reports: {i} задач за {days} дней в {forums} форумах")
+    for period in ('day', 'week', 'month'):
+        start, end = period_range(period, today)
+        t = time.perf_counter()
+        for _ in range(runs):
+            text = engine.build(-100, period, start, end, PROJECTS.values(), today)
+        print(f"  {period}: {(time.perf_counter() - t) / runs * 1000:.2f} мс на отчет, {len(text)} символов")
+
+    # Те же отчеты после перезапуска: счетчики и готовые задачи из базы, у каждого форума свои
+    with tempfile.TemporaryDirectory() as tmp:
+        store = TaskStore(os.path.join(tmp, 'tasks.db'))
+        for i in range(200):
+            data = dict(fake_deadline(i), date=today.strftime('%d.%m'))
+            for kind in ('deadline', 'done'):
+                await store.add(kind, data, chat_id=-100 - i % forums, thread_id=4, created_by=i % 40)
+        engine = ReportEngine()
+        await engine.load(store, today)
+        await store.close()
+    start, end = period_range('month', today)
+    for forum in range(forums):
+        text = engine.build(-100 - forum, 'month', start, end, PROJECTS.values(), today + timedelta(days=1))
+        numbers = {int(number) for number in re.findall(r"Задача номер (\d+)", text)}
+        created = sum(int(count) for count in re.findall(r"📅 Дедлайнов: (\d+)", text))
+        overdue = sum(int(count) for count in re.findall(r"Просрочено дедлайнов: (\d+)", text))
+        foreign = {number for number in numbers if number % forums != forum}
+        print(f"  форум {-100 - forum}: дедлайнов {created}, просрочено {overdue}, "
+              f"чужих задач в отчете {len(foreign)}")
+        assert not foreign and created == 200 // forums, "в отчет форума попали задачи другого форума"
+
+
+# ==================== НАПОМИНАНИЯ ====================
+async def bench_reminders(deadlines=100000, soon=2000, window=3.0):
+    """100k дедлайнов в куче: время перестройки, CPU за время ожидания, точность срабатывания"""
+    lateness = []
+
+    async def notify(task, stage):
+        lateness.append(time.time() - task['fire_at'])
+
+    scheduler = ReminderScheduler(notify)
+    today = date.today()
+    t = time.perf_counter()
+    scheduler.rebuild({'id': i, 'due_date': (today + timedelta(days=2 + i % 300)).isoformat(),
+                       'reminder_stage': 0} for i in range(deadlines))
+    print(f"reminders: куча из {len(scheduler.heap)} напоминаний собрана за {time.perf_counter() - t:.2f} с")
+
+    # Часть напоминаний срабатывает в ближайшие секунды
+    now = time.time()
+    for i in range(soon):
+        task = {'id': deadlines + i, 'due_date': today.isoformat(), 'reminder_stage': 2,
+                'fire_at': now + window * i / soon}
+        entry = (task['fire_at'], task['id'], 3)
+        scheduler.tasks[task['id']] = task
+        scheduler.entries[task['id']] = entry
+        heapq.heappush(scheduler.heap, entry)
+
+    scheduler.start()
+    await asyncio.sleep(window + 0.5)
+    lateness.sort()
+    print(f"  сработало {scheduler.fired} из {soon}, опоздание p50 {percentile(lateness, 50) * 1000:.1f} мс, "
+          f"p99 {percentile(lateness, 99) * 1000:.1f} мс")
+
+    # Дальше в куче только далекие сроки — планировщик должен спать
+    cpu, wall = time.process_time(), time.perf_counter()
+    await asyncio.sleep(window)
+    cpu, wall = time.process_time() - cpu, time.perf_counter() - wall
+    await scheduler.stop()
+    print(f"  CPU в простое за {wall:.1f} с: {cpu * 1000:.1f} мс ({len(scheduler.heap)} напоминаний в куче)")
+
+
+# ==================== ФОРУМЫ КОМАНД ====================
+def dict_size(mapping):
+    """Размер словаря вместе с его числами (строки-ключи общие и не считаются)"""
+    return sys.getsizeof(mapping) + sum(sys.getsizeof(value) for value in mapping.values()
+                                        if not -5 <= value <= 256)
+
+
+async def bench_tenants(forums=1000, members=20, updates=200000):
+    """1000 форумов: память на форум, первая (ленивая) загрузка и поиск форума на апдейт"""
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'tenants.db')
+        registry = TenantRegistry(path, default={})
+        for f in range(forums):
+            forum_id = -100000 - f
+            await registry.bind(forum_id, f"Team {f}")
+            for thread, chat_type in enumerate(('deadlines', 'questions', 'done', 'ideas'), 2):
+                await registry.set_topic(forum_id, chat_type, thread)
+            for m in range(members):
+                await registry.join(f * members + m + 1, forum_id)
+        await registry.close()
+
+        registry = TenantRegistry(path, default={})
+        t = time.perf_counter()
+        await registry.load()
+        index_time = time.perf_counter() - t
+        index_memory = dict_size(registry.sources) + sum(sys.getsizeof(key) for key in registry.sources)
+
+        t = time.perf_counter()
+        for f in range(forums):
+            await registry.resolve(f * members + 1)
+        lazy_time = time.perf_counter() - t
+        forums_memory = sum(dict_size(chats) for chats in registry.forums.values())
+
+        users = forums * members
+        t = time.perf_counter()
+        for i in range(updates):
+            user = i % users + 1
+            await registry.resolve(user, user)
+        route_time = time.perf_counter() - t
+        await registry.close()
+
+    print(f"tenants: {forums} форумов, {users} участников")
+    print(f"  индекс источников: загрузка {index_time * 1000:.1f} мс, "
+          f"{index_memory / len(registry.sources):.0f} байт на чат/участника")
+    print(f"  темы форумов: {forums_memory / forums:.0f} байт на форум, "
+          f"первая загрузка {lazy_time / forums * 1e6:.0f} мкс")
+    print(f"  поиск форума на апдейт: {route_time / updates * 1e6:.2f} мкс")
+
+
+# ==================== НЕСКОЛЬКО ПРОЦЕССОВ ====================
+def fake_update(i):
+    return {'update_id': i, 'message': {'message_id': i, 'date': 0, 'text': f"Задача {i}",
+                                        'chat': {'id': 1000 + i % 500, 'type': 'private'},
+                                        'from': {'id': 1000 + i % 500, 'is_bot': False, 'first_name': 'U'}}}
+
+
+def cpu_worker(index, count, conn, work=10):
+    """Воркер для бенчмарка: разбирает апдейт и строит клавиатуры, как обработчик формы"""
+    from aiogram.types import Update
+    conn.send([])
+    while True:
+        try:
+            data = conn.recv_bytes()
+        except EOFError:
+            break
+        Update.model_validate_json(data)
+        for _ in range(work):
+            build_uncached(PROJECTS, 'deadline', 'project', None)
+
+
+async def bench_sharding(updates=4000, counts=(1, 2, 4)):
+    """Пропускная способность супервизора с 1, 2, 4 воркерами на CPU-нагруженных апдейтах"""
+    print(f"sharding: {updates} апдейтов, ядер: {os.cpu_count()}")
+    payloads = [fake_update(i) for i in range(updates)]
+    for workers in counts:
+        supervisor = Supervisor(workers, target=cpu_worker)
+        supervisor.start()
+        await supervisor.wait_ready()
+        t = time.perf_counter()
+        for update in payloads:
+            supervisor.route(update)
+        routed = time.perf_counter() - t
+        await supervisor.stop()
+        elapsed = time.perf_counter() - t
+        print(f"  воркеров {workers}: {updates / elapsed:.0f} апдейтов/с, "
+              f"маршрутизация {routed / updates * 1e6:.1f} мкс на апдейт, по воркерам {supervisor.routed}")
+
+
+# ==================== МЕТРИКИ ====================
+async def bench_metrics(events=50000, handlers=30):
+    """Цена HandlerMetricsMiddleware на событие и время отрисовки /metrics"""
+    message = Message(message_id=1, date=0, chat=Chat(id=1, type='private'), text='x',
+                      from_user=User(id=1, is_bot=False, first_name='U'))
+    metrics = Metrics()
+    results = {}
+    for name, middleware in (('без метрик', None), ('с метриками', HandlerMetricsMiddleware(metrics))):
+        router = Router()
+        router.message()(noop_handler)
+        if middleware is not None:
+            router.message.middleware(middleware)
+        t = time.perf_counter()
+        for _ in range(events):
+            await router.propagate_event('message', message)
+        results[name] = (time.perf_counter() - t) / events * 1e6
+        print(f"{name}: {results[name]:.1f} мкс на событие")
+    print(f"Накладные расходы: {results['с метриками'] - results['без метрик']:.1f} мкс на событие")
+
+    histogram = Histogram()
+    t = time.perf_counter()
+    for i in range(events):
+        histogram.observe(i % 1000 / 1000)
+    print(f"Histogram.observe: {(time.perf_counter() - t) / events * 1e9:.0f} нс")
+
+    for i in range(handlers):
+        metrics.handlers[f"handler_{i}"].observe(0.01)
+        metrics.states[f"Form:step_{i}"].observe(0.01)
+        metrics.api[f"method_{i}"].observe(0.01)
+    t = time.perf_counter()
+    text = metrics.render()
+    print(f"render(): {(time.perf_counter() - t) * 1000:.2f} мс, {len(text.splitlines())} строк "
+          f"({handlers} обработчиков, состояний и методов API)")
+
+
+# ==================== ФОРМА ОДНОЙ СТРОКОЙ ====================
+QUICK_SAMPLES = {
+    'deadline': "bm 30.04 high @ivan doing Сдать макет лендинга",
+    'question': "ai low @petr Какой стек выбрать? | Бюджет ограничен",
+    'done': "bm done https://example.com/pr/1 Сдать макет | Проверить на стенде",
+    'idea': "moto medium Новый лендинг | Больше заявок",
+    'resource': "print doc Техническое задание https://example.com/spec",
+    'report': "week Все по плану",
+}
+
+
+def bench_quick(runs=20000):
+    """Разбор /команды одной строкой: время на форму и цена перестройки таблицы"""
+    parser = QuickParser()
+    for form, text in QUICK_SAMPLES.items():
+        fields = parser.parse(form, text)
+        t = time.perf_counter()
+        for _ in range(runs):
+            parser.parse(form, text)
+        print(f"{form:<9} {(time.perf_counter() - t) / runs * 1e6:5.1f} мкс, полей: {len(fields)}")
+
+    t = time.perf_counter()
+    for _ in range(1000):
+        parser._tables.clear()
+        parser.table('deadline')
+    print(f"перестройка таблицы после правки справочника: {(time.perf_counter() - t) * 1000:.1f} мкс")
+
+
+# ==================== ИМПОРТ ====================
+class SendLogBot(FakeSendBot):
+    """Запоминает время и текст каждой отправки, возвращает message_id"""
+
+    def __init__(self, latency=0.005):
+        super().__init__(latency)
+        self.sent_at = []
+        self.texts = []
+
+    async def send_message(self, chat_id, message_thread_id, text, **kwargs):
+        await super().send_message(chat_id, message_thread_id, text)
+        self.sent_at.append(time.monotonic())
+        self.texts.append(text)
+        return SimpleNamespace(message_id=self.calls)
+
+
+def import_post(kind, data):
+    return (f"📅 <b>ДЕДЛАЙН:</b> {data['date']} - {data['task']}\n{data['project']} {data['priority']} "
+            f"{data['status']}\n👤 <b>Ответственный:</b> {data['responsible']}\n📝 <b>Создано через бота</b>")
+
+
+async def bench_import(rows=10000, speedup=60, cut_after=200):
+    """/import файла на rows строк при лимите 20 сообщений в минуту на чат (время ускорено в speedup раз).
+
+    Импорт прерывается после cut_after сообщений и продолжается новым
+    Importer, как после перезапуска: каждая строка должна быть
+    опубликована ровно один раз. Пока он идет, в тот же форум пишут
+    посты форм: они не должны ждать очереди импорта.
+    """
+    limit = 20
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'plan.csv')
+        with open(path, 'w', encoding='utf-8', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['project', 'date', 'task', 'priority', 'responsible'])
+            for i in range(rows):
+                data = fake_deadline(i)
+                writer.writerow([list(PROJECTS)[i % len(PROJECTS)] if i % 500 else 'unknown', data['date'],
+                                 data['task'], list(PRIORITIES)[i % len(PRIORITIES)], data['responsible']])
+
+        store = TaskStore(os.path.join(tmp, 'tasks.db'))
+        outbox_store = OutboxStore(os.path.join(tmp, 'outbox.db'))
+        bot = SendLogBot()
+        targets = {'deadline': (-100, 4)}
+        state = await store.start_import('import:bench', 'file', 'plan.csv', 'deadline', 1, 1)
+
+        tracemalloc.start()
+        started = time.monotonic()
+        runs = []
+        waits = []
+
+        async def post_forms(outbox):
+            # Пост формы раз в 10 секунд (в пересчете на реальные лимиты) в другую тему того же форума
+            while True:
+                await asyncio.sleep(10 / speedup)
+                sent_at = time.monotonic()
+
+                async def on_sent(message, sent_at=sent_at):
+                    waits.append(time.monotonic() - sent_at)
+                await outbox.put(-100, 8, "❓ вопрос", on_sent=on_sent)
+
+        for attempt in range(2):
+            outbox = Outbox(workers=4, rate_per_minute=limit * speedup, burst=3, store=outbox_store)
+            await outbox.load()
+            outbox.start(bot)
+            importer = Importer(store, outbox, QuickParser(), import_post, chunk_chars=3500, max_pending=20)
+            run = importer.spawn(state['key'], importer.run(state, path, targets, created_by=1))
+            if attempt == 0:
+                while len(bot.texts) < cut_after:
+                    await asyncio.sleep(0.01)
+                await importer.stop()
+            else:
+                forms = asyncio.create_task(post_forms(outbox))
+                report = await run
+                forms.cancel()
+            await outbox.stop()
+            runs.append(len(bot.texts))
+            state = await store.start_import('import:bench', 'file', 'plan.csv', 'deadline', 1, 1)
+        elapsed = time.monotonic() - started
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        unposted = len(await store.unposted('import:bench'))
+        await store.close()
+        await outbox_store.close()
+
+    posted = [line for text in bot.texts for line in text.splitlines() if line.startswith('📅')]
+    window = 60 / speedup
+    busiest = max(sum(1 for t in bot.sent_at if start <= t < start + window) for start in bot.sent_at)
+    minimum = (len(bot.texts) - 3) / limit
+    print(f"import: {rows} строк, ошибок {report.errors}, добавлено {report.added}, "
+          f"прервано после {runs[0]} сообщений и продолжено")
+    print(f"  сообщений {len(bot.texts)} (по {report.added / len(bot.texts):.0f} строк), "
+          f"строк в постах {len(posted)}, уникальных {len(set(posted))}, без поста {unposted}")
+    print(f"  время {elapsed * speedup / 60:.1f} мин в пересчете на реальные лимиты "
+          f"(минимум при {limit} сообщ./мин: {minimum:.1f} мин; по посту на строку — {rows / limit:.0f} мин)")
+    print(f"  максимум за минуту: {busiest} сообщений (лимит {limit + 3} с запасом burst), "
+          f"пик памяти {peak / 1e6:.1f} МБ")
+    waits.sort()
+    print(f"  посты форм во время импорта: {len(waits)}, ожидание p50 {percentile(waits, 50) * speedup:.1f} с, "
+          f"p99 {percentile(waits, 99) * speedup:.1f} с (в пересчете на реальные лимиты)")
+
+
+# ==================== ПОИСК ====================
+SEARCH_WORDS = ("макет лендинг сайт бюджет отчет дизайн ссылка доступ сервер база договор клиент презентация "
+                "релиз тест баг оплата счет ролик баннер статья запуск интеграция api deploy review").split()
+
+
+def fake_item(i):
+    """Задача любого вида с текстом из словаря SEARCH_WORDS и уникальным словом"""
+    data = fake_deadline(i)
+    words = [SEARCH_WORDS[(i * k) % len(SEARCH_WORDS)] for k in (1, 7, 13)]
+    data['task'] = f"{' '.join(words).capitalize()} версия{i}"
+    data['link'] = f"https://example.com/doc/{i}"
+    return {'id': i + 1, 'chat_id': -100 - i % 3, 'project': data['project'], 'status': data['status'],
+            'priority': data['priority'], 'data': data}
+
+
+async def bench_search(items=100000, queries=200):
+    """/search по items задачам: время запроса и цена add() для формы"""
+    with tempfile.TemporaryDirectory() as tmp:
+        index = SearchIndex(os.path.join(tmp, 'search.db'), flush_interval=3600)
+        t = time.perf_counter()
+        rows = [fake_item(i) for i in range(items)]
+        await index._run(index._write, rows)
+        print(f"search: {items} задач проиндексировано за {time.perf_counter() - t:.1f} с")
+
+        latencies = []
+        for i in range(1000):
+            t = time.perf_counter()
+            index.add(fake_item(items + i))
+            latencies.append(time.perf_counter() - t)
+        latencies.sort()
+        t = time.perf_counter()
+        await index.flush()
+        print(f"  add() при отправке формы: p50 {percentile(latencies, 50) * 1e6:.1f} мкс, "
+              f"p99 {percentile(latencies, 99) * 1e6:.1f} мкс; запись 1000 в фоне {time.perf_counter() - t:.3f} с")
+
+        projects, statuses = list(PROJECTS.values()), list(STATUSES.values())
+        cases = {
+            'частое слово': lambda i: ('макеты', {}),
+            'два слова': lambda i: ('лендинга доступ', {}),
+            'редкое слово': lambda i: (f"версия{i * 37 % items}", {}),
+            'форум + проект + статус': lambda i: ('дизайн', {'chat_id': -100 - i % 3,
+                                                             'project': projects[i % len(projects)],
+                                                             'status': statuses[i % len(statuses)]}),
+            'нет совпадений': lambda i: ('ёлка', {}),
+        }
+        for name, case in cases.items():
+            latencies = []
+            found = 0
+            for i in range(queries):
+                text, facets = case(i)
+                t = time.perf_counter()
+                found += len(await index.search(text, **facets))
+                latencies.append(time.perf_counter() - t)
+            latencies.sort()
+            print(f"  {name:<24} p50 {percentile(latencies, 50) * 1000:.2f} мс, "
+                  f"p99 {percentile(latencies, 99) * 1000:.2f} мс, найдено в среднем {found / queries:.1f}")
+        await index.close()
+
+
+# ==================== СВОДКИ ТЕМ ====================
+class BoardBot(FakeSendBot):
+    """Считает отправки, правки и закрепления сводок"""
+
+    def __init__(self, latency=0.02):
+        super().__init__(latency)
+        self.edits = 0
+        self.pins = 0
+
+    async def send_message(self, chat_id, message_thread_id, text, **kwargs):
+        await super().send_message(chat_id, message_thread_id, text)
+        return SimpleNamespace(message_id=self.calls)
+
+    async def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        self.edits += 1
+        await asyncio.sleep(self.latency)
+
+    async def pin_chat_message(self, chat_id, message_id, **kwargs):
+        self.pins += 1
+
+
+async def bench_board(updates=50, seconds=2.0, debounce=0.5, topics=3, backlog=2000):
+    """Всплеск из updates форм за seconds секунд в topics темах: сколько вызовов API на сводки"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = TaskStore(os.path.join(tmp, 'tasks.db'))
+        # Открытые дедлайны, которые уже были в теме до всплеска
+        for i in range(backlog):
+            await store.add('deadline', fake_deadline(i), chat_id=-100, thread_id=4, created_by=1)
+        bot = BoardBot()
+        outbox = Outbox(rate_per_minute=600, burst=20)
+        board = StatusBoard(store, outbox, PROJECTS, debounce=debounce)
+        t = time.perf_counter()
+        await board.load()
+        print(f"board: {backlog} открытых задач загружено за {(time.perf_counter() - t) * 1000:.1f} мс")
+        board.start(bot)
+        await board.flush()
+        t = time.perf_counter()
+        text = board.render((-100, 4))
+        print(f"  перерисовка темы: {(time.perf_counter() - t) * 1000:.2f} мс, {len(text)} символов")
+        bot.calls = bot.edits = bot.pins = 0
+
+        added = []
+        for i in range(updates):
+            data = fake_deadline(backlog + i)
+            task = await store.add('deadline', data, chat_id=-100, thread_id=4 + i % topics, created_by=1)
+            board.track(task)
+            added.append(task)
+            await asyncio.sleep(seconds / updates)
+        await asyncio.sleep(debounce * 2)
+        # Повторные обновления без изменений (например, та же задача еще раз) — только перерисовка
+        for task in added:
+            board.track(task)
+        await asyncio.sleep(debounce * 2)
+        await board.stop()
+        await store.close()
+
+    calls = bot.calls + bot.edits
+    print(f"  {updates} форм за {seconds:g} с + {updates} повторов: новых сводок {bot.calls}, правок {bot.edits}, "
+          f"закреплений {bot.pins} (правка на каждое обновление — {updates * 2})")
+    print(f"  перерисовок {board.renders}, пропущено без изменений {board.skipped}, вызовов API {calls + bot.pins}")
+
+
+# ==================== СМЕНА СТАТУСА ====================
+async def bench_deadlines(rows=100000, queries=1000, forums=10):
+    """Выбор открытого дедлайна для /done и /status: индекс в памяти против запроса к базе"""
+    with tempfile.TemporaryDirectory() as tmp:
+        store = TaskStore(os.path.join(tmp, 'tasks.db'))
+        batch = []
+        for i in range(rows):
+            data = fake_deadline(i)
+            data['task'] = fake_item(i)['data']['task']
+            batch.append(new_task('deadline', data, chat_id=-100 - i % forums, thread_id=4, created_by=i % 40))
+        await store._run(store._insert_batch, batch, None, 0, 0)
+        index = DeadlineIndex()
+        t = time.perf_counter()
+        await index.load(store)
+        print(f"deadlines: {len(index)} открытых из {rows} в {forums} форумах, "
+              f"индекс загружен за {(time.perf_counter() - t) * 1000:.0f} мс")
+        projects = list(PROJECTS.values())
+        t = time.perf_counter()
+        for forum in range(forums):
+            index.matching(-100 - forum, 'макет')
+        print(f"  основы слов названий собраны при первом поиске по словам: "
+              f"{(time.perf_counter() - t) / forums * 1000:.0f} мс на форум")
+
+        cases = {
+            'проект': lambda i: {'project': projects[i % len(projects)]},
+            'ответственный': lambda i: {'responsible': f"@user{i % 40}"},
+            'проект + слово': lambda i: {'project': projects[i % len(projects)], 'text': 'макеты'},
+            'редкое слово': lambda i: {'text': f"версия{i * 37 % rows}"},
+        }
+        for name, case in cases.items():
+            latencies = []
+            for i in range(queries):
+                t = time.perf_counter()
+                index.find(-100 - i % forums, limit=8, **case(i))
+                latencies.append(time.perf_counter() - t)
+            latencies.sort()
+            print(f"  {name:<16} p50 {percentile(latencies, 50) * 1e6:.0f} мкс, p99 {percentile(latencies, 99) * 1e6:.0f} мкс")
+
+        open_statuses = [name for key, name in STATUSES.items() if key != 'done']
+        latencies = []
+        for i in range(200):
+            t = time.perf_counter()
+            await store.list(-100 - i % forums, projects[i % len(projects)], open_statuses)
+            latencies.append(time.perf_counter() - t)
+        latencies.sort()
+        print(f"  для сравнения /list из базы: p50 {percentile(latencies, 50) * 1e6:.0f} мкс")
+
+        t = time.perf_counter()
+        for task in batch[:queries]:
+            index.track(dict(task, status=STATUSES['done']))
+        print(f"  закрытие дедлайна в индексе: {(time.perf_counter() - t) / queries * 1e6:.1f} мкс, "
+              f"открытых осталось {len(index)}")
+        await store.close()
+
+
+FIRST_NAMES = ('Иван', 'Петр', 'Мария', 'Анна', 'Сергей', 'Ольга', 'Алексей', 'Елена', 'Дмитрий', 'Наталья',
+               'Alex', 'Maria', 'John', 'Kate', 'Denis', 'Pavel')
+LAST_NAMES = ('Иванов', 'Петров', 'Смирнов', 'Кузнецов', 'Попов', 'Соколов', 'Лебедев', 'Козлов', 'Новиков',
+              'Морозов', 'Smith', 'Brown', 'Volkov', 'Orlov')
+
+
+async def bench_people(members=5000, queries=2000, forums=3):
+    """Подсказки участника по первым буквам: members человек в каждом из forums форумов"""
+    with tempfile.TemporaryDirectory() as tmp:
+        directory = PeopleDirectory(os.path.join(tmp, 'people.db'))
+        users = [User(id=i + 1, is_bot=False, first_name=FIRST_NAMES[i % len(FIRST_NAMES)],
+                      last_name=f"{LAST_NAMES[i // len(FIRST_NAMES) % len(LAST_NAMES)]}{i // 224 or ''}",
+                      username=f"user{i}" if i % 3 else None)
+                 for i in range(members)]
+        t = time.perf_counter()
+        for forum in range(forums):
+            for user in users:
+                directory.see(-100 - forum, user)
+        added = time.perf_counter() - t
+        t = time.perf_counter()
+        for user in users:
+            directory.see(-100, user)
+        repeated = time.perf_counter() - t
+        print(f"people: {len(directory)} записей ({members} в {forums} форумах)")
+        print(f"  новый участник: {added / (members * forums) * 1e6:.1f} мкс, "
+              f"повторное сообщение: {repeated / members * 1e6:.2f} мкс")
+
+        prefixes = [name[:size] for name in FIRST_NAMES + LAST_NAMES + ('@user1', 'иван_', 'ivan p') for size in (1, 2, 4)]
+        for size in (1, 2, 4):
+            latencies = []
+            for i in range(queries):
+                prefix = prefixes[i % len(prefixes)][:size]
+                t = time.perf_counter()
+                directory.suggest(-100 - i % forums, prefix, limit=8)
+                latencies.append(time.perf_counter() - t)
+            latencies.sort()
+            print(f"  первые {size} букв: p50 {percentile(latencies, 50) * 1e6:.0f} мкс, "
+                  f"p99 {percentile(latencies, 99) * 1e6:.0f} мкс")
+
+        t = time.perf_counter()
+        await directory.flush()
+        flushed = time.perf_counter() - t
+        await directory.close()
+        restored = PeopleDirectory(directory.path)
+        t = time.perf_counter()
+        await restored.load()
+        print(f"  запись в базу: {flushed * 1000:.0f} мс, загрузка после рестарта: "
+              f"{(time.perf_counter() - t) * 1000:.0f} мс, участников {len(restored)}")
+        await restored.close()
+
+
+# ==================== ЗАЩИТА ОТ ФЛУДА ====================
+class NullSession(BaseSession):
+    """Сессия бота, которая ничего не отправляет: любой вызов API сразу успешен"""
+
+    async def make_request(self, bot, method, timeout=None):
+        return True
+
+    async def stream_content(self, *args, **kwargs):
+        yield b''
+
+    async def close(self):
+        pass
+
+
+def busy(seconds):
+    """Работа обработчика на CPU: цикл событий занят, как при разборе формы и шаблонах"""
+    until = time.perf_counter() + seconds
+    while time.perf_counter() < until:
+        pass
+
+
+async def bench_flood(seconds=3.0, users=50, user_rate=1.0, flooders=3, flood_rate=500, work=0.001):
+    """Флудеры (команды и одна кнопка без остановки) рядом с обычными пользователями: p99 обычных"""
+    bot = Bot('123:FAKE', session=NullSession())
+    print(f"flood: {users} пользователей по {user_rate:g} апд./с, обработчик {work * 1000:g} мс CPU; "
+          f"флудеры по {flood_rate} апд./с")
+    for name, spammers, control in (('без флудеров', 0, True), (f'{flooders} флудера без защиты', flooders, False),
+                                    (f'{flooders} флудера с защитой', flooders, True)):
+        dp = Dispatcher()
+        flood = FloodControl()
+        if control:
+            dp.update.outer_middleware(flood)
+        sent_at = {}
+        latencies = []
+        handled = {'flood': 0}
+
+        async def on_update(event):
+            busy(work)
+            started = sent_at.pop(event.from_user.id * 1000000 + (event.message_id if isinstance(event, Message)
+                                                                    else int(event.id)), None)
+            if started is None:
+                handled['flood'] += 1
+            else:
+                latencies.append(time.perf_counter() - started)
+
+        dp.message()(on_update)
+        dp.callback_query()(on_update)
+        ids = iter(range(1, 10 ** 9))
+        flood_sent = 0
+        tasks = set()
+
+        def feed(user_id, press, measured):
+            update_id = next(ids)
+            user = User(id=user_id, is_bot=False, first_name='U')
+            chat = Chat(id=user_id, type='private')
+            if press:
+                update = Update(update_id=update_id, callback_query=CallbackQuery(
+                    id=str(update_id), from_user=user, chat_instance='flood', data='f:deadline:project:bm',
+                    message=Message(message_id=1, date=0, chat=chat, text='…')))
+            else:
+                update = Update(update_id=update_id, message=Message(message_id=update_id, date=0, chat=chat,
+                                                                     from_user=user, text='/deadline'))
+            if measured:
+                sent_at[user_id * 1000000 + update_id] = time.perf_counter()
+            task = asyncio.create_task(dp.feed_update(bot, update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        started = time.perf_counter()
+        tick = 0.01
+        due_users = [i / users / user_rate for i in range(users)]
+        while time.perf_counter() - started < seconds:
+            elapsed = time.perf_counter() - started
+            for i in range(users):
+                if due_users[i] <= elapsed:
+                    due_users[i] += 1 / user_rate
+                    feed(1000 + i, False, True)
+            # Апдейты приходят по часам, а не по мере обработки: отставший бот копит очередь
+            for n in range(flood_sent // max(1, spammers), int(elapsed * flood_rate)):
+                for i in range(spammers):
+                    feed(1 + i, n % 2 == 1, False)
+                    flood_sent += 1
+            await asyncio.sleep(tick)
+        while tasks:
+            await asyncio.gather(*tasks)
+        latencies.sort()
+        print(f"  {name:<24} p50 {percentile(latencies, 50) * 1000:6.1f} мс, p99 {percentile(latencies, 99) * 1000:7.1f} мс "
+              f"({len(latencies)} апдейтов); флуд: прислано {flood_sent}, дошло до обработчиков {handled['flood']}")
+        if control and spammers:
+            print(f"  {'':<24} {flood.stats()}")
+    await bot.session.close()
+
+
+async def bench_scheduler(users=500, steps=10, io=0.02, concurrency=40):
+    """Апдейты пользователей с ожиданием API: пропускная способность и нарушения порядка внутри пользователя"""
+    import random
+    print(f"scheduler: {users} пользователей по {steps} апдейтов подряд, обработчик ждет API до {io * 1000:g} мс")
+    updates = [SimpleNamespace(update_id=step * users + user, user=user, step=step)
+               for step in range(steps) for user in range(users)]
+
+    for name, limit in (('задача на апдейт', None), ('по одному', 1), (f'планировщик по {concurrency}', concurrency)):
+        last = {}
+        violations = 0
+        in_flight = peak = 0
+
+        async def handle(update):
+            nonlocal violations, in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            # Как FSM: прочитали состояние, подождали API, записали следующее
+            seen = last.get(update.user, -1)
+            await asyncio.sleep(random.random() * io)
+            if seen != update.step - 1:
+                violations += 1
+            last[update.user] = update.step
+            in_flight -= 1
+
+        started = time.perf_counter()
+        if limit is None:
+            await asyncio.gather(*(asyncio.create_task(handle(update)) for update in updates))
+            queues = 0
+        else:
+            scheduler = UpdateScheduler(handle, limit, max_pending=len(updates), max_queue=steps,
+                                        key=lambda update: update.user)
+            for update in updates:
+                await scheduler.submit(update)
+            await scheduler.join()
+            queues = len(scheduler.queues)
+        elapsed = time.perf_counter() - started
+        print(f"  {name:<22} {len(updates) / elapsed:8.0f} апд./с, одновременно до {peak:5}, "
+              f"нарушений порядка {violations:5}, очередей осталось {queues}")
+
+
+BENCHMARKS = {
+    'outbox': bench_outbox,
+    'digest': bench_digest,
+    'retry': bench_retry,
+    'storage': bench_storage,
+    'fsm_soak': bench_fsm_soak,
+    'callbacks': bench_callbacks,
+    'keyboards': bench_keyboards,
+    'tasks': bench_tasks,
+    'reports': bench_reports,
+    'reminders': bench_reminders,
+    'tenants': bench_tenants,
+    'sharding': bench_sharding,
+    'metrics': bench_metrics,
+    'quick': bench_quick,
+    'import': bench_import,
+    'search': bench_search,
+    'board': bench_board,
+    'deadlines': bench_deadlines,
+    'people': bench_people,
+    'flood': bench_flood,
+    'scheduler': bench_scheduler,
+}
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print("Доступные бенчмарки: " + ", ".join(BENCHMARKS))
+        sys.exit(1)
+    result = BENCHMARKS[sys.argv[1]]()
+    if asyncio.iscoroutine(result):
+        asyncio.run(result)
@@ -0,0 +1,235 @@
+import asyncio
+import logging
+from datetime import date
+
+from aiogram.exceptions import TelegramBadRequest
+
+from config import STATUSES
+from reports import short
+from wizard import content_hash
+
+logger = logging.getLogger(__name__)
+
+# Виды задач, у тем которых есть сводка, и ее заголовок
+BOARD_TITLES = {
+    'deadline': "📌 <b>ОТКРЫТЫЕ ДЕДЛАЙНЫ</b>",
+    'done': "📌 <b>ЖДУТ ПРОВЕРКИ</b>",
+}
+# Сколько задач одной группы (проект + статус) перечислять
+GROUP_LIMIT = 10
+# Что из задачи нужно сводке (остальное в памяти не держим)
+ITEM_FIELDS = ('id', 'kind', 'project', 'status', 'title', 'due_date', 'responsible', 'chat_id', 'thread_id')
+
+
+def board_line(item):
+    """Строка задачи в сводке: заголовок, срок и ответственный, если есть"""
+    line = f"• {short(item['title'])}"
+    if item['due_date']:
+        line += f" — до {date.fromisoformat(item['due_date']):%d.%m}"
+    if item['responsible'] and item['responsible'].startswith('@'):
+        line += f" {item['responsible']}"
+    return line
+
+
+class StatusBoard:
+    """Закрепленная сводка открытых задач в каждой теме с формами.
+
+    В памяти лежат только открытые задачи (статус не "готово") по темам.
+    track(task) обновляет тему и помечает ее измененной; раз в debounce
+    секунд измененные темы перерисовываются, и текст сравнивается по
+    хэшу с уже показанным: правка (editMessageText) уходит, только если
+    сводка действительно изменилась. Поэтому всплеск из десятков форм —
+    одна-две правки, а не по одной на форму. Первая сводка темы
+    отправляется и закрепляется; message_id и хэш хранятся в TaskStore.
+    Запросы к API идут через ведра очереди отправки (лимит чата общий).
+
+    С несколькими воркерами сводки форума ведет один (owns), а задачи,
+    пришедшие через другие воркеры, он подхватывает, перечитывая
+    хранилище раз в refresh_interval секунд.
+    """
+
+    def __init__(self, tasks, outbox, projects, statuses=STATUSES, titles=BOARD_TITLES, debounce=3.0,
+                 max_chars=3800, owns=None, refresh_interval=0):
+        self.tasks = tasks
+        self.outbox = outbox
+        self.projects = projects
+        self.statuses = statuses
+        self.titles = titles
+        self.debounce = debounce
+        self.max_chars = max_chars
+        self.owns = owns  # owns(chat_id) — этот процесс ведет сводки форума (для нескольких воркеров)
+        self.refresh_interval = refresh_interval
+        self.bot = None
+        self.items = {}     # (chat_id, thread_id) -> {task_id: задача}
+        self.kinds = {}     # (chat_id, thread_id) -> вид задач темы
+        self.messages = {}  # (chat_id, thread_id) -> [message_id, хэш текста]
+        self._refresher = None
+        self._dirty = set()
+        self._flush_handle = None
+        self._flushing = None
+        self.renders = 0
+        self.edited = 0
+        self.sent = 0
+        self.skipped = 0
+
+    async def load(self):
+        """Открытые задачи и уже опубликованные сводки из хранилища (повторный вызов — перечитывает)"""
+        items = {}
+        for task in await self.tasks.open_items(tuple(self.titles)):
+            if self.owns is None or self.owns(task['chat_id']):
+                key = (task['chat_id'], task['thread_id'])
+                items.setdefault(key, {})[task['id']] = task
+                self.kinds[key] = task['kind']
+        for chat_id, thread_id, kind, message_id, text_hash in await self.tasks.boards():
+            self.messages[(chat_id, thread_id)] = [message_id, text_hash]
+            self.kinds.setdefault((chat_id, thread_id), kind)
+        # Сводки могли устареть, пока бот был выключен: сверяем все, хэш отсеет неизменившиеся
+        self._dirty.update(set(items) | set(self.items))
+        self._dirty.update(key for key in self.messages if self.owns is None or self.owns(key[0]))
+        self.items = items
+        logger.info(f"📌 Сводок тем: {len(self.messages)}, открытых задач в них: "
+                    f"{sum(map(len, items.values()))}")
+
+    def start(self, bot):
+        """Начинает публиковать сводки (в том числе изменившиеся, пока бот был выключен)"""
+        self.bot = bot
+        if self._dirty:
+            self._schedule()
+        if self.refresh_interval:
+            self._refresher = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._refresher is not None:
+            self._refresher.cancel()
+            await asyncio.gather(self._refresher, return_exceptions=True)
+            self._refresher = None
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        await self.flush()
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.refresh_interval)
+            try:
+                await self.load()
+                self._schedule()
+            except Exception as e:
+                logger.error(f"Ошибка перечитывания сводок: {e}")
+
+    # ==================== ИЗМЕНЕНИЯ ====================
+    def track(self, task):
+        """Новая задача или новый статус задачи: сводка ее темы перерисуется"""
+        if task['kind'] not in self.titles or not task['thread_id']:
+            return
+        if self.owns is not None and not self.owns(task['chat_id']):
+            return
+        key = (task['chat_id'], task['thread_id'])
+        items = self.items.setdefault(key, {})
+        if task['status'] == self.statuses['done']:
+            if items.pop(task['id'], None) is None:
+                return
+        else:
+            items[task['id']] = {field: task[field] for field in ITEM_FIELDS}
+        self.kinds[key] = task['kind']
+        self._dirty.add(key)
+        if self.bot is not None:
+            self._schedule()
+
+    def _schedule(self):
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.debounce, self._schedule_flush)
+
+    def _schedule_flush(self):
+        self._flush_handle = None
+        asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        """Перерисовывает измененные темы"""
+        if self._flushing is not None:
+            await self._flushing
+        if not self._dirty or self.bot is None:
+            return
+
+        dirty, self._dirty = self._dirty, set()
+        self._flushing = asyncio.gather(*(self._show(key) for key in dirty))
+        try:
+            await self._flushing
+        finally:
+            self._flushing = None
+
+    # ==================== ПУБЛИКАЦИЯ ====================
+    def render(self, key):
+        """Текст сводки темы: открытые задачи по проектам и статусам"""
+        items = self.items.get(key, {})
+        lines = [f"{self.titles.get(self.kinds.get(key), '📌 <b>СВОДКА</b>')} ({len(items)})"]
+        if not items:
+            lines.append("\nОткрытых задач нет ✨")
+            return '\n'.join(lines)
+
+        projects = {name: i for i, name in enumerate(self.projects.values())}
+        statuses = {name: i for i, name in enumerate(self.statuses.values())}
+        groups = {}
+        for task in items.values():
+            groups.setdefault(task['project'], {}).setdefault(task['status'], []).append(task)
+
+        size = len(lines[0])
+        shown = 0
+        for project in sorted(groups, key=lambda name: (projects.get(name, len(projects)), name or '')):
+            block = ["", f"<b>{project}</b>"]
+            for status in sorted(groups[project], key=lambda name: (statuses.get(name, len(statuses)), name or '')):
+                group = sorted(groups[project][status], key=lambda task: (task['due_date'] or '9999', task['id']))
+                block.append(f"{status} ({len(group)}):")
+                block.extend(board_line(task) for task in group[:GROUP_LIMIT])
+                if len(group) > GROUP_LIMIT:
+                    block.append(f"  … и еще {len(group) - GROUP_LIMIT}")
+            block_size = sum(len(line) + 1 for line in block)
+            if size + block_size > self.max_chars:
+                lines.append(f"\n… не поместилось проектов: {len(groups) - shown}")
+                break
+            lines.extend(block)
+            size += block_size
+            shown += 1
+        return '\n'.join(lines)
+
+    async def _show(self, key):
+        chat_id, thread_id = key
+        text = self.render(key)
+        text_hash = content_hash(text)
+        self.renders += 1
+        entry = self.messages.get(key)
+        if entry is not None and entry[1] == text_hash:
+            self.skipped += 1
+            return
+        if entry is None and not self.items.get(key):
+            return
+
+        try:
+            await self.outbox.bucket(chat_id).acquire()
+            await self.outbox.global_bucket.acquire()
+            message_id = entry[0] if entry is not None else None
+            if message_id is not None:
+                try:
+                    await self.bot.edit_message_text(text, chat_id=chat_id, message_id=message_id)
+                    self.edited += 1
+                except TelegramBadRequest as e:
+                    if 'not modified' not in str(e):
+                        # Сводку удалили или ее уже нельзя править — публикуем заново
+                        logger.warning(f"Сводку темы {thread_id} не обновить, отправляем новую: {e}")
+                        message_id = None
+            if message_id is None:
+                message = await self.bot.send_message(chat_id=chat_id, message_thread_id=thread_id, text=text)
+                message_id = message.message_id
+                self.sent += 1
+                try:
+                    await self.bot.pin_chat_message(chat_id=chat_id, message_id=message_id,
+                                                    disable_notification=True)
+                except TelegramBadRequest as e:
+                    logger.warning(f"Сводку темы {thread_id} не закрепить (нет права закреплять?): {e}")
+        except Exception as e:
+            logger.error(f"Ошибка обновления сводки темы {thread_id}: {e}")
+            return
+
+        self.messages[key] = [message_id, text_hash]
+        await self.tasks.set_board(chat_id, thread_id, self.kinds.get(key), message_id, text_hash)
@@ -1,22 +1,129 @@
+import argparse
 import asyncio
+import json
 import logging
-from datetime import datetime
-from aiogram import Bot, Dispatcher, types
+import os
+import tempfile
+import time
+from contextlib import suppress
+from datetime import date, datetime
+from functools import partial
+from aiogram import Bot, Dispatcher, F, types
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
 from aiogram.filters import Command
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, ReplyKeyboardMarkup, KeyboardButton
-from config import BOT_TOKEN, ADMIN_ID, CHATS, PROJECTS, STATUSES, PRIORITIES, RESOURCE_TYPES, save_chats, load_chats
+from config import BOT_TOKEN, BOT_API_URL, ADMIN_ID, CHATS, COALESCE, PROJECTS, STATUSES, PRIORITIES, RESOURCE_TYPES, Catalog, CONFIG_WATCH_INTERVAL, ConfigWatcher, apply_chats, save_chats_async
+from config import OUTBOX_WORKERS, OUTBOX_RATE_PER_MINUTE, OUTBOX_BURST, OUTBOX_GLOBAL_RATE, FSM_STORAGE_FILE, TASKS_DB_FILE, REMINDER_HOUR
+from config import OUTBOX_DB_FILE, OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_RATE
+from config import FSM_TTL, FSM_MAX_DIALOGS, FSM_MAX_BYTES, FSM_EXPIRE_NOTICE, FORM_WIZARD
+from config import FLOOD_USER_RATE, FLOOD_USER_BURST, FLOOD_CHAT_RATE, FLOOD_CHAT_BURST, FLOOD_MAX_DELAY
+from config import BOARD_DEBOUNCE, BOARD_REFRESH_INTERVAL
+from config import SEARCH_DB_FILE, IMPORT_CHUNK_CHARS, IMPORT_MAX_PENDING, IMPORT_PROGRESS_INTERVAL, IMPORT_MAX_BYTES
+from config import PEOPLE_DB_FILE, TENANTS_DB_FILE, BOT_WORKERS, SHARD_INDEX, SHARD_COUNT, METRICS_HOST, METRICS_PORT
+from config import BOT_MODE, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET, WEBHOOK_MAX_CONCURRENCY
+from config import UPDATE_CONCURRENCY, UPDATE_MAX_PENDING, UPDATE_USER_QUEUE
+from outbox import Outbox
+from outbox_store import OutboxStore
+from callbacks import CallbackRouter, FormCallback, PREFIX as CALLBACK_PREFIX, unpack
+from keyboards import KeyboardRegistry
+from sqlite_storage import SQLiteStorage
+from webhook import run_webhook
+from task_store import TaskStore, parse_due_date
+from reminders import ReminderScheduler, TOMORROW, TODAY, OVERDUE
+from reports import ReportEngine, period_range, parse_period, short
+from tenants import TenantRegistry, empty_chats
+from sharding import run_supervisor, shard_of
+from scheduler import UpdateScheduler, run_polling
+from quick import QuickParser
+from importer import Importer, IMPORT_FIELDS
+from search import SearchIndex
+from wizard import Wizard, WIZARD_KEY
+from board import StatusBoard
+from deadlines import DeadlineIndex
+from flood import FloodControl
+from people import PeopleDirectory, PeopleMiddleware, name_key, person_handle
+from metrics import Metrics, HandlerMetricsMiddleware, ApiMetricsMiddleware, serve_metrics
 
 # ==================== НАСТРОЙКА ЛОГИРОВАНИЯ ====================
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 # ==================== ИНИЦИАЛИЗАЦИЯ БОТА ====================
-bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
+api_session = AiohttpSession(api=TelegramAPIServer.from_base(BOT_API_URL)) if BOT_API_URL else None
+bot = Bot(token=BOT_TOKEN, session=api_session)
+# Файл FSM общий для воркеров: каждый загружает, убирает и вытесняет только диалоги своих пользователей
+storage = SQLiteStorage(FSM_STORAGE_FILE, ttl=FSM_TTL, max_entries=FSM_MAX_DIALOGS, max_bytes=FSM_MAX_BYTES,
+                        owns=(lambda key: shard_of(key.user_id, SHARD_COUNT) == SHARD_INDEX) if SHARD_COUNT > 1 else None)
 dp = Dispatcher(storage=storage)
+# Разные пользователи — параллельно, апдейты одного — строго по порядку
+scheduler = UpdateScheduler(partial(dp.feed_update, bot), UPDATE_CONCURRENCY, max_pending=UPDATE_MAX_PENDING,
+                            max_queue=UPDATE_USER_QUEUE)
+# В режиме нескольких процессов лимиты Telegram делятся между воркерами поровну
+outbox = Outbox(workers=OUTBOX_WORKERS, rate_per_minute=OUTBOX_RATE_PER_MINUTE / SHARD_COUNT,
+                burst=max(1, OUTBOX_BURST // SHARD_COUNT), global_rate=OUTBOX_GLOBAL_RATE / SHARD_COUNT,
+                store=OutboxStore(OUTBOX_DB_FILE, shard=SHARD_INDEX, shards=SHARD_COUNT),
+                max_attempts=OUTBOX_MAX_ATTEMPTS, retry_rate=OUTBOX_RETRY_RATE / SHARD_COUNT)
+callbacks = CallbackRouter()
+keyboards = KeyboardRegistry()
+quick = QuickParser()
+wizard = Wizard(FORM_WIZARD)
+tasks = TaskStore(TASKS_DB_FILE)
+search = SearchIndex(SEARCH_DB_FILE)
+# Сводки форума ведет один воркер, остальные подхватываются перечитыванием хранилища
+board = StatusBoard(tasks, outbox, PROJECTS, debounce=BOARD_DEBOUNCE,
+                    owns=(lambda chat_id: shard_of(chat_id, SHARD_COUNT) == SHARD_INDEX) if SHARD_COUNT > 1 else None,
+                    refresh_interval=BOARD_REFRESH_INTERVAL if SHARD_COUNT > 1 else 0)
+deadlines = DeadlineIndex()
+people = PeopleDirectory(PEOPLE_DB_FILE)
+reports = ReportEngine()
+tenants = TenantRegistry(TENANTS_DB_FILE, default=CHATS)
+config_watcher = ConfigWatcher(CONFIG_WATCH_INTERVAL)
+# Флуд отсекается до обработчиков; лимит группы делится между воркерами, как и лимиты отправки
+flood = FloodControl(FLOOD_USER_RATE, FLOOD_USER_BURST, FLOOD_CHAT_RATE / SHARD_COUNT,
+                     max(1, FLOOD_CHAT_BURST // SHARD_COUNT), max_delay=FLOOD_MAX_DELAY)
+if FLOOD_USER_RATE:
+    dp.update.outer_middleware(flood)
+# Отправители сообщений в группах — в справочник участников (и без подходящего обработчика)
+dp.message.outer_middleware(PeopleMiddleware(people))
+
+# ==================== МЕТРИКИ ====================
+metrics = Metrics()
+metrics_runner = None
+dp.message.middleware(HandlerMetricsMiddleware(metrics))
+
+def callback_label(callback, data):
+    """Кнопки всех форм идут через form_callback — в метриках пишем настоящий обработчик"""
+    try:
+        form, field, _ = unpack(callback.data or '')
+    except ValueError:
+        return None
+    entry = callbacks.resolve(form, field)
+    return entry[0].__name__ if entry else None
+
+dp.callback_query.middleware(HandlerMetricsMiddleware(metrics, label=callback_label))
+bot.session.middleware(ApiMetricsMiddleware(metrics))
+metrics.gauge('bot_outbox_depth', "Сообщений в очереди отправки", lambda: outbox.queue.qsize())
+metrics.gauge('bot_outbox_bulk_depth', "Сообщений импорта в очереди отправки", lambda: outbox.bulk.qsize())
+metrics.gauge('bot_outbox_sent_total', "Отправлено из очереди", lambda: outbox.sent, kind='counter')
+metrics.gauge('bot_outbox_failed_total', "Не удалось отправить из очереди", lambda: outbox.failed, kind='counter')
+metrics.gauge('bot_outbox_retried_total', "Отложено на повтор после ошибки", lambda: outbox.retried, kind='counter')
+metrics.gauge('bot_outbox_pending_retries', "Сообщений ждет повтора", lambda: len(outbox.retries))
+metrics.gauge('bot_flood_dropped_total', "Апдейтов отброшено защитой от флуда", lambda: flood.dropped, kind='counter')
+metrics.gauge('bot_flood_deferred_total', "Апдейтов отложено до появления токена", lambda: flood.deferred,
+              kind='counter')
+metrics.gauge('bot_flood_duplicates_total', "Повторных нажатий кнопок", lambda: flood.duplicates, kind='counter')
+metrics.gauge('bot_updates_running', "Апдейтов в обработке", lambda: scheduler.running)
+metrics.gauge('bot_updates_pending', "Апдейтов принято и не обработано", lambda: scheduler.pending)
+metrics.gauge('bot_updates_queues', "Пользователей с апдейтами в очереди", lambda: len(scheduler.queues))
+metrics.gauge('bot_updates_overflow_total', "Апдейтов отброшено из-за переполненной очереди пользователя",
+              lambda: scheduler.overflow, kind='counter')
+metrics.gauge('bot_fsm_active', "Диалогов посреди формы", storage.active)
+metrics.gauge('bot_fsm_expired_total', "Черновиков удалено по TTL", lambda: storage.expired, kind='counter')
+metrics.gauge('bot_fsm_evicted_total', "Черновиков вытеснено сверх предела", lambda: storage.evicted, kind='counter')
 
 # ==================== СОСТОЯНИЯ (FSM) ====================
 class DeadlineForm(StatesGroup):
@@ -55,67 +162,184 @@ class ResourceForm(StatesGroup):
 
 class ReportForm(StatesGroup):
     period = State()
-    projects = State()
-    completed = State()
-    problems = State()
-    plans = State()
+    comment = State()
+
+class StatusForm(StatesGroup):
+    task = State()
+    status = State()
 
 # ==================== КЛАВИАТУРЫ ====================
-def create_keyboard(items_dict, prefix="item"):
-    """Создает клавиатуру из словаря"""
-    buttons = []
-    for key, value in items_dict.items():
-        buttons.append(InlineKeyboardButton(text=value, callback_data=f"{prefix}_{key}"))
-    
-    # Разбиваем по 2 кнопки в ряд
-    rows = []
-    for i in range(0, len(buttons), 2):
-        rows.append(buttons[i:i+2])
-    
-    return InlineKeyboardMarkup(inline_keyboard=rows)
+def create_keyboard(items_dict, form, field, keys=None):
+    """Создает (или берет из кэша) клавиатуру из словаря: кнопки поля field формы form"""
+    return keyboards.get(items_dict, form, field, keys)
+
+def projects_keyboard(form):
+    return create_keyboard(PROJECTS, form, 'project')
 
-def projects_keyboard(prefix="proj"):
-    return create_keyboard(PROJECTS, prefix)
+def priorities_keyboard(form):
+    return create_keyboard(PRIORITIES, form, 'priority')
 
-def priorities_keyboard(prefix="prio"):
-    return create_keyboard(PRIORITIES, prefix)
+def statuses_keyboard(form):
+    return create_keyboard(STATUSES, form, 'status')
 
-def statuses_keyboard(prefix="stat"):
-    return create_keyboard(STATUSES, prefix)
+def resource_types_keyboard(form):
+    return create_keyboard(RESOURCE_TYPES, form, 'resource_type')
 
-def resource_types_keyboard(prefix="res"):
-    return create_keyboard(RESOURCE_TYPES, prefix)
+REPORT_PERIODS = Catalog({
+    'day': "📅 За день",
+    'week': "📅 За неделю",
+    'month': "📅 За месяц",
+    'custom': "📅 Другой период"
+})
 
 def period_keyboard():
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="📅 За день", callback_data="period_day"),
-            InlineKeyboardButton(text="📅 За неделю", callback_data="period_week")
-        ],
-        [
-            InlineKeyboardButton(text="📅 За месяц", callback_data="period_month"),
-            InlineKeyboardButton(text="📅 Другой период", callback_data="period_custom")
-        ]
-    ])
-    return keyboard
+    return create_keyboard(REPORT_PERIODS, 'report', 'period')
+
+# Сколько открытых дедлайнов показывать кнопками за раз
+PICK_LIMIT = 8
+
+def deadlines_keyboard(items, form, other=None):
+    """Кнопки выбора открытого дедлайна (по одной в ряд); other — текст кнопки «ни один из них»"""
+    rows = []
+    for item in items:
+        text = short(item['title'], 40)
+        if item['due_date']:
+            text += f" · {date.fromisoformat(item['due_date']):%d.%m}"
+        callback_data = FormCallback(form=form, field='deadline', value=str(item['id'])).pack()
+        rows.append([InlineKeyboardButton(text=text, callback_data=callback_data)])
+    if other:
+        rows.append([InlineKeyboardButton(text=other,
+                                          callback_data=FormCallback(form=form, field='deadline', value='0').pack())])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+def people_keyboard(found, form, field):
+    """Кнопки выбора участника форума (по одному в ряд) и «оставить как написано»"""
+    rows = []
+    for person in found:
+        text = person['full_name']
+        if person['username']:
+            text += f" (@{person['username']})"
+        callback_data = FormCallback(form=form, field=field, value=str(person['user_id'])).pack()
+        rows.append([InlineKeyboardButton(text=text, callback_data=callback_data)])
+    rows.append([InlineKeyboardButton(text="✍️ Оставить как написано",
+                                      callback_data=FormCallback(form=form, field=field, value='0').pack())])
+    return InlineKeyboardMarkup(inline_keyboard=rows)
 
 # ==================== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ====================
-def send_to_topic(chat_type, text):
-    """Отправляет сообщение в указанную тему"""
-    thread_id = CHATS[chat_type]
-    if thread_id == 0:
+async def tenant_chats(event):
+    """Настройки форума команды, откуда пришло сообщение или нажатие (CHATS — основной форум)"""
+    return await tenants.resolve(event_message(event).chat.id, event.from_user.id)
+
+def topic_target(chat_type, chats=CHATS):
+    """(chat_id, thread_id) темы, прочитанные из настроек за один шаг; None, если тема не настроена"""
+    thread_id = chats[chat_type]
+    return (chats['chat_id'], thread_id) if thread_id else None
+
+async def send_to_topic(chat_type, text, on_sent=None, urgent=False, target=None, chats=CHATS, key=None, group=None):
+    """Ставит сообщение в очередь отправки в указанную тему (urgent — без склейки, key — ключ идемпотентности,
+    group — с какими постами можно склеивать)"""
+    target = target or topic_target(chat_type, chats)
+    if target is None:
         return False, f"❌ Тема для '{chat_type}' не настроена!"
     
-    try:
-        bot.send_message(
-            chat_id=CHATS['chat_id'],
-            message_thread_id=thread_id,
-            text=text
-        )
-        return True, f"✅ Сообщение отправлено в тему!"
-    except Exception as e:
-        logger.error(f"Ошибка отправки: {e}")
-        return False, f"❌ Ошибка отправки: {str(e)}"
+    coalesce = None if urgent else COALESCE.get(chat_type)
+    chat_id, thread_id = target
+    await outbox.put(chat_id, thread_id, text, on_sent=on_sent, coalesce=coalesce, key=key, group=group)
+    return True, "✅ Сообщение поставлено в очередь!"
+
+async def publish_item(kind, chat_type, data, text, event):
+    """Сохраняет заполненную форму в хранилище задач и ставит сообщение в очередь форума команды"""
+    target = topic_target(chat_type, await tenant_chats(event))
+    if target is None:
+        return False, f"❌ Тема для '{chat_type}' не настроена!"
+    
+    chat_id, thread_id = target
+    task = await tasks.add(kind, data, chat_id=chat_id, thread_id=thread_id, created_by=event.from_user.id)
+    people.see(chat_id, event.from_user)
+    track_task(task)
+    
+    async def on_sent(message):
+        await tasks.set_message_id(task['id'], message.message_id)
+    
+    urgent = data.get('priority') == PRIORITIES['critical']
+    # Тема та же, что записана в задачу, даже если настройки перечитались за время await.
+    # Посты задач склеиваются только друг с другом: update_post пересобирает такой пост из его задач
+    return await send_to_topic(chat_type, text, on_sent=on_sent, urgent=urgent, target=target,
+                               key=f"task:{task['id']}", group='tasks')
+
+def track_task(task):
+    """Новая задача в счетчиках отчетов, в поиске, в сводке темы и, если это открытый дедлайн, в напоминаниях"""
+    reports.record(task)
+    search.add(task)
+    board.track(task)
+    deadlines.track(task)
+    if task['kind'] == 'deadline' and task['due_date'] and task['status'] != STATUSES['done']:
+        reminders.schedule(task)
+
+async def on_restored_sent(key, message):
+    """Пост формы, отправленный из журнала после перезапуска: запоминаем message_id"""
+    kind, _, task_id = key.partition(':')
+    if kind == 'task':
+        await tasks.set_message_id(int(task_id), message.message_id)
+
+outbox.on_restored = on_restored_sent
+
+# ==================== БРОШЕННЫЕ ЧЕРНОВИКИ ====================
+FORM_COMMANDS = {
+    'DeadlineForm': '/deadline',
+    'QuestionForm': '/question',
+    'DoneForm': '/done',
+    'IdeaForm': '/idea',
+    'ResourceForm': '/resource',
+    'ReportForm': '/report',
+    'StatusForm': '/status'
+}
+
+async def notify_draft_expired(key, state, data):
+    """Сообщает пользователю, что его незаконченная форма удалена"""
+    command = FORM_COMMANDS.get(state.split(':', 1)[0])
+    if command is None:
+        return
+    # Через очередь: уборка может разом удалить много черновиков
+    await outbox.put(key.chat_id, key.thread_id,
+                     f"⌛ Черновик {command} удален: форма долго не заполнялась.\nНачните заново: {command}")
+
+if FSM_EXPIRE_NOTICE:
+    storage.on_expire = notify_draft_expired
+
+# ==================== КНОПКИ ФОРМ ====================
+@dp.callback_query(F.data.startswith(CALLBACK_PREFIX))
+async def form_callback(callback: types.CallbackQuery, state: FSMContext):
+    """Единая точка входа для кнопок всех форм"""
+    await callbacks.dispatch(callback, state)
+
+# ==================== НАПОМИНАНИЯ О ДЕДЛАЙНАХ ====================
+REMINDER_TITLES = {
+    TOMORROW: "⏰ <b>ДЕДЛАЙН ЗАВТРА:</b>",
+    TODAY: "🔥 <b>ДЕДЛАЙН СЕГОДНЯ:</b>",
+    OVERDUE: "⚠️ <b>ДЕДЛАЙН ПРОСРОЧЕН:</b>"
+}
+
+async def notify_deadline(task, stage):
+    """Отправляет напоминание в тему дедлайнов и запоминает этап"""
+    if SHARD_COUNT > 1:
+        # Дедлайн мог закрыть /status в другом воркере
+        current = await tasks.by_ids([task['id']])
+        if current and current[0]['status'] == STATUSES['done']:
+            return
+    due = date.fromisoformat(task['due_date']).strftime('%d.%m')
+    text = f"""
+{REMINDER_TITLES[stage]} {due} - {task['title']}
+{task['project']}
+👤 <b>Ответственный:</b> {task['responsible']}
+"""
+    target = (task['chat_id'], task['thread_id']) if task.get('thread_id') else None
+    ok, result = await send_to_topic('deadlines', text, target=target, key=f"reminder:{task['id']}:{stage}")
+    if not ok:
+        logger.error(result)
+    await tasks.set_reminder_stage(task['id'], stage)
+
+reminders = ReminderScheduler(notify_deadline, hour=REMINDER_HOUR)
 
 # ==================== КОМАНДЫ СТАРТА И ПОМОЩИ ====================
 @dp.message(Command("start", "help"))
@@ -126,25 +350,39 @@ async def cmd_start(message: types.Message):
 <b>📋 ОСНОВНЫЕ КОМАНДЫ:</b>
 /deadline - Создать дедлайн
 /question - Задать вопрос
-/done - Отметить задачу выполненной
+/done - Отметить задачу выполненной (можно выбрать открытый дедлайн)
+/status - Сменить статус дедлайна в его посте
 /idea - Предложить идею
 /resource - Добавить ресурс
-/report - Создать отчет
+/report - Отчет по проектам (собирается автоматически)
 
 <b>📊 ИНФОРМАЦИЯ:</b>
 /projects - Список проектов
 /statuses - Список статусов
 /priorities - Список приоритетов
+/list - Открытые задачи проекта
+/search - Поиск по задачам, вопросам, идеям и ресурсам
 /getinfo - Информация о теме
 
 <b>⚙️ НАСТРОЙКА (только админ):</b>
-/setall - Настроить все темы разом
+/setall - Настроить все темы основного форума разом
 /check - Проверить настройки
+/stats - Метрики бота
+/bind - Подключить форум своей команды
+/settopic - Назначить тему форума (/settopic deadlines)
+/join - Отправлять свои формы в этот форум
+/import - Загрузить задачи из CSV/JSONL
 
 <b>🎯 КАК РАБОТАТЬ:</b>
 1. Выберите команду (например /deadline)
 2. Заполните данные через диалог
 3. Бот отправит сообщение в нужную тему
+
+<b>⚡ ОДНОЙ СТРОКОЙ:</b>
+<code>/deadline bm 30.04 high @ivan doing Сдать макет</code>
+<code>/idea moto medium Новый лендинг | Больше заявок</code>
+Сначала проект, приоритет, статус, дата, @ответственный (в любом порядке), потом текст.
+Чего не хватает — бот спросит.
 """
     await message.answer(text)
 
@@ -167,512 +405,756 @@ async def cmd_getinfo(message: types.Message):
 
 @dp.message(Command("setall"))
 async def cmd_setall(message: types.Message):
-    """Настроить все темы одной командой"""
+    """Настроить все темы основного форума одной командой: /setall deadlines=4 questions=8 ..."""
     if message.from_user.id != ADMIN_ID:
         await message.answer("⛔ Только для администратора")
         return
+    if not message.chat.is_forum:
+        await message.answer("❌ Команду нужно отправить в форуме (группе с темами)")
+        return
     
-    # Настраиваем все темы согласно твоим данным
-    CHATS.update({
-        'chat_id': -1003761419747,
-        'deadlines': 4,
-        'questions': 8,
-        'done': 10,
-        'ideas': 15,
-        'resources': 6,
-        'reports': 19,
-        'main': 2
-    })
-    
-    if save_chats(CHATS):
-        text = """
-✅ <b>Все темы настроены!</b>
-
-• 📅 Дедлайны: <code>ID 4</code>
-• ❓ Вопросы: <code>ID 8</code>
-• ✅ Готово: <code>ID 10</code>
-• 💡 Идеи: <code>ID 15</code>
-• 🗃 Ресурсы: <code>ID 6</code>
-• 📊 Отчеты: <code>ID 19</code>
-• 📌 Главный: <code>ID 2</code>
-
-Теперь можно тестировать команды!
-"""
-        await message.answer(text)
-    else:
+    topics = {}
+    for pair in message.text.split()[1:]:
+        chat_type, _, thread_id = pair.partition('=')
+        if chat_type not in TOPIC_NAMES or not thread_id.isdigit():
+            topics = None
+            break
+        topics[chat_type] = int(thread_id)
+    if not topics:
+        await message.answer(
+            "❌ Укажите темы: <code>/setall deadlines=4 questions=8 ...</code>\n"
+            f"Типы: {', '.join(TOPIC_NAMES)}. ID темы покажет /getinfo, отправленная в ней."
+        )
+        return
+    
+    # Темы другого форума к этому не относятся: незаданные сбрасываются
+    chats = dict(CHATS) if CHATS['chat_id'] == message.chat.id else empty_chats(message.chat.id)
+    chats.update(topics)
+    if not await save_default_chats(chats):
         await message.answer("❌ Ошибка сохранения настроек")
+        return
+    if tenants.forum_of(message.chat.id) == message.chat.id:
+        for chat_type, thread_id in topics.items():
+            await tenants.set_topic(message.chat.id, chat_type, thread_id)
+    
+    text = "✅ <b>Темы основного форума настроены!</b>\n\n"
+    for key, name in TOPIC_NAMES.items():
+        text += f"• {name}: <code>{f'ID {chats[key]}' if chats[key] else 'Не настроено'}</code>\n"
+    await message.answer(text)
 
 @dp.message(Command("check"))
 async def cmd_check(message: types.Message):
     """Проверить текущие настройки"""
-    if message.from_user.id != ADMIN_ID:
+    if not await is_forum_admin(message):
         await message.answer("⛔ Только для администратора")
         return
     
-    chat_names = {
-        'deadlines': '📅 Дедлайны',
-        'questions': '❓ Вопросы',
-        'done': '✅ Готово',
-        'ideas': '💡 Идеи',
-        'resources': '🗃 Ресурсы',
-        'reports': '📊 Отчеты',
-        'main': '📌 Главный'
-    }
-    
+    chats = await tenant_chats(message)
     text = f"""
 📊 <b>ТЕКУЩИЕ НАСТРОЙКИ:</b>
 
-• ID форума: <code>{CHATS['chat_id']}</code>
+• ID форума: <code>{chats['chat_id']}</code>
 
 <b>Настроенные темы:</b>
 """
-    for key, name in chat_names.items():
-        thread_id = CHATS[key]
+    for key, name in TOPIC_NAMES.items():
+        thread_id = chats[key]
         status = "✅" if thread_id != 0 else "❌"
         text += f"{status} <b>{name}</b>: <code>{thread_id or 'Не настроено'}</code>\n"
     
     await message.answer(text)
 
+@dp.message(Command("stats"))
+async def cmd_stats(message: types.Message):
+    """Метрики процесса: время обработчиков, Bot API, очередь, живые диалоги"""
+    if message.from_user.id != ADMIN_ID:
+        await message.answer("⛔ Только для администратора")
+        return
+    
+    uptime = int(time.monotonic() - metrics.started)
+    events = sum(h.count for h in metrics.handlers.values())
+    errors = sum(metrics.handler_errors.values())
+    text = f"""
+📈 <b>МЕТРИКИ БОТА</b>
+
+• Работает: <code>{uptime // 3600} ч {uptime % 3600 // 60} мин</code>
+• Событий: <code>{events}</code>, ошибок: <code>{errors}</code>
+• Диалогов посреди формы: <code>{storage.active()}</code>
+• Брошенных черновиков удалено: <code>{storage.expired}</code>, вытеснено: <code>{storage.evicted}</code>
+• Очередь отправки: <code>{outbox.queue.qsize()}</code> (импорт <code>{outbox.bulk.qsize()}</code>), отправлено: <code>{outbox.sent}</code>, ошибок: <code>{outbox.failed}</code>
+• Повторов отправки: <code>{outbox.retried}</code>, ждут повтора: <code>{len(outbox.retries)}</code>
+• Сводки тем: перерисовок <code>{board.renders}</code>, правок <code>{board.edited}</code>, без изменений <code>{board.skipped}</code>
+• Апдейтов в обработке: <code>{scheduler.running}</code>, ждут: <code>{scheduler.pending - scheduler.running}</code> (очередей <code>{len(scheduler.queues)}</code>)
+• Флуд: отложено <code>{flood.deferred}</code>, отброшено <code>{flood.dropped}</code>, повторных нажатий <code>{flood.duplicates}</code>
+• Участников форумов: <code>{len(people)}</code>
+• Шаги форм: новых сообщений <code>{wizard.sent}</code>, правок <code>{wizard.edited}</code>, без изменений <code>{wizard.skipped}</code>
+"""
+    if SHARD_COUNT > 1:
+        text += f"• Воркер: <code>{SHARD_INDEX + 1}/{SHARD_COUNT}</code>\n"
+    
+    slowest = sorted(metrics.handlers.items(), key=lambda item: item[1].quantile(0.99), reverse=True)[:5]
+    if slowest:
+        text += "\n<b>Медленные обработчики (p99):</b>\n"
+        for name, histogram in slowest:
+            text += f"• {name}: <code>{histogram.quantile(0.99) * 1000:.0f} мс</code> ({histogram.count})\n"
+    
+    if metrics.api:
+        text += "\n<b>Bot API (p99):</b>\n"
+        for name, histogram in sorted(metrics.api.items(), key=lambda item: -item[1].count):
+            text += (f"• {name}: <code>{histogram.quantile(0.99) * 1000:.0f} мс</code> ({histogram.count}, "
+                     f"ошибок {metrics.api_errors[name]})\n")
+    
+    await message.answer(text)
+
+# ==================== ФОРУМЫ КОМАНД ====================
+TOPIC_NAMES = {
+    'deadlines': '📅 Дедлайны',
+    'questions': '❓ Вопросы',
+    'done': '✅ Готово',
+    'ideas': '💡 Идеи',
+    'resources': '🗃 Ресурсы',
+    'reports': '📊 Отчеты',
+    'main': '📌 Главный'
+}
+
+async def save_default_chats(chats):
+    """Сохраняет настройки основного форума в chats.json (в отдельном потоке) и применяет их"""
+    if not await save_chats_async(chats):
+        return False
+    apply_chats(chats)
+    return True
+
+async def is_forum_admin(message: types.Message):
+    """Владелец бота или администратор группы, в которой написано сообщение"""
+    if message.from_user.id == ADMIN_ID:
+        return True
+    if message.chat.type == 'private':
+        return False
+    member = await bot.get_chat_member(message.chat.id, message.from_user.id)
+    return member.status in ('creator', 'administrator')
+
+@dp.message(Command("bind"))
+async def cmd_bind(message: types.Message):
+    """Подключить форум своей команды (команда пишется в самом форуме)"""
+    if not message.chat.is_forum:
+        await message.answer("❌ Команду нужно отправить в форуме (группе с темами)")
+        return
+    if not await is_forum_admin(message):
+        await message.answer("⛔ Только для администратора группы")
+        return
+    
+    await tenants.bind(message.chat.id, message.chat.title)
+    await tenants.join(message.from_user.id, message.chat.id)
+    await message.answer(
+        "✅ <b>Форум подключен!</b>\n\n"
+        "Отправьте в каждой теме /settopic с ее типом, например <code>/settopic deadlines</code>.\n"
+        f"Типы: {', '.join(TOPIC_NAMES)}\n\n"
+        "Участники подключаются командой /join здесь же — после этого формы из личных сообщений "
+        "уходят в этот форум."
+    )
+
+@dp.message(Command("settopic"))
+async def cmd_settopic(message: types.Message):
+    """Назначить текущую тему форума для дедлайнов, вопросов и т.д."""
+    chat_type = (message.text.split(maxsplit=1)[1:] or [''])[0].strip()
+    if chat_type not in TOPIC_NAMES:
+        await message.answer(f"❌ Укажите тип темы: {', '.join(TOPIC_NAMES)}")
+        return
+    if not message.message_thread_id:
+        # Тема 0 значит "не настроена": в General и вне тем назначать нечего
+        await message.answer("❌ Отправьте команду внутри темы, которую нужно назначить (не в General)")
+        return
+    bound = tenants.forum_of(message.chat.id) == message.chat.id
+    default = message.chat.id == CHATS['chat_id']
+    if not bound and not default:
+        await message.answer("❌ Сначала подключите форум командой /bind")
+        return
+    if not await is_forum_admin(message):
+        await message.answer("⛔ Только для администратора группы")
+        return
+    
+    thread_id = message.message_thread_id
+    # Основной форум живет в chats.json: тема должна пережить перезапуск и дойти до других процессов
+    if default and not await save_default_chats(dict(CHATS, **{chat_type: thread_id})):
+        await message.answer("❌ Ошибка сохранения настроек")
+        return
+    if bound:
+        await tenants.set_topic(message.chat.id, chat_type, thread_id)
+    await message.answer(f"✅ {TOPIC_NAMES[chat_type]}: <code>ID {message.message_thread_id}</code>")
+
+@dp.message(Command("join"))
+async def cmd_join(message: types.Message):
+    """Отправлять формы из личных сообщений в этот форум"""
+    if tenants.forum_of(message.chat.id) != message.chat.id:
+        await message.answer("❌ Этот чат не подключен. Администратор может подключить его командой /bind")
+        return
+    
+    await tenants.join(message.from_user.id, message.chat.id)
+    await message.answer(f"✅ Теперь ваши формы уходят в форум «{message.chat.title}»")
+
+# ==================== ШАГИ ФОРМ ====================
+# Поля каждой формы по порядку: состояние FSM, вопрос и клавиатура (если выбор из справочника)
+FORM_STEPS = {
+    'deadline': [
+        ('project', DeadlineForm.project, "📅 <b>СОЗДАНИЕ ДЕДЛАЙНА</b>\n\nВыберите проект:",
+         lambda: projects_keyboard('deadline')),
+        ('date', DeadlineForm.date, "📅 Введите дату в формате <b>ДД.ММ</b> (например: 30.04):", None),
+        ('task', DeadlineForm.task, "✍️ Введите описание задачи:", None),
+        ('priority', DeadlineForm.priority, "🎯 Выберите приоритет:", lambda: priorities_keyboard('deadline')),
+        ('responsible', DeadlineForm.responsible, "👤 Укажите ответственного (@username или Имя_Фамилия):", None),
+        ('status', DeadlineForm.status, "🔄 Выберите статус:", lambda: statuses_keyboard('deadline')),
+    ],
+    'question': [
+        ('project', QuestionForm.project, "❓ <b>ЗАДАТЬ ВОПРОС</b>\n\nВыберите проект:",
+         lambda: projects_keyboard('question')),
+        ('question', QuestionForm.question, "❓ Введите ваш вопрос:", None),
+        ('priority', QuestionForm.priority, "🎯 Выберите приоритет вопроса:", lambda: priorities_keyboard('question')),
+        ('to_who', QuestionForm.to_who, "👤 Кому адресован вопрос? (@username или Имя_Фамилия):", None),
+        ('context', QuestionForm.context, "📋 Дополнительный контекст (если нужно, или напишите 'нет'):", None),
+    ],
+    'done': [
+        ('project', DoneForm.project, "✅ <b>ЗАДАЧА ВЫПОЛНЕНА</b>\n\nВыберите проект:",
+         lambda: projects_keyboard('done')),
+        # Кнопки — открытые дедлайны проекта (STEP_PICKERS), можно и написать своими словами
+        ('task', DoneForm.task, "✅ Что именно сделано?", None),
+        # Клавиатура только для статусов Готово/Проверка
+        ('status', DoneForm.status, "🔄 Выберите статус:",
+         lambda: create_keyboard(STATUSES, 'done', 'status', keys=('done', 'review'))),
+        ('link', DoneForm.link, "🔗 Ссылка на результат (если есть, или напишите 'нет'):", None),
+        ('check', DoneForm.check, "🔍 Что конкретно проверять? (опишите кратко):", None),
+    ],
+    'idea': [
+        ('project', IdeaForm.project, "💡 <b>ПРЕДЛОЖЕНИЕ ИДЕИ</b>\n\nВыберите проект:",
+         lambda: projects_keyboard('idea')),
+        ('idea', IdeaForm.idea, "💡 Опишите вашу идею:", None),
+        ('priority', IdeaForm.priority, "🎯 Выберите приоритет:", lambda: priorities_keyboard('idea')),
+        ('benefit', IdeaForm.benefit, "📈 Какая польза от этой идеи? (опишите кратко):", None),
+    ],
+    'resource': [
+        ('project', ResourceForm.project, "🗃 <b>ДОБАВЛЕНИЕ РЕСУРСА</b>\n\nВыберите проект:",
+         lambda: projects_keyboard('resource')),
+        ('resource_type', ResourceForm.resource_type, "📎 Выберите тип ресурса:",
+         lambda: resource_types_keyboard('resource')),
+        ('description', ResourceForm.description, "📝 Опишите ресурс (что это, для чего):", None),
+        ('link', ResourceForm.link, "🔗 Ссылка на ресурс (если есть, или напишите 'нет'):", None),
+    ],
+}
+
+def event_message(event):
+    """Сообщение, в чат которого отвечать: само сообщение или то, под которым нажата кнопка"""
+    return event.message if isinstance(event, types.CallbackQuery) else event
+
+def command_args(message: types.Message):
+    """Текст после команды (/deadline bm 30.04 ... -> "bm 30.04 ...") или в подписи к файлу"""
+    parts = (message.text or message.caption or '').split(maxsplit=1)
+    return parts[1] if len(parts) > 1 else ''
+
+async def pick_done_deadline(event, data):
+    """Открытые дедлайны проекта кнопками: выбранный /done закроет"""
+    items, _ = deadlines.find((await tenant_chats(event))['chat_id'], data.get('project'), limit=PICK_LIMIT)
+    return deadlines_keyboard(items, 'done') if items else None
+
+# Шаги, кнопки которых зависят от уже заполненных полей и форума: (форма, поле) -> async picker(event, data)
+STEP_PICKERS = {
+    ('done', 'task'): pick_done_deadline,
+}
+
+async def take_person(message: types.Message, state: FSMContext, form, field):
+    """Ответственный или адресат: по первым буквам предлагает участников форума кнопками"""
+    data = await state.get_data()
+    data.pop('typed', None)
+    text = message.text or ''
+    if SHARD_COUNT > 1:
+        await people.refresh()
+    found = people.suggest((await tenant_chats(message))['chat_id'], text, limit=PICK_LIMIT)
+    exact = [person for person in found if name_key(person_handle(person)) == name_key(text)]
+    if exact:
+        text = person_handle(exact[0])
+    elif found:
+        data['typed'] = text
+        await state.set_data(data)
+        await wizard.show(message, state, "👥 Кого вы имели в виду? Выберите участника форума:",
+                          people_keyboard(found, form, field))
+        return
+    data[field] = text
+    await state.set_data(data)
+    await ask_next(message, state, form)
+
+async def person_picked(callback: types.CallbackQuery, key, state: FSMContext, form, field):
+    """Нажата кнопка участника (или «оставить как написано») из take_person"""
+    data = await state.get_data()
+    typed = data.pop('typed', None)
+    person = people.get((await tenant_chats(callback))['chat_id'], int(key)) if key.isdigit() else None
+    if person is not None:
+        data[field] = person_handle(person)
+    elif typed is not None and key == '0':
+        data[field] = typed
+    else:
+        await callback.answer("Участник не найден — напишите еще раз")
+        return
+    await state.set_data(data)
+    await callback.answer()
+    await ask_next(callback, state, form)
+
+async def start_form(message: types.Message, state: FSMContext, form):
+    """Начинает форму: поля, указанные прямо в команде, заполняются сразу, об остальных бот спросит"""
+    args = command_args(message)
+    await state.set_data(quick.parse(form, args) if args else {})
+    await ask_next(message, state, form)
+
+async def ask_next(event, state: FSMContext, form):
+    """Спрашивает первое незаполненное поле формы; если все заполнено — публикует форму"""
+    data = await state.get_data()
+    for field, form_state, prompt, keyboard in FORM_STEPS[form]:
+        if field not in data:
+            await state.set_state(form_state)
+            picker = STEP_PICKERS.get((form, field))
+            markup = await picker(event, data) if picker else keyboard() if keyboard else None
+            await wizard.show(event, state, prompt, markup)
+            return
+    # Служебное поле мастера в задачу не попадает
+    data.pop(WIZARD_KEY, None)
+    await FORM_FINISHERS[form](event, state, data)
+
 # ==================== КОМАНДА /DEADLINE ====================
 @dp.message(Command("deadline"))
 async def cmd_deadline(message: types.Message, state: FSMContext):
-    """Создать дедлайн"""
-    if CHATS['deadlines'] == 0:
-        await message.answer("❌ Тема для дедлайнов не настроена. Используйте /setall")
+    """Создать дедлайн (или сразу: /deadline bm 30.04 high @ivan doing Сдать макет)"""
+    chats = await tenant_chats(message)
+    if chats['deadlines'] == 0:
+        await message.answer("❌ Тема для дедлайнов не настроена. Используйте /bind и /settopic в форуме команды")
         return
     
-    await state.set_state(DeadlineForm.project)
-    await message.answer("📅 <b>СОЗДАНИЕ ДЕДЛАЙНА</b>\n\nВыберите проект:", 
-                        reply_markup=projects_keyboard("deadline"))
+    await start_form(message, state, 'deadline')
 
-@dp.callback_query(lambda c: c.data.startswith('deadline_'), DeadlineForm.project)
-async def deadline_project(callback: types.CallbackQuery, state: FSMContext):
-    key = callback.data.replace('deadline_', '')
+@callbacks.register('deadline', 'project', DeadlineForm.project)
+async def deadline_project(callback: types.CallbackQuery, key: str, state: FSMContext):
     if key in PROJECTS:
         await state.update_data(project=PROJECTS[key])
         await callback.answer()
-        await state.set_state(DeadlineForm.date)
-        await callback.message.answer("📅 Введите дату в формате <b>ДД.ММ</b> (например: 30.04):")
+        await ask_next(callback, state, 'deadline')
 
 @dp.message(DeadlineForm.date)
 async def deadline_date(message: types.Message, state: FSMContext):
+    if not parse_due_date(message.text):
+        await wizard.show(message, state, "❌ Не понял дату. Введите в формате <b>ДД.ММ</b> (например: 30.04):")
+        return
     await state.update_data(date=message.text)
-    await state.set_state(DeadlineForm.task)
-    await message.answer("✍️ Введите описание задачи:")
+    await ask_next(message, state, 'deadline')
 
 @dp.message(DeadlineForm.task)
 async def deadline_task(message: types.Message, state: FSMContext):
     await state.update_data(task=message.text)
-    await state.set_state(DeadlineForm.priority)
-    await message.answer("🎯 Выберите приоритет:", reply_markup=priorities_keyboard("deadline_prio"))
+    await ask_next(message, state, 'deadline')
 
-@dp.callback_query(lambda c: c.data.startswith('deadline_prio_'), DeadlineForm.priority)
-async def deadline_priority(callback: types.CallbackQuery, state: FSMContext):
-    key = callback.data.replace('deadline_prio_', '')
+@callbacks.register('deadline', 'priority', DeadlineForm.priority)
+async def deadline_priority(callback: types.CallbackQuery, key: str, state: FSMContext):
     if key in PRIORITIES:
         await state.update_data(priority=PRIORITIES[key])
         await callback.answer()
-        await state.set_state(DeadlineForm.responsible)
-        await callback.message.answer("👤 Укажите ответственного (@username или Имя_Фамилия):")
+        await ask_next(callback, state, 'deadline')
 
 @dp.message(DeadlineForm.responsible)
 async def deadline_responsible(message: types.Message, state: FSMContext):
-    await state.update_data(responsible=message.text)
-    await state.set_state(DeadlineForm.status)
-    await message.answer("🔄 Выберите статус:", reply_markup=statuses_keyboard("deadline_stat"))
+    await take_person(message, state, 'deadline', 'responsible')
+
+@callbacks.register('deadline', 'responsible', DeadlineForm.responsible)
+async def deadline_responsible_pick(callback: types.CallbackQuery, key: str, state: FSMContext):
+    await person_picked(callback, key, state, 'deadline', 'responsible')
 
-@dp.callback_query(lambda c: c.data.startswith('deadline_stat_'), DeadlineForm.status)
-async def deadline_status(callback: types.CallbackQuery, state: FSMContext):
-    key = callback.data.replace('deadline_stat_', '')
+@callbacks.register('deadline', 'status', DeadlineForm.status)
+async def deadline_status(callback: types.CallbackQuery, key: str, state: FSMContext):
     if key in STATUSES:
         await state.update_data(status=STATUSES[key])
         await callback.answer()
-        
-        data = await state.get_data()
-        
-        # Формируем сообщение
-        text = f"""
+        await ask_next(callback, state, 'deadline')
+
+def deadline_post(data):
+    return f"""
 📅 <b>ДЕДЛАЙН:</b> {data['date']} - {data['task']}
 {data['project']} {data['priority']} {data['status']}
 👤 <b>Ответственный:</b> {data['responsible']}
 📝 <b>Создано через бота</b>
 """
-        
-        # Отправляем в тему дедлайнов
-        try:
-            await bot.send_message(
-                chat_id=CHATS['chat_id'],
-                message_thread_id=CHATS['deadlines'],
-                text=text
-            )
-            await callback.message.answer("✅ Дедлайн создан и отправлен в тему 'Дедлайны'!")
-        except Exception as e:
-            logger.error(f"Ошибка: {e}")
-            await callback.message.answer("❌ Ошибка отправки. Проверьте настройки командой /check")
-        
-        await state.clear()
+
+async def finish_deadline(event, state: FSMContext, data):
+    # Ставим в очередь отправки в тему дедлайнов
+    ok, result = await publish_item('deadline', 'deadlines', data, deadline_post(data), event)
+    await wizard.show(event, state, "✅ Дедлайн создан и отправлен в тему 'Дедлайны'!" if ok else result)
+    
+    await state.clear()
 
 # ==================== КОМАНДА /QUESTION ====================
 @dp.message(Command("question"))
 async def cmd_question(message: types.Message, state: FSMContext):
-    """Задать вопрос"""
-    if CHATS['questions'] == 0:
-        await message.answer("❌ Тема для вопросов не настроена. Используйте /setall")
+    """Задать вопрос (или сразу: /question ai low @petr Какой стек? | контекст)"""
+    chats = await tenant_chats(message)
+    if chats['questions'] == 0:
+        await message.answer("❌ Тема для вопросов не настроена. Используйте /bind и /settopic в форуме команды")
         return
     
-    await state.set_state(QuestionForm.project)
-    await message.answer("❓ <b>ЗАДАТЬ ВОПРОС</b>\n\nВыберите проект:", 
-                        reply_markup=projects_keyboard("question"))
+    await start_form(message, state, 'question')
 
-@dp.callback_query(lambda c: c.data.startswith('question_'), QuestionForm.project)
-async def question_project(callback: types.CallbackQuery, state: FSMContext):
-    key = callback.data.replace('question_', '')
+@callbacks.register('question', 'project', QuestionForm.project)
+async def question_project(callback: types.CallbackQuery, key: str, state: FSMContext):
     if key in PROJECTS:
         await state.update_data(project=PROJECTS[key])
         await callback.answer()
-        await state.set_state(QuestionForm.question)
-        await callback.message.answer("❓ Введите ваш вопрос:")
+        await ask_next(callback, state, 'question')
 
 @dp.message(QuestionForm.question)
 async def question_text(message: types.Message, state: FSMContext):
     await state.update_data(question=message.text)
-    await state.set_state(QuestionForm.priority)
-    await message.answer("🎯 Выберите приоритет вопроса:", reply_markup=priorities_keyboard("question_prio"))
+    await ask_next(message, state, 'question')
 
-@dp.callback_query(lambda c: c.data.startswith('question_prio_'), QuestionForm.priority)
-async def question_priority(callback: types.CallbackQuery, state: FSMContext):
-    key = callback.data.replace('question_prio_', '')
+@callbacks.register('question', 'priority', QuestionForm.priority)
+async def question_priority(callback: types.CallbackQuery, key: str, state: FSMContext):
     if key in PRIORITIES:
         await state.update_data(priority=PRIORITIES[key])
         await callback.answer()
-        await state.set_state(QuestionForm.to_who)
-        await callback.message.answer("👤 Кому адресован вопрос? (@username или Имя_Фамилия):")
+        await ask_next(callback, state, 'question')
 
 @dp.message(QuestionForm.to_who)
 async def question_to_who(message: types.Message, state: FSMContext):
-    await state.update_data(to_who=message.text)
-    await state.set_state(QuestionForm.context)
-    await message.answer("📋 Дополнительный контекст (если нужно, или напишите 'нет'):")
+    await take_person(message, state, 'question', 'to_who')
+
+@callbacks.register('question', 'to_who', QuestionForm.to_who)
+async def question_to_who_pick(callback: types.CallbackQuery, key: str, state: FSMContext):
+    await person_picked(callback, key, state, 'question', 'to_who')
 
 @dp.message(QuestionForm.context)
 async def question_context(message: types.Message, state: FSMContext):
     context = message.text if message.text.lower() != 'нет' else 'не указан'
     await state.update_data(context=context)
-    data = await state.get_data()
-    
-    text = f"""
+    await ask_next(message, state, 'question')
+
+def question_post(data):
+    return f"""
 ❓ <b>ВОПРОС:</b> {data['question']}
-{data['project']} {data['priority']} #Жду
+{data['project']} {data['priority']} {data['status']}
 👤 <b>Кому:</b> {data['to_who']}
 📝 <b>Контекст:</b> {data.get('context', 'не указан')}
 🔔 <b>Создан через бота</b>
 """
-    
-    try:
-        await bot.send_message(
-            chat_id=CHATS['chat_id'],
-            message_thread_id=CHATS['questions'],
-            text=text
-        )
-        await message.answer("✅ Вопрос отправлен в тему 'Вопросы'!")
-    except Exception as e:
-        logger.error(f"Ошибка: {e}")
-        await message.answer("❌ Ошибка отправки.")
+
+async def finish_question(event, state: FSMContext, data):
+    data['status'] = STATUSES['waiting']
+    ok, result = await publish_item('question', 'questions', data, question_post(data), event)
+    await wizard.show(event, state, "✅ Вопрос отправлен в тему 'Вопросы'!" if ok else result)
     
     await state.clear()
 
 # ==================== КОМАНДА /DONE ====================
 @dp.message(Command("done"))
 async def cmd_done(message: types.Message, state: FSMContext):
-    """Отметить задачу как выполненную"""
-    if CHATS['done'] == 0:
-        await message.answer("❌ Тема для готовых задач не настроена. Используйте /setall")
+    """Отметить задачу как выполненную (или сразу: /done bm done Сдать макет | Что проверить)"""
+    chats = await tenant_chats(message)
+    if chats['done'] == 0:
+        await message.answer("❌ Тема для готовых задач не настроена. Используйте /bind и /settopic в форуме команды")
         return
     
-    await state.set_state(DoneForm.project)
-    await message.answer("✅ <b>ЗАДАЧА ВЫПОЛНЕНА</b>\n\nВыберите проект:", 
-                        reply_markup=projects_keyboard("done"))
+    await deadlines.refresh(tasks)
+    await start_form(message, state, 'done')
 
-@dp.callback_query(lambda c: c.data.startswith('done_'), DoneForm.project)
-async def done_project(callback: types.CallbackQuery, state: FSMContext):
-    key = callback.data.replace('done_', '')
+@callbacks.register('done', 'project', DoneForm.project)
+async def done_project(callback: types.CallbackQuery, key: str, state: FSMContext):
     if key in PROJECTS:
         await state.update_data(project=PROJECTS[key])
         await callback.answer()
-        await state.set_state(DoneForm.task)
-        await callback.message.answer("✅ Что именно сделано?")
+        await ask_next(callback, state, 'done')
 
 @dp.message(DoneForm.task)
 async def done_task(message: types.Message, state: FSMContext):
+    data = await state.get_data()
+    chat_id = (await tenant_chats(message))['chat_id']
+    if message.text and deadlines.match(chat_id, data.get('project'), message.text) is None:
+        # Похоже на открытый дедлайн — предлагаем привязать к нему
+        items, _ = deadlines.find(chat_id, data.get('project'), text=message.text, limit=PICK_LIMIT)
+        if items:
+            await state.update_data(typed=message.text)
+            await wizard.show(message, state, "🔎 Это один из открытых дедлайнов? Выберите его — статус обновится:",
+                              deadlines_keyboard(items, 'done', other="✍️ Нет, оставить как написано"))
+            return
     await state.update_data(task=message.text)
-    await state.set_state(DoneForm.status)
-    
-    # Клавиатура только для статусов Готово/Проверка
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [
-            InlineKeyboardButton(text="#Готово", callback_data="done_stat_done"),
-            InlineKeyboardButton(text="#Проверка", callback_data="done_stat_review")
-        ]
-    ])
-    
-    await message.answer("🔄 Выберите статус:", reply_markup=keyboard)
+    await ask_next(message, state, 'done')
 
-@dp.callback_query(lambda c: c.data.startswith('done_stat_'), DoneForm.status)
-async def done_status(callback: types.CallbackQuery, state: FSMContext):
-    key = callback.data.replace('done_stat_', '')
+@callbacks.register('done', 'deadline', DoneForm.task)
+async def done_deadline(callback: types.CallbackQuery, key: str, state: FSMContext):
+    data = await state.get_data()
+    typed = data.pop('typed', None)
+    item = deadlines.get(int(key), (await tenant_chats(callback))['chat_id']) if key.isdigit() else None
+    if item is not None:
+        data.update(task=item['title'], deadline=item['id'])
+    elif typed and key == '0':
+        data['task'] = typed
+    else:
+        await callback.answer("Этот дедлайн уже закрыт — напишите, что сделано")
+        return
+    await state.set_data(data)
+    await callback.answer()
+    await ask_next(callback, state, 'done')
+
+@callbacks.register('done', 'status', DoneForm.status)
+async def done_status(callback: types.CallbackQuery, key: str, state: FSMContext):
     if key in ['done', 'review']:
         await state.update_data(status=STATUSES[key])
         await callback.answer()
-        await state.set_state(DoneForm.link)
-        await callback.message.answer("🔗 Ссылка на результат (если есть, или напишите 'нет'):")
+        await ask_next(callback, state, 'done')
 
 @dp.message(DoneForm.link)
 async def done_link(message: types.Message, state: FSMContext):
     link = message.text if message.text.lower() != 'нет' else 'не указана'
     await state.update_data(link=link)
-    await state.set_state(DoneForm.check)
-    await message.answer("🔍 Что конкретно проверять? (опишите кратко):")
+    await ask_next(message, state, 'done')
 
 @dp.message(DoneForm.check)
 async def done_check(message: types.Message, state: FSMContext):
     await state.update_data(check=message.text)
-    data = await state.get_data()
-    
-    text = f"""
+    await ask_next(message, state, 'done')
+
+def done_post(data):
+    deadline = f"📅 <b>Дедлайн:</b> {data['deadline_link']}\n" if data.get('deadline_link') else ""
+    return f"""
 ✅ <b>ГОТОВО:</b> {data['task']}
 {data['project']} {data['status']}
-🔗 <b>Ссылка:</b> {data.get('link', 'не указана')}
+{deadline}🔗 <b>Ссылка:</b> {data.get('link', 'не указана')}
 🔍 <b>Проверить:</b> {data.get('check', 'не указано')}
 🎯 <b>Отправлено через бота</b>
 """
+
+async def finish_done(event, state: FSMContext, data):
+    data.pop('typed', None)
+    # Выбранный или совпавший по названию открытый дедлайн меняет статус в своем посте
+    chat_id = (await tenant_chats(event))['chat_id']
+    deadline_id = data.pop('deadline', None) or deadlines.match(chat_id, data['project'], data['task'])
+    deadline = deadlines.get(deadline_id, chat_id) if deadline_id else None
+    if deadline is not None:
+        deadline = await change_status(deadline['id'], data['status'])
+    if deadline is not None:
+        data['deadline'] = deadline['id']
+        link = message_link(deadline['chat_id'], deadline['message_id'])
+        if link:
+            data['deadline_link'] = link
     
-    try:
-        await bot.send_message(
-            chat_id=CHATS['chat_id'],
-            message_thread_id=CHATS['done'],
-            text=text
-        )
-        await message.answer("✅ Задача отмечена как выполненная!")
-    except Exception as e:
-        logger.error(f"Ошибка: {e}")
-        await message.answer("❌ Ошибка отправки.")
+    ok, result = await publish_item('done', 'done', data, done_post(data), event)
+    if ok:
+        result = "✅ Задача отмечена как выполненная!"
+        if deadline is not None:
+            result += f"\n📅 Статус дедлайна обновлен: {data['status']}"
+    await wizard.show(event, state, result)
     
     await state.clear()
 
 # ==================== КОМАНДА /IDEA ====================
 @dp.message(Command("idea"))
 async def cmd_idea(message: types.Message, state: FSMContext):
-    """Предложить идею"""
-    if CHATS['ideas'] == 0:
-        await message.answer("❌ Тема для идей не настроена. Используйте /setall")
+    """Предложить идею (или сразу: /idea moto medium Новый лендинг | Больше заявок)"""
+    chats = await tenant_chats(message)
+    if chats['ideas'] == 0:
+        await message.answer("❌ Тема для идей не настроена. Используйте /bind и /settopic в форуме команды")
         return
     
-    await state.set_state(IdeaForm.project)
-    await message.answer("💡 <b>ПРЕДЛОЖЕНИЕ ИДЕИ</b>\n\nВыберите проект:", 
-                        reply_markup=projects_keyboard("idea"))
+    await start_form(message, state, 'idea')
 
-@dp.callback_query(lambda c: c.data.startswith('idea_'), IdeaForm.project)
-async def idea_project(callback: types.CallbackQuery, state: FSMContext):
-    key = callback.data.replace('idea_', '')
+@callbacks.register('idea', 'project', IdeaForm.project)
+async def idea_project(callback: types.CallbackQuery, key: str, state: FSMContext):
     if key in PROJECTS:
         await state.update_data(project=PROJECTS[key])
         await callback.answer()
-        await state.set_state(IdeaForm.idea)
-        await callback.message.answer("💡 Опишите вашу идею:")
+        await ask_next(callback, state, 'idea')
 
 @dp.message(IdeaForm.idea)
 async def idea_text(message: types.Message, state: FSMContext):
     await state.update_data(idea=message.text)
-    await state.set_state(IdeaForm.priority)
-    await message.answer("🎯 Выберите приоритет:", reply_markup=priorities_keyboard("idea_prio"))
+    await ask_next(message, state, 'idea')
 
-@dp.callback_query(lambda c: c.data.startswith('idea_prio_'), IdeaForm.priority)
-async def idea_priority(callback: types.CallbackQuery, state: FSMContext):
-    key = callback.data.replace('idea_prio_', '')
+@callbacks.register('idea', 'priority', IdeaForm.priority)
+async def idea_priority(callback: types.CallbackQuery, key: str, state: FSMContext):
     if key in PRIORITIES:
         await state.update_data(priority=PRIORITIES[key])
         await callback.answer()
-        await state.set_state(IdeaForm.benefit)
-        await callback.message.answer("📈 Какая польза от этой идеи? (опишите кратко):")
+        await ask_next(callback, state, 'idea')
 
 @dp.message(IdeaForm.benefit)
 async def idea_benefit(message: types.Message, state: FSMContext):
     await state.update_data(benefit=message.text)
-    data = await state.get_data()
-    
-    text = f"""
+    await ask_next(message, state, 'idea')
+
+def idea_post(data):
+    return f"""
 💡 <b>ИДЕЯ:</b> {data['idea']}
 {data['project']} {data['priority']}
 📈 <b>Польза:</b> {data.get('benefit', 'не указана')}
 🎯 <b>Предложено через бота</b>
 """
-    
-    try:
-        await bot.send_message(
-            chat_id=CHATS['chat_id'],
-            message_thread_id=CHATS['ideas'],
-            text=text
-        )
-        await message.answer("✅ Идея предложена в тему 'Идеи и предложения'!")
-    except Exception as e:
-        logger.error(f"Ошибка: {e}")
-        await message.answer("❌ Ошибка отправки.")
+
+async def finish_idea(event, state: FSMContext, data):
+    ok, result = await publish_item('idea', 'ideas', data, idea_post(data), event)
+    await wizard.show(event, state, "✅ Идея предложена в тему 'Идеи и предложения'!" if ok else result)
     
     await state.clear()
 
 # ==================== КОМАНДА /RESOURCE ====================
 @dp.message(Command("resource"))
 async def cmd_resource(message: types.Message, state: FSMContext):
-    """Добавить ресурс"""
-    if CHATS['resources'] == 0:
-        await message.answer("❌ Тема для ресурсов не настроена. Используйте /setall")
+    """Добавить ресурс (или сразу: /resource print doc ТЗ https://...)"""
+    chats = await tenant_chats(message)
+    if chats['resources'] == 0:
+        await message.answer("❌ Тема для ресурсов не настроена. Используйте /bind и /settopic в форуме команды")
         return
     
-    await state.set_state(ResourceForm.project)
-    await message.answer("🗃 <b>ДОБАВЛЕНИЕ РЕСУРСА</b>\n\nВыберите проект:", 
-                        reply_markup=projects_keyboard("resource"))
+    await start_form(message, state, 'resource')
 
-@dp.callback_query(lambda c: c.data.startswith('resource_'), ResourceForm.project)
-async def resource_project(callback: types.CallbackQuery, state: FSMContext):
-    key = callback.data.replace('resource_', '')
+@callbacks.register('resource', 'project', ResourceForm.project)
+async def resource_project(callback: types.CallbackQuery, key: str, state: FSMContext):
     if key in PROJECTS:
         await state.update_data(project=PROJECTS[key])
         await callback.answer()
-        await state.set_state(ResourceForm.resource_type)
-        await callback.message.answer("📎 Выберите тип ресурса:", reply_markup=resource_types_keyboard("res_type"))
+        await ask_next(callback, state, 'resource')
 
-@dp.callback_query(lambda c: c.data.startswith('res_type_'), ResourceForm.resource_type)
-async def resource_type_handler(callback: types.CallbackQuery, state: FSMContext):
-    key = callback.data.replace('res_type_', '')
+@callbacks.register('resource', 'resource_type', ResourceForm.resource_type)
+async def resource_type_handler(callback: types.CallbackQuery, key: str, state: FSMContext):
     if key in RESOURCE_TYPES:
         await state.update_data(resource_type=RESOURCE_TYPES[key])
         await callback.answer()
-        await state.set_state(ResourceForm.description)
-        await callback.message.answer("📝 Опишите ресурс (что это, для чего):")
+        await ask_next(callback, state, 'resource')
 
 @dp.message(ResourceForm.description)
 async def resource_description(message: types.Message, state: FSMContext):
     await state.update_data(description=message.text)
-    await state.set_state(ResourceForm.link)
-    await message.answer("🔗 Ссылка на ресурс (если есть, или напишите 'нет'):")
+    await ask_next(message, state, 'resource')
 
 @dp.message(ResourceForm.link)
 async def resource_link(message: types.Message, state: FSMContext):
     link = message.text if message.text.lower() != 'нет' else 'не указана'
     await state.update_data(link=link)
-    data = await state.get_data()
-    
-    text = f"""
+    await ask_next(message, state, 'resource')
+
+def resource_post(data):
+    return f"""
 🗃 <b>РЕСУРС:</b> {data['resource_type']}
 {data['project']}
 📝 <b>Описание:</b> {data.get('description', 'не указано')}
 🔗 <b>Ссылка:</b> {data.get('link', 'не указана')}
 🎯 <b>Добавлено через бота</b>
 """
-    
-    try:
-        await bot.send_message(
-            chat_id=CHATS['chat_id'],
-            message_thread_id=CHATS['resources'],
-            text=text
-        )
-        await message.answer("✅ Ресурс добавлен в тему 'Ресурсы и документы'!")
-    except Exception as e:
-        logger.error(f"Ошибка: {e}")
-        await message.answer("❌ Ошибка отправки.")
+
+async def finish_resource(event, state: FSMContext, data):
+    ok, result = await publish_item('resource', 'resources', data, resource_post(data), event)
+    await wizard.show(event, state, "✅ Ресурс добавлен в тему 'Ресурсы и документы'!" if ok else result)
     
     await state.clear()
 
 # ==================== КОМАНДА /REPORT ====================
 @dp.message(Command("report"))
 async def cmd_report(message: types.Message, state: FSMContext):
-    """Создать отчет"""
-    if CHATS['reports'] == 0:
-        await message.answer("❌ Тема для отчетов не настроена. Используйте /setall")
+    """Создать отчет (или сразу: /report week Все по плану)"""
+    chats = await tenant_chats(message)
+    if chats['reports'] == 0:
+        await message.answer("❌ Тема для отчетов не настроена. Используйте /bind и /settopic в форуме команды")
         return
     
-    await state.set_state(ReportForm.period)
-    await message.answer("📊 <b>СОЗДАНИЕ ОТЧЕТА</b>\n\nВыберите период:", reply_markup=period_keyboard())
+    args = command_args(message)
+    data = quick.parse('report', args) if args else {}
+    await state.set_data({})
+    period = report_period(data['period']) if 'period' in data else None
+    if period is None:
+        await state.set_state(ReportForm.period)
+        await wizard.show(message, state, "📊 <b>СОЗДАНИЕ ОТЧЕТА</b>\n\nВыберите период:", period_keyboard())
+    elif 'comment' in data:
+        await finish_report(message, state, await build_report(chats['chat_id'], *period), data['comment'])
+    else:
+        await show_report(message, state, *period)
 
-@dp.callback_query(lambda c: c.data.startswith('period_'), ReportForm.period)
-async def report_period_handler(callback: types.CallbackQuery, state: FSMContext):
-    period_type = callback.data.replace('period_', '')
+def report_period(value):
+    """(заголовок, первый день, последний день) для day/week/month или "ДД.ММ-ДД.ММ", иначе None"""
     today = datetime.now().strftime("%d.%m.%Y")
-    
     periods = {
         'day': f"За день {today}",
         'week': f"За неделю {today}",
-        'month': f"За месяц {datetime.now().strftime('%m.%Y')}",
-        'custom': "Другой период"
+        'month': f"За месяц {datetime.now().strftime('%m.%Y')}"
     }
-    
+    if value in periods:
+        return (periods[value], *period_range(value))
+    period = parse_period(value)
+    if not period:
+        return None
+    start, end = period
+    return f"{start.strftime('%d.%m.%Y')} - {end.strftime('%d.%m.%Y')}", start, end
+
+@callbacks.register('report', 'period', ReportForm.period)
+async def report_period_handler(callback: types.CallbackQuery, period_type: str, state: FSMContext):
+    await callback.answer()
     if period_type == 'custom':
-        await callback.message.answer("📅 Введите период отчета (например: 'За неделю 24-30.04'):")
+        await wizard.show(callback, state,
+                          "📅 Введите период отчета в формате <b>ДД.ММ-ДД.ММ</b> (например: 24.04-30.04):")
         await state.set_state(ReportForm.period)
-    else:
-        await state.update_data(period=periods[period_type])
-        await callback.answer()
-        await state.set_state(ReportForm.projects)
-        await callback.message.answer("🎯 Над какими проектами работали? (перечислите через запятую):")
+    elif period_type in REPORT_PERIODS:
+        await show_report(callback, state, *report_period(period_type))
 
 @dp.message(ReportForm.period)
 async def report_period_custom(message: types.Message, state: FSMContext):
-    await state.update_data(period=message.text)
-    await state.set_state(ReportForm.projects)
-    await message.answer("🎯 Над какими проектами работали? (перечислите через запятую):")
-
-@dp.message(ReportForm.projects)
-async def report_projects(message: types.Message, state: FSMContext):
-    await state.update_data(projects=message.text)
-    await state.set_state(ReportForm.completed)
-    await message.answer("✅ Что сделано за этот период? (перечислите задачи):")
-
-@dp.message(ReportForm.completed)
-async def report_completed(message: types.Message, state: FSMContext):
-    await state.update_data(completed=message.text)
-    await state.set_state(ReportForm.problems)
-    await message.answer("⚠️ Были ли проблемы или блокеры? (если нет, напишите 'нет'):")
-
-@dp.message(ReportForm.problems)
-async def report_problems(message: types.Message, state: FSMContext):
-    problems = message.text if message.text.lower() != 'нет' else 'нет проблем'
-    await state.update_data(problems=problems)
-    await state.set_state(ReportForm.plans)
-    await message.answer("📅 Планы на следующий период:")
-
-@dp.message(ReportForm.plans)
-async def report_plans(message: types.Message, state: FSMContext):
-    await state.update_data(plans=message.text)
+    period = report_period(message.text)
+    if not period:
+        await wizard.show(message, state,
+                          "❌ Не понял период. Введите в формате <b>ДД.ММ-ДД.ММ</b> (например: 24.04-30.04):")
+        return
+    await show_report(message, state, *period)
+
+async def build_report(chat_id, title, start, end):
+    """Собирает отчет форума chat_id из дневных счетчиков"""
+    if SHARD_COUNT > 1:
+        # Задачи пишут все воркеры, а счетчики в памяти знают только о своих
+        await reports.load(tasks)
+    return reports.build(chat_id, title, start, end, PROJECTS.values())
+
+async def show_report(event, state: FSMContext, title, start, end):
+    """Собирает отчет и предлагает дописать комментарий"""
+    summary = await build_report((await tenant_chats(event))['chat_id'], title, start, end)
+    await state.update_data(period=title, summary=summary)
+    await state.set_state(ReportForm.comment)
+    await wizard.show(event, state, f"{summary}\n\n📝 Добавьте комментарий (проблемы, планы) или напишите 'нет':")
+
+@dp.message(ReportForm.comment)
+async def report_comment(message: types.Message, state: FSMContext):
     data = await state.get_data()
-    
-    text = f"""
-📊 <b>ОТЧЕТ:</b> {data['period']}
-
-🎯 <b>Проекты:</b> {data.get('projects', 'не указано')}
-
-✅ <b>Сделано:</b>
-{data.get('completed', 'не указано')}
+    await finish_report(message, state, data['summary'], message.text)
 
-⚠️ <b>Проблемы:</b> {data.get('problems', 'нет проблем')}
-
-📅 <b>Планы:</b> {data.get('plans', 'не указано')}
-
-📝 <b>Отчет создан через бота</b>
-"""
+async def finish_report(message: types.Message, state: FSMContext, summary, comment):
+    text = summary
+    if comment and comment.lower() != 'нет':
+        text += f"\n\n📝 <b>Комментарий:</b> {comment}"
+    text += "\n\n📝 <b>Отчет создан через бота</b>"
     
-    try:
-        await bot.send_message(
-            chat_id=CHATS['chat_id'],
-            message_thread_id=CHATS['reports'],
-            text=text
-        )
-        await message.answer("✅ Отчет создан в теме 'Отчеты'!")
-    except Exception as e:
-        logger.error(f"Ошибка: {e}")
-        await message.answer("❌ Ошибка отправки.")
+    ok, result = await send_to_topic('reports', text, chats=await tenant_chats(message))
+    await wizard.show(message, state, "✅ Отчет создан в теме 'Отчеты'!" if ok else result)
     
     await state.clear()
 
+FORM_FINISHERS = {
+    'deadline': finish_deadline,
+    'question': finish_question,
+    'done': finish_done,
+    'idea': finish_idea,
+    'resource': finish_resource
+}
+
+# Текст поста и тема форума для элементов каждого вида (формы и /import)
+FORM_POSTS = {
+    'deadline': deadline_post,
+    'question': question_post,
+    'done': done_post,
+    'idea': idea_post,
+    'resource': resource_post
+}
+FORM_TOPICS = {
+    'deadline': 'deadlines',
+    'question': 'questions',
+    'done': 'done',
+    'idea': 'ideas',
+    'resource': 'resources'
+}
+
 # ==================== ИНФОРМАЦИОННЫЕ КОМАНДЫ ====================
 @dp.message(Command("projects"))
 async def cmd_projects(message: types.Message):
@@ -689,19 +1171,378 @@ async def cmd_priorities(message: types.Message):
     text = "🎯 <b>ПРИОРИТЕТЫ:</b>\n\n" + "\n".join([f"• {name}" for name in PRIORITIES.values()])
     await message.answer(text)
 
+def resolve_catalog(items_dict, value):
+    """Находит значение справочника по ключу (bm) или хэштегу (#Boost_Marine)"""
+    value = value.lower().lstrip('#')
+    for key, name in items_dict.items():
+        if value == key or value == name.lower().lstrip('#'):
+            return name
+    return None
+
+@dp.message(Command("list"))
+async def cmd_list(message: types.Message):
+    """Задачи проекта из хранилища (только форума этой команды): /list <проект> [статус]"""
+    args = (message.text or '').split()[1:]
+    project = resolve_catalog(PROJECTS, args[0]) if args else None
+    if not project:
+        await message.answer(
+            "📋 Использование: <code>/list проект [статус]</code>\n"
+            "Например: <code>/list bm</code> или <code>/list bm done</code>\n\n"
+            "Проекты: " + ", ".join(PROJECTS)
+        )
+        return
+    
+    if len(args) > 1:
+        status = resolve_catalog(STATUSES, args[1])
+        if not status:
+            await message.answer("❌ Неизвестный статус. Список: /statuses")
+            return
+        statuses = [status]
+    else:
+        # По умолчанию — все незавершенные
+        statuses = [name for key, name in STATUSES.items() if key != 'done']
+    
+    items = await tasks.list((await tenant_chats(message))['chat_id'], project, statuses)
+    if not items:
+        await message.answer(f"📋 {project}: ничего не найдено")
+        return
+    
+    lines = [f"📋 <b>{project}</b> — {', '.join(statuses)}\n"]
+    for item in items:
+        line = f"• {item['title']} {item['status']}"
+        if item['priority']:
+            line += f" {item['priority']}"
+        if item['responsible']:
+            line += f" 👤 {item['responsible']}"
+        if item['due_date']:
+            line += f" 📅 {date.fromisoformat(item['due_date']).strftime('%d.%m')}"
+        lines.append(line)
+    await message.answer("\n".join(lines))
+
+# ==================== СТАТУС ЗАДАЧ ====================
+async def update_post(task):
+    """Правит опубликованный пост задачи под ее текущие поля; False — поста еще нет или его не править"""
+    if not task['message_id']:
+        return False
+    items = await tasks.by_message(task['chat_id'], task['message_id'])
+    # Пост-пачку (импорт или склейка) собираем заново из всех ее задач: других постов в ней нет,
+    # склейка не смешивает посты задач с напоминаниями и заметками о статусе (group='tasks')
+    text = Outbox.DIGEST_SEPARATOR.join(FORM_POSTS[item['kind']](json.loads(item['data'])).strip() for item in items)
+    await outbox.bucket(task['chat_id']).acquire()
+    await outbox.global_bucket.acquire()
+    try:
+        await bot.edit_message_text(text, chat_id=task['chat_id'], message_id=task['message_id'])
+    except TelegramBadRequest as e:
+        if 'not modified' in str(e):
+            return True
+        logger.warning(f"Пост задачи {task['id']} не править: {e}")
+        return False
+    except Exception as e:
+        logger.error(f"Ошибка правки поста задачи {task['id']}: {e}")
+        return False
+    return True
+
+async def change_status(task_id, status):
+    """Новый статус задачи: хранилище, отчеты, поиск, сводка, напоминания и правка ее поста на месте"""
+    result = await tasks.set_status(task_id, status)
+    if result is None:
+        return None
+    old, new = result
+    reports.record(old, -1)
+    reports.record(new)
+    search.add(new)
+    board.track(new)
+    deadlines.track(new)
+    if new['kind'] == 'deadline' and shard_of(new['created_by'], SHARD_COUNT) == SHARD_INDEX:
+        if status == STATUSES['done']:
+            reminders.cancel(task_id)
+        elif new['due_date'] and task_id not in reminders.tasks:
+            reminders.schedule(new)
+    if old['status'] != status and not await update_post(new):
+        # Пост не поправить (еще в очереди или удален) — коротко в ту же тему
+        await outbox.put(new['chat_id'], new['thread_id'], f"🔄 {new['title']}: {old['status']} → {status}")
+    return new
+
+@dp.message(Command("status"))
+async def cmd_status(message: types.Message, state: FSMContext):
+    """Сменить статус открытого дедлайна (или сразу: /status bm @ivan макет done)"""
+    await deadlines.refresh(tasks)
+    args = command_args(message)
+    await state.set_data(quick.parse('status', args) if args else {})
+    await status_pick(message, state)
+
+async def status_pick(event, state: FSMContext):
+    """Открытые дедлайны по фильтрам /status кнопками; если выбор однозначен и статус указан — сразу меняет"""
+    data = await state.get_data()
+    chat_id = (await tenant_chats(event))['chat_id']
+    items, total = deadlines.find(chat_id, data.get('project'), data.get('responsible'), data.get('query'),
+                                  limit=PICK_LIMIT)
+    if not items:
+        await wizard.show(event, state, "📭 Открытых дедлайнов не найдено.\n"
+                                        "Фильтры: <code>/status [проект] [@ответственный] [слова] [статус]</code>")
+        await state.clear()
+        return
+    if total == 1 and 'status' in data:
+        await finish_status(event, state, items[0]['id'], data['status'])
+        return
+    
+    text = f"🔄 <b>СТАТУС ДЕДЛАЙНА</b>\n\nОткрытых: {total}. Выберите задачу"
+    text += f" (показаны ближайшие {len(items)})" if total > len(items) else ""
+    text += " или напишите слова из названия:"
+    await state.set_state(StatusForm.task)
+    await wizard.show(event, state, text, deadlines_keyboard(items, 'status'))
+
+@dp.message(StatusForm.task)
+async def status_query(message: types.Message, state: FSMContext):
+    await state.update_data(query=message.text)
+    await status_pick(message, state)
+
+@callbacks.register('status', 'deadline', StatusForm.task)
+async def status_deadline(callback: types.CallbackQuery, key: str, state: FSMContext):
+    item = deadlines.get(int(key), (await tenant_chats(callback))['chat_id']) if key.isdigit() else None
+    if item is None:
+        await callback.answer("Этот дедлайн уже закрыт")
+        return
+    await callback.answer()
+    data = await state.get_data()
+    if 'status' in data:
+        await finish_status(callback, state, item['id'], data['status'])
+        return
+    await state.update_data(deadline=item['id'])
+    await state.set_state(StatusForm.status)
+    await wizard.show(callback, state, f"🔄 {item['title']}\nСейчас: {item['status']}\n\nВыберите новый статус:",
+                      statuses_keyboard('status'))
+
+@callbacks.register('status', 'status', StatusForm.status)
+async def status_status(callback: types.CallbackQuery, key: str, state: FSMContext):
+    if key in STATUSES:
+        await callback.answer()
+        data = await state.get_data()
+        await finish_status(callback, state, data['deadline'], STATUSES[key])
+
+async def finish_status(event, state: FSMContext, task_id, status):
+    task = await change_status(task_id, status)
+    await wizard.show(event, state, f"✅ {task['title']}: {status}" if task else "❌ Задача не найдена")
+    await state.clear()
+
+# ==================== ПОИСК ====================
+KIND_ICONS = {
+    'deadline': '📅',
+    'question': '❓',
+    'done': '✅',
+    'idea': '💡',
+    'resource': '🗃'
+}
+
+def message_link(chat_id, message_id):
+    """Ссылка на сообщение в супергруппе (t.me/c/...), None для остальных чатов"""
+    chat = str(chat_id or '')
+    if not message_id or not chat.startswith('-100'):
+        return None
+    return f"https://t.me/c/{chat[4:]}/{message_id}"
+
+@dp.message(Command("search"))
+async def cmd_search(message: types.Message):
+    """Поиск по всему, что публиковали формы: /search слова [проект] [статус] [приоритет]"""
+    facets, words = {}, []
+    table = quick.table('search')
+    for word in command_args(message).split():
+        found = table.get(word.lower().lstrip('#'))
+        if found is not None and found[0] not in facets:
+            facets[found[0]] = found[1]
+        else:
+            words.append(word)
+    if not words:
+        await message.answer(
+            "🔎 Использование: <code>/search слова [проект] [статус] [приоритет]</code>\n"
+            "Например: <code>/search макет bm</code> или <code>/search ссылка доступ done</code>"
+        )
+        return
+    
+    chats = await tenant_chats(message)
+    ids = await search.search(' '.join(words), chat_id=chats['chat_id'], **facets)
+    items = await tasks.by_ids(ids)
+    if not items:
+        await message.answer("🔎 Ничего не найдено")
+        return
+    
+    lines = [f"🔎 <b>{' '.join(words)}</b> {' '.join(facets.values())}\n"]
+    for item in items:
+        line = ' '.join(filter(None, (KIND_ICONS.get(item['kind'], '•'), item['title'], item['project'],
+                                      item['status'])))
+        if item['due_date']:
+            line += f" 📅 {date.fromisoformat(item['due_date']).strftime('%d.%m')}"
+        link = message_link(item['chat_id'], item['message_id'])
+        if link:
+            line += f" {link}"
+        lines.append(line)
+    await message.answer("\n".join(lines))
+
+# ==================== ИМПОРТ ====================
+importer = Importer(tasks, outbox, quick, render=lambda kind, data: FORM_POSTS[kind](data), on_added=track_task,
+                    chunk_chars=IMPORT_CHUNK_CHARS, max_pending=IMPORT_MAX_PENDING,
+                    progress_interval=IMPORT_PROGRESS_INTERVAL)
+
+IMPORT_HELP = """
+📥 <b>ИМПОРТ ЗАДАЧ</b>
+
+Отправьте файл CSV или JSONL с подписью <code>/import [вид]</code> (или ответьте /import на файл).
+Вид по умолчанию — deadline; в файле его можно задать колонкой kind.
+
+<b>Колонки:</b>
+• deadline: project, date, task, priority, status, responsible
+• question: project, question, priority, to_who, context
+• done: project, task, status, link, check
+• idea: project, idea, priority, benefit
+• resource: project, resource_type, description, link
+Вместо главного текста можно писать title. Проект, приоритет, статус и тип — ключ (bm) или хэштег.
+
+Пример CSV:
+<code>project,date,task,priority,responsible
+bm,30.04,Сдать макет,high,@ivan</code>
+"""
+
+def import_progress_text(report):
+    """Сообщение о ходе импорта: строки, ошибки, опубликованные посты"""
+    title = "✅ <b>ИМПОРТ ЗАВЕРШЕН</b>" if report.finished else "📥 <b>ИМПОРТ...</b>"
+    elapsed = int(time.monotonic() - report.started)
+    text = f"""{title} {report.file_name or ''}
+
+• Прочитано строк: <code>{report.row}</code>{' (продолжение после перезапуска)' if report.resumed else ''}
+• Добавлено задач: <code>{report.added}</code>, опубликовано: <code>{report.posted}</code>
+• Сообщений в темы: <code>{report.messages}</code>
+• Ошибок: <code>{report.errors}</code>
+• Время: <code>{elapsed // 60} мин {elapsed % 60} с</code>
+"""
+    if report.samples:
+        text += "\n<b>Ошибки:</b>\n" + "\n".join(f"• строка {row}: {error}" for row, error in report.samples)
+        if report.errors > len(report.samples):
+            text += f"\n… и еще {report.errors - len(report.samples)}"
+    return text
+
+def launch_import(state):
+    """Скачивает файл импорта во временный файл и импортирует его в фоне с сообщением о ходе"""
+    async def job():
+        chats = await tenants.resolve(state['chat_id'], state['user_id'])
+        targets = {kind: topic_target(chat_type, chats) for kind, chat_type in FORM_TOPICS.items()}
+        status = await bot.send_message(state['chat_id'], "📥 Импорт: скачиваю файл...")
+
+        async def progress(report):
+            with suppress(TelegramBadRequest):  # "message is not modified"
+                await bot.edit_message_text(import_progress_text(report), chat_id=status.chat.id,
+                                            message_id=status.message_id)
+
+        fd, path = tempfile.mkstemp(prefix='import-', suffix=os.path.splitext(state['file_name'] or '')[1])
+        os.close(fd)
+        try:
+            await bot.download(state['file_id'], destination=path)
+            await importer.run(state, path, targets, created_by=state['user_id'], progress=progress)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Ошибка импорта {state['key']}: {e}")
+            await bot.send_message(state['chat_id'], f"❌ Импорт прерван: {e}\nОтправьте /import с тем же файлом, "
+                                                     "чтобы продолжить")
+        finally:
+            os.remove(path)
+
+    return importer.spawn(state['key'], job())
+
+@dp.message(Command("import"))
+async def cmd_import(message: types.Message):
+    """Импорт задач из CSV/JSONL: файл с подписью /import [вид] или ответ /import на файл"""
+    if not await is_forum_admin(message):
+        await message.answer("⛔ Только для администратора")
+        return
+    
+    document = message.document or (message.reply_to_message and message.reply_to_message.document)
+    if document is None:
+        await message.answer(IMPORT_HELP)
+        return
+    kind = (command_args(message).split() or ['deadline'])[0].lower()
+    if kind not in IMPORT_FIELDS:
+        await message.answer(f"❌ Вид задач: {', '.join(IMPORT_FIELDS)}")
+        return
+    if (document.file_size or 0) > IMPORT_MAX_BYTES:
+        await message.answer("❌ Файл больше 20 МБ — Telegram не отдает ботам такие файлы. Разбейте его на части")
+        return
+    
+    chats = await tenant_chats(message)
+    # Один и тот же файл в один форум импортируется один раз: повтор продолжает прерванный импорт
+    key = f"import:{chats['chat_id']}:{document.file_unique_id}"
+    if key in importer.running:
+        await message.answer("⏳ Этот файл уже импортируется")
+        return
+    state = await tasks.start_import(key, document.file_id, document.file_name, kind, message.chat.id,
+                                     message.from_user.id)
+    if state['finished']:
+        await message.answer(f"ℹ️ Этот файл уже импортирован: добавлено задач {state['added']}, "
+                             f"ошибок {state['errors']}")
+        return
+    launch_import(state)
+
 # ==================== ОБРАБОТКА НЕИЗВЕСТНЫХ КОМАНД ====================
 @dp.message()
 async def handle_unknown(message: types.Message):
-    """Обработка неизвестных команд"""
-    if message.text.startswith('/'):
+    """Обработка неизвестных команд (в группах молчим: там бывают команды других ботов)"""
+    if message.chat.type != 'private' or not (message.text or '').startswith('/'):
+        return
+    # На поток неизвестных команд отвечаем не чаще раза в несколько секунд
+    if flood.may_notify(message.from_user.id):
         await message.answer(
             "❌ <b>Неизвестная команда</b>\n\n"
             "Используйте /help для просмотра доступных команд"
         )
 
 # ==================== ЗАПУСК БОТА ====================
-async def main():
-    logger.info("🤖 Бот запускается...")
+@dp.startup()
+async def on_startup(bot: Bot):
+    global metrics_runner
+    await tenants.load()
+    await reports.load(tasks)
+    await search.load(tasks)
+    await board.load()
+    await deadlines.load(tasks)
+    await people.load()
+    await outbox.load()
+    outbox.start(bot)
+    board.start(bot)
+    # Каждый воркер напоминает о дедлайнах тех, чьи апдейты он обрабатывает
+    reminders.rebuild(task for task in await tasks.open_deadlines()
+                      if shard_of(task['created_by'], SHARD_COUNT) == SHARD_INDEX)
+    reminders.start()
+    # Импорты, прерванные остановкой бота, продолжаются с последней записанной строки
+    for state in await tasks.unfinished_imports():
+        if shard_of(state['user_id'], SHARD_COUNT) == SHARD_INDEX:
+            launch_import(state)
+    storage.start()
+    if CONFIG_WATCH_INTERVAL:
+        config_watcher.hooks.append(tenants.refresh)
+        config_watcher.start()
+    if METRICS_PORT:
+        metrics_runner = await serve_metrics(metrics, METRICS_HOST, METRICS_PORT + SHARD_INDEX)
+
+@dp.shutdown()
+async def on_shutdown(bot: Bot):
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+    await config_watcher.stop()
+    await storage.stop()
+    await reminders.stop()
+    await importer.stop()
+    await board.stop()
+    await outbox.stop()
+    logger.info(f"📤 Очередь отправки: {outbox.stats()}")
+    logger.info(f"🚦 Защита от флуда: {flood.stats()}")
+    logger.info(f"📨 Обработка апдейтов: {scheduler.stats()}")
+    await outbox.store.close()
+    await search.close()
+    await people.close()
+    await tasks.close()
+    await tenants.close()
+
+async def main(mode=BOT_MODE, workers=BOT_WORKERS):
+    logger.info(f"🤖 Бот запускается (режим: {mode})...")
     logger.info(f"Админ ID: {ADMIN_ID}")
     
     # Проверяем настройки
@@ -709,11 +1550,31 @@ async def main():
     logger.info(f"Настроено тем: {configured}/7")
     
     if configured == 0:
-        logger.info("⚠️ Темы не настроены. Используйте команду /setall")
+        logger.info("⚠️ Темы не настроены. Используйте /setall или /bind и /settopic в форуме команды")
     else:
         logger.info("✅ Темы настроены, бот готов к работе")
     
-    await dp.start_polling(bot)
+    if mode == 'webhook' and not WEBHOOK_URL:
+        logger.error("❌ Для режима webhook укажите WEBHOOK_URL в .env")
+        return
+    
+    if workers > 1:
+        await run_supervisor(bot, workers, mode, WEBHOOK_URL, path=WEBHOOK_PATH, host=WEBHOOK_HOST,
+                             port=WEBHOOK_PORT, secret_token=WEBHOOK_SECRET or None,
+                             max_concurrency=WEBHOOK_MAX_CONCURRENCY)
+    elif mode == 'webhook':
+        await run_webhook(dp, bot, scheduler, WEBHOOK_URL, path=WEBHOOK_PATH, host=WEBHOOK_HOST, port=WEBHOOK_PORT,
+                          secret_token=WEBHOOK_SECRET or None, max_concurrency=WEBHOOK_MAX_CONCURRENCY)
+    else:
+        # getUpdates не работает, пока у бота установлен вебхук
+        await bot.delete_webhook()
+        await run_polling(dp, bot, scheduler)
 
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Agile Team Bot")
+    parser.add_argument('--mode', choices=['polling', 'webhook'], default=BOT_MODE,
+                        help="способ получения апдейтов (по умолчанию BOT_MODE из .env)")
+    parser.add_argument('--workers', type=int, default=BOT_WORKERS,
+                        help="число процессов-воркеров (по умолчанию BOT_WORKERS из .env, 1 — без супервизора)")
+    args = parser.parse_args()
+    asyncio.run(main(args.mode, args.workers))
\ No newline at end of file
@@ -0,0 +1,69 @@
+import logging
+
+from aiogram.filters.callback_data import CallbackData
+
+logger = logging.getLogger(__name__)
+
+
+class FormCallback(CallbackData, prefix='f'):
+    """Данные кнопки формы: f:<форма>:<поле>:<значение>"""
+    form: str
+    field: str
+    value: str
+
+
+PREFIX = FormCallback.__prefix__ + FormCallback.__separator__
+
+
+def unpack(data):
+    """Быстрый разбор FormCallback без валидации: (форма, поле, значение)"""
+    _, form, field, value = data.split(FormCallback.__separator__, 3)
+    return form, field, value
+
+
+class CallbackRouter:
+    """Диспетчер нажатий кнопок форм.
+
+    Вместо цепочки фильтров c.data.startswith(...), которые aiogram
+    проверяет по очереди, в Dispatcher регистрируется один обработчик
+    FormCallback, а нужная функция находится по ключу (форма, поле)
+    в словаре — время выбора не зависит от числа форм.
+    """
+
+    def __init__(self):
+        self.handlers = {}
+
+    def register(self, form, field, state=None):
+        """Декоратор: handler(callback, value, state) для кнопок (form, field).
+
+        Если указан state, кнопка срабатывает только в этом состоянии FSM.
+        """
+        def decorator(handler):
+            key = (form, field)
+            if key in self.handlers:
+                raise ValueError(f"Обработчик для {form}:{field} уже зарегистрирован")
+            self.handlers[key] = (handler, state.state if state is not None else None)
+            return handler
+        return decorator
+
+    def resolve(self, form, field):
+        return self.handlers.get((form, field))
+
+    async def dispatch(self, callback, state):
+        try:
+            form, field, value = unpack(callback.data)
+        except ValueError:
+            form = field = value = None
+        entry = self.handlers.get((form, field))
+        if entry is None:
+            logger.warning(f"Нет обработчика для кнопки {callback.data}")
+            await callback.answer()
+            return
+
+        handler, expected_state = entry
+        if expected_state is not None and await state.get_state() != expected_state:
+            # Кнопка из старого сообщения: форма уже на другом шаге
+            await callback.answer()
+            return
+
+        await handler(callback, value, state)
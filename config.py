@@ -1,18 +1,74 @@
+import asyncio
+import logging
 import os
 import json
+import tempfile
 from dotenv import load_dotenv
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+# ==================== СПРАВОЧНИКИ ====================
+class Catalog(dict):
+    """Справочник (проекты, статусы...), который считает свои изменения.
+
+    version растет при любом изменении — по нему кэш клавиатур понимает,
+    что справочник поменялся на лету.
+    """
+    version = 0
+
+    def _changed(self):
+        self.version += 1
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self._changed()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._changed()
+
+    def __ior__(self, other):
+        result = super().__ior__(other)
+        self._changed()
+        return result
+
+    def update(self, *args, **kwargs):
+        super().update(*args, **kwargs)
+        self._changed()
+
+    def clear(self):
+        super().clear()
+        self._changed()
+
+    def pop(self, *args):
+        result = super().pop(*args)
+        self._changed()
+        return result
+
+    def popitem(self):
+        result = super().popitem()
+        self._changed()
+        return result
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self._changed()
+        return super().setdefault(key, default)
+
 # ==================== БАЗОВЫЕ НАСТРОЙКИ ====================
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 ADMIN_ID = int(os.getenv('ADMIN_ID', 0))
 
+# Свой сервер Bot API (например, поддельный из fake_api.py для нагрузочных тестов); пусто — api.telegram.org
+BOT_API_URL = os.getenv('BOT_API_URL', '')
+
 # Файл для хранения настроек чатов
 CHATS_FILE = 'chats.json'
 
 # ==================== ХЭШТЕГИ ПРОЕКТОВ ====================
-PROJECTS = {
+PROJECTS = Catalog({
     'bm': '#Boost_Marine',
     'moto': '#Boost_Moto', 
     'print': '#Revolution_Print',
@@ -20,74 +76,352 @@ PROJECTS = {
     'games': '#Pavel_Game',
     'denis': '#Denis_Crimea',
     'platform': '#Agile_Business_Platform'
-}
+})
 
 # ==================== СТАТУСЫ ====================
-STATUSES = {
+STATUSES = Catalog({
     'doing': '#Делаю',
     'waiting': '#Жду', 
     'done': '#Готово',
     'review': '#Проверка',
     'blocked': '#Препятствие'
-}
+})
 
 # ==================== ПРИОРИТЕТЫ ====================
-PRIORITIES = {
+PRIORITIES = Catalog({
     'critical': '#Критический',
     'high': '#Высокий',
     'medium': '#Средний', 
     'low': '#Низкий'
-}
+})
 
 # ==================== ТИПЫ РЕСУРСОВ ====================
-RESOURCE_TYPES = {
+RESOURCE_TYPES = Catalog({
     'doc': '📄 Документ',
     'link': '🔗 Ссылка',
     'access': '🔑 Доступ',
     'file': '📎 Файл',
     'design': '🎨 Дизайн',
     'code': '💻 Код'
+})
+
+# ==================== РЕЖИМ ЗАПУСКА ====================
+# polling - long polling, webhook - aiohttp-сервер за TLS-прокси (nginx, caddy)
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')  # публичный адрес, например https://bot.example.com/webhook
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '127.0.0.1')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', 8080))
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET', '')
+WEBHOOK_MAX_CONCURRENCY = int(os.getenv('WEBHOOK_MAX_CONCURRENCY', 40))  # одновременных соединений от Telegram
+
+# ==================== НЕСКОЛЬКО ПРОЦЕССОВ ====================
+# BOT_WORKERS > 1 — супервизор раздает апдейты стольким процессам-воркерам по id пользователя.
+# SHARD_INDEX и SHARD_COUNT супервизор выставляет воркерам сам.
+BOT_WORKERS = int(os.getenv('BOT_WORKERS', 1))
+SHARD_INDEX = int(os.getenv('SHARD_INDEX', 0))
+SHARD_COUNT = int(os.getenv('SHARD_COUNT', 1))
+
+# ==================== ОБРАБОТКА АПДЕЙТОВ ====================
+# Сколько апдейтов обрабатывается одновременно (в каждом воркере); апдейты одного пользователя — всегда по очереди
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', 40))
+# Сколько принятых апдейтов может ждать обработки, прежде чем прием притормозит
+UPDATE_MAX_PENDING = int(os.getenv('UPDATE_MAX_PENDING', 1000))
+# Сколько апдейтов одного пользователя может ждать в очереди (лишние отбрасываются)
+UPDATE_USER_QUEUE = int(os.getenv('UPDATE_USER_QUEUE', 100))
+
+# ==================== МЕТРИКИ ====================
+# Метрики в формате Prometheus на http://METRICS_HOST:METRICS_PORT/metrics (0 — не поднимать сервер).
+# Воркеры в режиме нескольких процессов слушают METRICS_PORT + номер воркера.
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', 0))
+
+# ==================== ОЧЕРЕДЬ ОТПРАВКИ ====================
+# Telegram пропускает примерно 20 сообщений в минуту в одну группу
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', 4))
+OUTBOX_RATE_PER_MINUTE = int(os.getenv('OUTBOX_RATE_PER_MINUTE', 20))
+OUTBOX_BURST = int(os.getenv('OUTBOX_BURST', 3))
+# Общий лимит бота на все чаты вместе (сообщений в секунду)
+OUTBOX_GLOBAL_RATE = int(os.getenv('OUTBOX_GLOBAL_RATE', 30))
+# Журнал неотправленных сообщений: повторы после 429 и сбоев сети переживают перезапуск
+OUTBOX_DB_FILE = os.getenv('OUTBOX_DB_FILE', 'outbox.db')
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', 8))
+# Сколько повторов в секунду возвращается в очередь после сбоя (чтобы не поймать новый флуд-бан)
+OUTBOX_RETRY_RATE = float(os.getenv('OUTBOX_RETRY_RATE', 1))
+
+# ==================== ХРАНИЛИЩЕ FSM ====================
+# Файл SQLite с незаконченными диалогами (переживает перезапуск бота)
+FSM_STORAGE_FILE = os.getenv('FSM_STORAGE_FILE', 'fsm.db')
+# Сколько секунд незаконченная форма ждет пользователя (0 — без ограничения)
+FSM_TTL_DEFAULT = int(os.getenv('FSM_TTL', 24 * 3600))
+FSM_TTL = {
+    'default': FSM_TTL_DEFAULT,
+    # Отчет собирается за минуты: брошенный на середине уже неактуален
+    'ReportForm': min(FSM_TTL_DEFAULT, 3600) if FSM_TTL_DEFAULT else 3600,
+    # Смена статуса — тоже дело минуты
+    'StatusForm': min(FSM_TTL_DEFAULT, 3600) if FSM_TTL_DEFAULT else 3600,
 }
+# Предел диалогов и байт данных форм в памяти: сверх него вытесняются самые давние (0 — без предела)
+FSM_MAX_DIALOGS = int(os.getenv('FSM_MAX_DIALOGS', 100000))
+FSM_MAX_BYTES = int(os.getenv('FSM_MAX_BYTES', 0))
+# Писать ли пользователю, что его черновик удален
+FSM_EXPIRE_NOTICE = os.getenv('FSM_EXPIRE_NOTICE', '1') == '1'
+
+# ==================== ЗАЩИТА ОТ ФЛУДА ====================
+# Апдейтов в секунду и запас на всплеск от одного пользователя (0 — без ограничений)
+FLOOD_USER_RATE = float(os.getenv('FLOOD_USER_RATE', 2))
+FLOOD_USER_BURST = int(os.getenv('FLOOD_USER_BURST', 10))
+# То же для группы целиком (для всех ее участников вместе)
+FLOOD_CHAT_RATE = float(os.getenv('FLOOD_CHAT_RATE', 10))
+FLOOD_CHAT_BURST = int(os.getenv('FLOOD_CHAT_BURST', 50))
+# Сообщение сверх лимита ждет токена не дольше стольких секунд, потом отбрасывается
+FLOOD_MAX_DELAY = float(os.getenv('FLOOD_MAX_DELAY', 2))
+
+# ==================== МАСТЕР ФОРМ ====================
+# 1 — форма живет в одном сообщении, шаги его правят; 0 — каждый шаг новым сообщением
+FORM_WIZARD = os.getenv('FORM_WIZARD', '1') == '1'
+
+# ==================== ХРАНИЛИЩЕ ЗАДАЧ ====================
+# Все заполненные формы (дедлайны, вопросы, готовое, идеи, ресурсы)
+TASKS_DB_FILE = os.getenv('TASKS_DB_FILE', 'tasks.db')
+
+# ==================== ПОИСК ====================
+# Индекс /search по текстам всех форм (SQLite FTS5)
+SEARCH_DB_FILE = os.getenv('SEARCH_DB_FILE', 'search.db')
+
+# ==================== СВОДКИ ТЕМ ====================
+# Закрепленная сводка открытых задач перерисовывается не чаще раза в BOARD_DEBOUNCE секунд
+BOARD_DEBOUNCE = float(os.getenv('BOARD_DEBOUNCE', '3'))
+# С несколькими воркерами: как часто сводка подхватывает задачи из других воркеров
+BOARD_REFRESH_INTERVAL = float(os.getenv('BOARD_REFRESH_INTERVAL', '60'))
+
+# ==================== ИМПОРТ ====================
+# /import: строки файла склеиваются в посты до IMPORT_CHUNK_CHARS символов (лимит Telegram — 4096);
+# чтение файла ждет, пока в массовой очереди отправки больше IMPORT_MAX_PENDING сообщений
+IMPORT_CHUNK_CHARS = int(os.getenv('IMPORT_CHUNK_CHARS', 3500))
+IMPORT_MAX_PENDING = int(os.getenv('IMPORT_MAX_PENDING', 20))
+# Как часто обновлять сообщение о ходе импорта (секунды)
+IMPORT_PROGRESS_INTERVAL = float(os.getenv('IMPORT_PROGRESS_INTERVAL', 5))
+# Telegram отдает ботам файлы до 20 МБ
+IMPORT_MAX_BYTES = 20 * 1024 * 1024
+
+# ==================== ФОРУМЫ КОМАНД ====================
+# Форумы других команд, их темы и привязанные к ним чаты и люди
+TENANTS_DB_FILE = os.getenv('TENANTS_DB_FILE', 'tenants.db')
+
+# ==================== УЧАСТНИКИ ====================
+# Кто писал в форумы: подсказки ответственного и адресата вопроса по первым буквам
+PEOPLE_DB_FILE = os.getenv('PEOPLE_DB_FILE', 'people.db')
+
+# ==================== НАПОМИНАНИЯ ====================
+# Час, в который приходят напоминания "завтра", "сегодня" и "просрочен"
+REMINDER_HOUR = int(os.getenv('REMINDER_HOUR', 10))
+
+# ==================== ЖИВАЯ ПЕРЕЗАГРУЗКА НАСТРОЕК ====================
+# Как часто проверять, не изменились ли chats.json и catalogs.json (секунды, 0 — не следить)
+CONFIG_WATCH_INTERVAL = float(os.getenv('CONFIG_WATCH_INTERVAL', 2))
 
 # ==================== ФУНКЦИИ ДЛЯ РАБОТЫ С ЧАТАМИ ====================
+DEFAULT_CHATS = {
+    'chat_id': -1003761419747,  # ID вашего форума
+    'deadlines': 4,    # Тема Дедлайны
+    'questions': 8,    # Тема Вопросы
+    'done': 10,        # Тема Готово / Демо
+    'ideas': 15,       # Тема Идеи и предложения
+    'resources': 6,    # Тема Ресурсы и документы
+    'reports': 19,     # Тема Отчеты
+    'main': 2          # Тема Главный чат
+}
+
+def read_chats():
+    """Читает chats.json поверх значений по умолчанию; ошибки не глотает"""
+    chats = dict(DEFAULT_CHATS)
+    if os.path.exists(CHATS_FILE):
+        with open(CHATS_FILE, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+        for key in chats:
+            if key in saved:
+                chats[key] = int(saved[key])
+    return chats
+
 def load_chats():
     """Загружает настройки чатов из файла"""
-    default_chats = {
-        'chat_id': -1003761419747,  # ID вашего форума
-        'deadlines': 4,    # Тема Дедлайны
-        'questions': 8,    # Тема Вопросы
-        'done': 10,        # Тема Готово / Демо
-        'ideas': 15,       # Тема Идеи и предложения
-        'resources': 6,    # Тема Ресурсы и документы
-        'reports': 19,     # Тема Отчеты
-        'main': 2          # Тема Главный чат
-    }
-    
     try:
-        if os.path.exists(CHATS_FILE):
-            with open(CHATS_FILE, 'r', encoding='utf-8') as f:
-                saved = json.load(f)
-                for key in default_chats:
-                    if key in saved:
-                        default_chats[key] = saved[key]
+        return read_chats()
     except Exception as e:
-        print(f"⚠️ Ошибка загрузки chats.json: {e}")
-    
-    return default_chats
+        print(f"⚠️ Ошибка загрузки chats.json, взяты значения по умолчанию: {e}")
+        return dict(DEFAULT_CHATS)
+
+def write_json_atomic(path, data):
+    """Пишет JSON во временный файл рядом, fsync и атомарно подменяет им path.
+
+    При падении посреди записи на диске остается либо старый файл, либо новый.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(prefix='.' + os.path.basename(path) + '.', dir=directory)
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    if hasattr(os, 'O_DIRECTORY'):
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
 
 def save_chats(chats_dict):
     """Сохраняет настройки чатов в файл"""
     try:
-        with open(CHATS_FILE, 'w', encoding='utf-8') as f:
-            json.dump(chats_dict, f, ensure_ascii=False, indent=2)
+        write_json_atomic(CHATS_FILE, dict(chats_dict))
         return True
     except Exception as e:
         print(f"❌ Ошибка сохранения chats.json: {e}")
         return False
 
+async def save_chats_async(chats_dict):
+    """save_chats в отдельном потоке, чтобы не блокировать бота записью на диск"""
+    return await asyncio.get_running_loop().run_in_executor(None, save_chats, dict(chats_dict))
+
 # Загружаем при старте
 CHATS = load_chats()
 
+# ==================== СПРАВОЧНИКИ ИЗ ФАЙЛА ====================
+# Необязательный catalogs.json вида {"projects": {"bm": "#Boost_Marine", ...}, "statuses": {...}}
+# заменяет справочники целиком; ключи из REQUIRED_CATALOG_KEYS используются в коде и обязательны.
+CATALOGS_FILE = os.getenv('CATALOGS_FILE', 'catalogs.json')
+CATALOGS = {
+    'projects': PROJECTS,
+    'statuses': STATUSES,
+    'priorities': PRIORITIES,
+    'resource_types': RESOURCE_TYPES
+}
+REQUIRED_CATALOG_KEYS = {
+    'statuses': {'waiting', 'done'},
+    'priorities': {'critical'}
+}
+
+def read_catalogs():
+    """Читает и проверяет catalogs.json: {имя справочника: {ключ: значение}}"""
+    if not os.path.exists(CATALOGS_FILE):
+        return {}
+    with open(CATALOGS_FILE, 'r', encoding='utf-8') as f:
+        saved = json.load(f)
+    catalogs = {}
+    for name, values in saved.items():
+        if name not in CATALOGS:
+            raise ValueError(f"неизвестный справочник '{name}'")
+        if not values or not all(isinstance(v, str) for v in values.values()):
+            raise ValueError(f"справочник '{name}' должен быть непустым словарем строк")
+        missing = REQUIRED_CATALOG_KEYS.get(name, set()) - set(values)
+        if missing:
+            raise ValueError(f"в справочнике '{name}' нет ключей: {', '.join(sorted(missing))}")
+        catalogs[name] = {str(key): value for key, value in values.items()}
+    return catalogs
+
+def apply_catalogs(catalogs):
+    """Подменяет содержимое справочников; версия Catalog сбрасывает кэш клавиатур"""
+    for name, values in catalogs.items():
+        catalog = CATALOGS[name]
+        if dict(catalog) != values:
+            catalog.clear()
+            catalog.update(values)
+
+def apply_chats(chats):
+    """Подменяет настройки чатов на месте (все объекты, импортировавшие CHATS, видят новые)"""
+    if CHATS != chats:
+        CHATS.update(chats)
+
+try:
+    apply_catalogs(read_catalogs())
+except Exception as e:
+    print(f"⚠️ Ошибка загрузки {CATALOGS_FILE}, справочники по умолчанию: {e}")
+
+class ConfigWatcher:
+    """Следит за mtime chats.json и catalogs.json и перечитывает их без перезапуска.
+
+    Файл читается и проверяется в отдельном потоке, а подменяется одним
+    синхронным шагом в цикле событий — между двумя await обработчик видит
+    либо старые настройки целиком, либо новые. Битый файл не применяется:
+    остаются текущие настройки. hooks — async-функции без аргументов,
+    которые вызываются на каждой проверке (например, перечитать базу,
+    которую меняют другие процессы).
+    """
+
+    def __init__(self, interval=2.0):
+        self.interval = interval
+        self.sources = [
+            (CHATS_FILE, read_chats, apply_chats),
+            (CATALOGS_FILE, read_catalogs, apply_catalogs),
+        ]
+        self.mtimes = {path: self._mtime(path) for path, _, _ in self.sources}
+        self.hooks = []
+        self.reloads = 0
+        self._runner = None
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def start(self):
+        self._runner = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._runner:
+            self._runner.cancel()
+            await asyncio.gather(self._runner, return_exceptions=True)
+            self._runner = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.check()
+
+    async def check(self):
+        """Перечитывает файлы, у которых поменялся mtime"""
+        loop = asyncio.get_running_loop()
+        for path, read, apply in self.sources:
+            mtime = self._mtime(path)
+            if mtime == self.mtimes[path] or mtime is None:
+                continue
+            self.mtimes[path] = mtime
+            try:
+                data = await loop.run_in_executor(None, read)
+            except Exception as e:
+                logger.warning(f"⚠️ {path} не применен, остаются текущие настройки: {e}")
+                continue
+            apply(data)
+            self.reloads += 1
+            logger.info(f"🔄 {path} перечитан")
+        for hook in self.hooks:
+            try:
+                await hook()
+            except Exception as e:
+                logger.error(f"Ошибка проверки настроек: {e}")
+
+# ==================== СКЛЕЙКА ПОСТОВ ====================
+# Посты в одну тему, пришедшие за window секунд, уходят одним сообщением-дайджестом
+# не длиннее max_chars (лимит Telegram — 4096). window = 0 выключает склейку темы.
+# Посты с приоритетом #Критический не склеиваются никогда.
+COALESCE_WINDOW = float(os.getenv('COALESCE_WINDOW', 0))
+COALESCE = {
+    'deadlines': {'window': COALESCE_WINDOW, 'max_chars': 3500},
+    'questions': {'window': COALESCE_WINDOW, 'max_chars': 3500},
+    'done': {'window': COALESCE_WINDOW, 'max_chars': 3500},
+    'ideas': {'window': COALESCE_WINDOW, 'max_chars': 3500},
+    'resources': {'window': COALESCE_WINDOW, 'max_chars': 3500},
+    'reports': {'window': 0, 'max_chars': 3500},
+    'main': {'window': COALESCE_WINDOW, 'max_chars': 3500}
+}
+
 # Проверка токена
 if not BOT_TOKEN:
     print("❌ ОШИБКА: BOT_TOKEN не найден в .env файле!")
@@ -0,0 +1,205 @@
+import bisect
+import logging
+import time
+from collections import defaultdict
+
+from config import STATUSES
+from search import normalize
+
+logger = logging.getLogger(__name__)
+
+# Что из дедлайна нужно для выбора в /done и /status
+ITEM_FIELDS = ('id', 'kind', 'project', 'status', 'title', 'due_date', 'responsible', 'chat_id', 'thread_id')
+
+
+def title_key(title):
+    """Название задачи для сравнения: нижний регистр, ё -> е, без лишних пробелов"""
+    return ' '.join(title.lower().replace('ё', 'е').split())
+
+
+class DeadlineIndex:
+    """Открытые дедлайны в памяти для выбора в /done и /status.
+
+    Дедлайн лежит в словаре по id и в списках по форуму, по
+    (форум, проект) и по (форум, ответственный), отсортированных по сроку;
+    точное название (форум, проект, название) ведет к id дедлайнов с ним — отсюда
+    через TaskStore берется message_id поста, который правится при смене
+    статуса. Выборка берет самый короткий из подходящих списков и идет по
+    нему от ближайшего срока: без слов поиска она останавливается на limit
+    дедлайнах. Слова поиска ищутся по основам слов названий форума
+    (отсортированный список основ, совпадение по началу основы — как
+    "макет" находит "макетирование"): пересечение их id и есть кандидаты,
+    по всему форуму они не перебираются. Основы форума собираются при
+    первом поиске по словам в нем и дальше поддерживаются вместе с
+    остальными списками. Закрытый дедлайн (track со статусом "готово")
+    из индекса уходит. Если в базу писал другой процесс (несколько
+    воркеров), refresh перечитывает индекс по PRAGMA data_version.
+    """
+
+    def __init__(self, statuses=STATUSES):
+        self.statuses = statuses
+        self.items = {}                          # id -> дедлайн
+        self.by_chat = defaultdict(list)         # форум -> [(срок, id)] по порядку
+        self.by_project = defaultdict(list)      # (форум, проект) -> [(срок, id)]
+        self.by_responsible = defaultdict(list)  # (форум, ответственный в нижнем регистре) -> [(срок, id)]
+        self.by_title = defaultdict(set)         # (форум, проект, название) -> {id}
+        self.by_word = defaultdict(set)          # (форум, основа слова названия) -> {id}
+        self.words = {}                          # форум -> отсортированные основы слов его названий
+        self.data_version = None
+
+    def __len__(self):
+        return len(self.items)
+
+    async def load(self, store):
+        started = time.perf_counter()
+        self.data_version = await store.data_version()
+        self.items, self.by_chat, self.by_project, self.by_responsible, self.by_title = (
+            {}, defaultdict(list), defaultdict(list), defaultdict(list), defaultdict(set))
+        self.by_word, self.words = defaultdict(set), {}
+        for task in await store.open_items(('deadline',)):
+            self._add(task, keep_order=False)
+        for index in (self.by_chat, self.by_project, self.by_responsible):
+            for entries in index.values():
+                entries.sort()
+        logger.info(f"📅 Открытых дедлайнов в индексе: {len(self)} "
+                    f"за {(time.perf_counter() - started) * 1000:.1f} мс")
+
+    async def refresh(self, store):
+        """Перечитывает индекс, если задачи менял другой процесс"""
+        if await store.data_version() != self.data_version:
+            await self.load(store)
+
+    # ==================== ИЗМЕНЕНИЯ ====================
+    def track(self, task):
+        """Новый дедлайн или новый статус: открытый — в индекс, закрытый — из индекса"""
+        if task['kind'] != 'deadline':
+            return
+        self._remove(task['id'])
+        if task['status'] != self.statuses['done']:
+            self._add(task)
+
+    def _add(self, task, keep_order=True):
+        item = {field: task[field] for field in ITEM_FIELDS}
+        item['terms'] = title_key(item['title'])
+        item['person'] = (item['responsible'] or '').lower()
+        self.items[item['id']] = item
+        entry = (item['due_date'] or '9999', item['id'])
+        for index, key in self._keys(item):
+            if keep_order:
+                bisect.insort(index[key], entry)
+            else:
+                index[key].append(entry)
+        self.by_title[(item['chat_id'], item['project'], item['terms'])].add(item['id'])
+        if item['chat_id'] in self.words:
+            self._add_words(item, self.words[item['chat_id']])
+
+    def _remove(self, task_id):
+        item = self.items.pop(task_id, None)
+        if item is None:
+            return
+        entry = (item['due_date'] or '9999', item['id'])
+        for index, key in self._keys(item):
+            entries = index[key]
+            del entries[bisect.bisect_left(entries, entry)]
+            if not entries:
+                del index[key]
+        title = (item['chat_id'], item['project'], item['terms'])
+        same = self.by_title[title]
+        same.discard(task_id)
+        if not same:
+            del self.by_title[title]
+        for word in item.get('words', ()):
+            same = self.by_word[(item['chat_id'], word)]
+            same.discard(task_id)
+            if not same:
+                del self.by_word[(item['chat_id'], word)]
+                words = self.words[item['chat_id']]
+                del words[bisect.bisect_left(words, word)]
+
+    def _add_words(self, item, words, keep_order=True):
+        item['words'] = set(normalize(item['title']))
+        for word in item['words']:
+            same = self.by_word[(item['chat_id'], word)]
+            if not same:
+                if keep_order:
+                    bisect.insort(words, word)
+                else:
+                    words.append(word)
+            same.add(item['id'])
+
+    def _chat_words(self, chat_id):
+        """Отсортированные основы слов названий форума (при первом обращении собираются)"""
+        words = self.words.get(chat_id)
+        if words is None:
+            words = self.words[chat_id] = []
+            for _, task_id in self.by_chat.get(chat_id, ()):
+                self._add_words(self.items[task_id], words, keep_order=False)
+            words.sort()
+        return words
+
+    def _keys(self, item):
+        chat_id = item['chat_id']
+        keys = [(self.by_chat, chat_id), (self.by_project, (chat_id, item['project']))]
+        if item['person']:
+            keys.append((self.by_responsible, (chat_id, item['person'])))
+        return keys
+
+    # ==================== ВЫБОРКА ====================
+    def get(self, task_id, chat_id=None):
+        """Открытый дедлайн по id (и только из форума chat_id, если он задан)"""
+        item = self.items.get(task_id)
+        if item is None or (chat_id is not None and item['chat_id'] != chat_id):
+            return None
+        return item
+
+    def match(self, chat_id, project, title):
+        """id открытого дедлайна проекта с точно таким названием (из одноименных — с ближайшим сроком)"""
+        same = self.by_title.get((chat_id, project, title_key(title)))
+        if not same:
+            return None
+        return min(same, key=lambda task_id: (self.items[task_id]['due_date'] or '9999', task_id))
+
+    def matching(self, chat_id, word):
+        """id дедлайнов форума, в названии которых есть слово, начинающееся с основы word"""
+        words = self._chat_words(chat_id)
+        start = bisect.bisect_left(words, word)
+        end = bisect.bisect_left(words, word + '\uffff', start)
+        if end - start == 1:
+            return self.by_word[(chat_id, words[start])]
+        found = set()
+        for stem in words[start:end]:
+            found |= self.by_word[(chat_id, stem)]
+        return found
+
+    def find(self, chat_id, project=None, responsible=None, text=None, limit=10):
+        """Открытые дедлайны форума по проекту, ответственному и словам названия: (ближайшие по сроку, сколько всего)"""
+        person = responsible.lower() if responsible else None
+        candidates = [self.by_chat.get(chat_id, ())]
+        if project:
+            candidates.append(self.by_project.get((chat_id, project), ()))
+        if person:
+            candidates.append(self.by_responsible.get((chat_id, person), ()))
+        entries = min(candidates, key=len)
+        ids = None  # id с подходящими словами названия (None — слов поиска нет)
+        for matched in sorted((self.matching(chat_id, word) for word in normalize(text or '')), key=len):
+            ids = matched if ids is None else ids & matched
+            if not ids:
+                return [], 0
+        if ids is not None and len(ids) < len(entries):
+            # Совпавших по словам меньше, чем в самом коротком списке: сортируем только их
+            entries = sorted((self.items[task_id]['due_date'] or '9999', task_id) for task_id in ids)
+        # Без слов и не больше одного фильтра список уже точный: хватает первых limit
+        exact = ids is None and len(candidates) <= 2
+        found, total = [], 0
+        for _, task_id in entries:
+            item = self.items[task_id]
+            if (project and item['project'] != project) or (person and item['person'] != person):
+                continue
+            if ids is not None and task_id not in ids:
+                continue
+            if len(found) < limit:
+                found.append(item)
+            elif exact:
+                return found, len(entries)
+            total += 1
+        return found, total
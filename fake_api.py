@@ -0,0 +1,178 @@
+"""Локальный поддельный Telegram Bot API для нагрузочных тестов.
+
+Бот подключается к нему через BOT_API_URL (например http://127.0.0.1:8081).
+Сервер отдает апдейты через getUpdates или шлет их на вебхук, отвечает
+на sendMessage, editMessageText, editMessageReplyMarkup, answerCallbackQuery и служебные методы,
+умеет добавлять задержку и отвечать 429 Too Many Requests.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import random
+import time
+from collections import Counter, defaultdict, deque
+
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+BOT_USER = {'id': 123, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'}
+# Методы, которые отправляют сообщения и могут получить 429
+SEND_METHODS = {'sendMessage', 'editMessageText', 'editMessageReplyMarkup'}
+
+
+class FakeBotAPI:
+    """Поддельный Bot API: апдейты в очереди, сообщения бота — в ящиках чатов.
+
+    latency — задержка ответа на каждый запрос (секунды, плюс до jitter
+    случайно), error_rate — доля отправок, на которые приходит 429 с
+    retry_after. Все, что бот отправил в чат, попадает в inbox[chat_id],
+    откуда нагрузочный тест забирает ответы.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, retry_after=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+
+        self.pending = deque()
+        self._has_updates = asyncio.Event()
+        self._update_ids = itertools.count(1)
+        self._message_ids = itertools.count(1000)
+        self.inbox = defaultdict(asyncio.Queue)
+        self.calls = Counter()
+        self.throttled = 0
+        self.ready = asyncio.Event()
+
+        self.webhook_url = None
+        self.webhook_secret = None
+        self._webhook_slots = None
+        self._http = None
+
+    def app(self):
+        app = web.Application()
+        app.router.add_route('*', '/bot{token}/{method}', self.handle)
+        app.on_cleanup.append(self._close_http)
+        return app
+
+    async def _close_http(self, app):
+        if self._http is not None:
+            await self._http.close()
+
+    # ==================== АПДЕЙТЫ ====================
+    def push(self, update):
+        """Кладет апдейт (dict без update_id) для бота, возвращает его update_id"""
+        update['update_id'] = next(self._update_ids)
+        if self.webhook_url:
+            asyncio.create_task(self._deliver(update))
+        else:
+            self.pending.append(update)
+            self._has_updates.set()
+        return update['update_id']
+
+    async def _deliver(self, update):
+        headers = {'X-Telegram-Bot-Api-Secret-Token': self.webhook_secret} if self.webhook_secret else {}
+        async with self._webhook_slots:
+            try:
+                async with self._http.post(self.webhook_url, json=update, headers=headers) as response:
+                    if response.status != 200:
+                        logger.error(f"Вебхук ответил {response.status} на апдейт {update['update_id']}")
+            except aiohttp.ClientError as e:
+                logger.error(f"Вебхук недоступен: {e}")
+
+    async def get_updates(self, params):
+        offset = int(params.get('offset') or 0)
+        while self.pending and self.pending[0]['update_id'] < offset:
+            self.pending.popleft()
+        if not self.pending:
+            self._has_updates.clear()
+            try:
+                await asyncio.wait_for(self._has_updates.wait(), float(params.get('timeout') or 0))
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get('limit') or 100)
+        return list(itertools.islice(self.pending, limit))
+
+    # ==================== ЗАПРОСЫ БОТА ====================
+    async def handle(self, request):
+        method = request.match_info['method']
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        self.calls[method] += 1
+
+        if method == 'getUpdates':
+            self.ready.set()
+            return self.ok(await self.get_updates(params))
+
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + random.random() * self.jitter)
+        if method in SEND_METHODS and self.error_rate and random.random() < self.error_rate:
+            self.throttled += 1
+            return web.json_response({
+                'ok': False, 'error_code': 429,
+                'description': f"Too Many Requests: retry after {self.retry_after}",
+                'parameters': {'retry_after': self.retry_after}
+            }, status=429)
+
+        if method == 'getMe':
+            return self.ok(BOT_USER)
+        if method in SEND_METHODS:
+            return self.ok(self.record_message(params))
+        if method == 'getChatMember':
+            return self.ok({'status': 'member', 'user': {'id': int(params['user_id']), 'is_bot': False,
+                                                         'first_name': 'User'}})
+        if method == 'setWebhook':
+            self.webhook_url = params['url']
+            self.webhook_secret = params.get('secret_token')
+            self._webhook_slots = asyncio.Semaphore(int(params.get('max_connections') or 40))
+            self._http = self._http or aiohttp.ClientSession()
+            self.ready.set()
+        elif method == 'deleteWebhook':
+            self.webhook_url = None
+        return self.ok(True)
+
+    def record_message(self, params):
+        chat_id = int(params['chat_id'])
+        message = {
+            'message_id': int(params.get('message_id') or next(self._message_ids)),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private' if chat_id > 0 else 'supergroup'},
+            'from': BOT_USER,
+            'text': params.get('text', ''),
+        }
+        if params.get('message_thread_id'):
+            message['message_thread_id'] = int(params['message_thread_id'])
+        if params.get('reply_markup'):
+            markup = params['reply_markup']
+            message['reply_markup'] = json.loads(markup) if isinstance(markup, str) else markup
+        self.inbox[chat_id].put_nowait((time.perf_counter(), message))
+        return message
+
+    @staticmethod
+    def ok(result):
+        return web.json_response({'ok': True, 'result': result})
+
+
+async def serve(api, host='127.0.0.1', port=8081):
+    """Запускает поддельный API, возвращает runner для остановки"""
+    runner = web.AppRunner(api.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Поддельный Telegram Bot API")
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка ответа, с")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="доля отправок с ответом 429")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(FakeBotAPI(args.latency, error_rate=args.error_rate).app(), host='127.0.0.1', port=args.port)
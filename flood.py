@@ -0,0 +1,156 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+from aiogram import BaseMiddleware
+from aiogram.types import Update
+
+from outbox import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+
+class Sender(TokenBucket):
+    """Ведро пользователя и то, что нужно знать о нем между апдейтами"""
+    __slots__ = ('callback', 'noticed', 'pending')
+
+    def __init__(self, rate, capacity):
+        super().__init__(rate, capacity)
+        self.callback = None  # (данные кнопки, message_id, когда нажата) — последнее нажатие
+        self.noticed = 0      # когда последний раз сказали "не так быстро"
+        self.pending = 0      # сколько апдейтов ждут своей очереди
+
+
+class BucketMap:
+    """Ведра по ключу (пользователь или чат) с вытеснением простаивающих.
+
+    Порядок OrderedDict — порядок последнего обращения, поэтому самое
+    давнее ведро всегда первое: проверка и вытеснение — O(1) на апдейт.
+    Ведро, простоявшее idle секунд, успело наполниться, так что удалить
+    его — то же, что оставить полным.
+    """
+
+    def __init__(self, rate, capacity, factory=TokenBucket, idle=600.0, max_size=100000):
+        self.rate = rate
+        self.capacity = capacity
+        self.factory = factory
+        self.idle = max(idle, capacity / rate) if rate else idle
+        self.max_size = max_size
+        self.buckets = OrderedDict()
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self.buckets)
+
+    def get(self, key, now):
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = self.factory(self.rate, self.capacity)
+            bucket.updated = now
+        else:
+            self.buckets.move_to_end(key)
+        while len(self.buckets) > 1:
+            oldest_key = next(iter(self.buckets))
+            oldest = self.buckets[oldest_key]
+            if now - oldest.updated < self.idle and len(self.buckets) <= self.max_size:
+                break
+            if getattr(oldest, 'pending', 0):
+                # У пользователя еще ждут апдейты — не теряем его очередь
+                self.buckets.move_to_end(oldest_key)
+                break
+            del self.buckets[oldest_key]
+            self.evicted += 1
+        return bucket
+
+
+class FloodControl(BaseMiddleware):
+    """Внешний middleware апдейтов: защита от флуда командами и кнопками.
+
+    У каждого пользователя и у каждой группы свое ведро токенов. Повторное
+    нажатие той же кнопки того же сообщения в течение duplicate_window
+    секунд дальше не идет: пока у пользователя есть токены, оно получает
+    пустой answerCallbackQuery, чтобы у кнопки пропали часики. Сообщение
+    сверх лимита ждет токена, если ждать не дольше max_delay секунд и у
+    пользователя в ожидании меньше max_pending апдейтов, иначе
+    отбрасывается; лишнее нажатие отбрасывается сразу. Отброшенный апдейт
+    не доходит до обработчиков и ничего не отправляет, а "не так быстро"
+    пользователь слышит не чаще раза в notice_interval секунд — так флуд
+    не съедает общий лимит отправки бота.
+    """
+
+    def __init__(self, user_rate=2.0, user_burst=10, chat_rate=10.0, chat_burst=50, max_delay=2.0,
+                 max_pending=5, duplicate_window=1.0, notice_interval=10.0, idle=600.0):
+        self.users = BucketMap(user_rate, user_burst, factory=Sender, idle=idle)
+        self.chats = BucketMap(chat_rate, chat_burst, idle=idle)
+        self.max_delay = max_delay
+        self.max_pending = max_pending
+        self.duplicate_window = duplicate_window
+        self.notice_interval = notice_interval
+        self.passed = 0
+        self.deferred = 0
+        self.dropped = 0
+        self.duplicates = 0
+
+    def stats(self):
+        return {'passed': self.passed, 'deferred': self.deferred, 'dropped': self.dropped,
+                'duplicates': self.duplicates, 'users': len(self.users), 'chats': len(self.chats),
+                'evicted': self.users.evicted + self.chats.evicted}
+
+    def may_notify(self, user_id):
+        """Можно ли сейчас ответить пользователю служебным сообщением (не чаще раза в notice_interval)"""
+        now = time.monotonic()
+        sender = self.users.get(user_id, now)
+        if now - sender.noticed < self.notice_interval:
+            return False
+        sender.noticed = now
+        return True
+
+    async def __call__(self, handler, event: Update, data):
+        user = data.get('event_from_user')
+        if user is None:
+            return await handler(event, data)
+
+        now = time.monotonic()
+        sender = self.users.get(user.id, now)
+        callback = event.callback_query
+        if callback is not None:
+            pressed = (callback.data, callback.message.message_id if callback.message else None)
+            last = sender.callback
+            sender.callback = (*pressed, now)
+            if last is not None and last[:2] == pressed and now - last[2] < self.duplicate_window:
+                self.duplicates += 1
+                if not sender.consume(now):
+                    await callback.answer()
+                return None
+
+        bucket = sender
+        wait = sender.consume(now)
+        chat = data.get('event_chat')
+        if not wait and chat is not None and chat.type in ('group', 'supergroup'):
+            bucket = self.chats.get(chat.id, now)
+            wait = bucket.consume(now)
+        if not wait:
+            self.passed += 1
+            return await handler(event, data)
+
+        if event.message is not None and wait <= self.max_delay and sender.pending < self.max_pending:
+            # Занимаем токен в долг: следующие сообщения встанут в очередь за этим
+            bucket.tokens -= 1
+            sender.pending += 1
+            self.deferred += 1
+            try:
+                await asyncio.sleep(wait)
+            finally:
+                sender.pending -= 1
+            self.passed += 1
+            return await handler(event, data)
+
+        self.dropped += 1
+        if self.may_notify(user.id):
+            logger.warning(f"🚦 Флуд от {user.id}: апдейты отбрасываются")
+            if callback is not None:
+                await callback.answer("⏳ Не так быстро")
+            elif event.message is not None:
+                await event.message.answer("⏳ Слишком много сообщений подряд — подождите несколько секунд")
+        return None
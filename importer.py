@@ -0,0 +1,287 @@
+import asyncio
+import csv
+import json
+import logging
+import time
+
+from config import STATUSES
+from outbox import Outbox
+from task_store import TITLE_FIELDS, new_task, parse_due_date
+
+logger = logging.getLogger(__name__)
+
+# Поля строки импорта для каждого вида: обязательные и значения по умолчанию
+# (для справочников — ключ). Вместо главного текстового поля можно писать title.
+IMPORT_FIELDS = {
+    'deadline': {'required': ('project', 'date', 'task'),
+                 'defaults': {'priority': 'medium', 'status': 'doing', 'responsible': 'не указан'}},
+    'question': {'required': ('project', 'question'),
+                 'defaults': {'priority': 'medium', 'to_who': 'не указан', 'context': 'не указан'}},
+    'done': {'required': ('project', 'task'),
+             'defaults': {'status': 'done', 'link': 'не указана', 'check': 'не указано'}},
+    'idea': {'required': ('project', 'idea'),
+             'defaults': {'priority': 'medium', 'benefit': 'не указана'}},
+    'resource': {'required': ('project', 'resource_type', 'description'),
+                 'defaults': {'link': 'не указана'}},
+}
+MAX_TEXT = 1000
+MAX_ERRORS_SHOWN = 20
+
+
+class ImportRowError(ValueError):
+    """Строка файла не прошла проверку"""
+
+
+def read_rows(path):
+    """Строки файла по одной: (номер строки в файле, dict или None, если строку не разобрать).
+
+    JSONL — объект JSON на строке, иначе CSV с заголовком (разделитель
+    запятая, точка с запятой или табуляция). Файл целиком в память не читается.
+    """
+    with open(path, encoding='utf-8-sig', newline='') as file:
+        head = file.read(4096)
+        file.seek(0)
+        if head.lstrip().startswith('{'):
+            for number, line in enumerate(file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                yield number, row if isinstance(row, dict) else None
+            return
+
+        try:
+            dialect = csv.Sniffer().sniff(head.split('\n', 1)[0], delimiters=',;\t')
+        except csv.Error:
+            dialect = csv.excel
+        reader = csv.DictReader(file, dialect=dialect)
+        for row in reader:
+            yield reader.line_num, row
+
+
+def validate(parser, row, kind='deadline'):
+    """Поля формы из строки файла: (вид, data) как после диалога, иначе ImportRowError"""
+    if row is None:
+        raise ImportRowError("строку не удалось разобрать")
+    row = {str(name).strip().lower(): str(value).strip() for name, value in row.items()
+           if name is not None and value not in (None, '')}
+    kind = row.pop('kind', kind).lower()
+    spec = IMPORT_FIELDS.get(kind)
+    if spec is None:
+        raise ImportRowError(f"неизвестный вид {kind[:40]} (есть: {', '.join(IMPORT_FIELDS)})")
+    if 'title' in row:
+        row.setdefault(TITLE_FIELDS[kind], row.pop('title'))
+
+    catalogs = {field for field, _, _ in parser.forms[kind]['catalogs']}
+    data = {}
+    for field in (*spec['required'], *spec['defaults']):
+        value = row.get(field)
+        if value is None:
+            if field in spec['required']:
+                raise ImportRowError(f"не заполнено поле {field}")
+            value = spec['defaults'][field]
+        if field in catalogs:
+            resolved = parser.resolve(kind, field, value)
+            if resolved is None:
+                raise ImportRowError(f"неизвестное значение {field}: {value[:40]}")
+            value = resolved
+        elif field == 'date' and parse_due_date(value) is None:
+            raise ImportRowError(f"дата не в формате ДД.ММ или ДД.ММ.ГГГГ: {value[:40]}")
+        elif len(value) > MAX_TEXT:
+            raise ImportRowError(f"поле {field} длиннее {MAX_TEXT} символов")
+        data[field] = value
+    if kind == 'question':
+        # Как в форме: новый вопрос ждет ответа
+        data['status'] = STATUSES['waiting']
+    return kind, data
+
+
+class ImportReport:
+    """Ход одного импорта: для сообщения о прогрессе и итога"""
+
+    def __init__(self, state):
+        self.key = state['key']
+        self.file_name = state['file_name']
+        self.row = state['row']
+        self.added = state['added']
+        self.errors = state['errors']
+        self.resumed = state['row'] > 0
+        self.posted = 0
+        self.messages = 0
+        self.samples = []  # первые ошибки: (строка, текст)
+        self.started = time.monotonic()
+        self.reported = 0.0
+        self.finished = False
+
+    def error(self, row, error):
+        self.errors += 1
+        if len(self.samples) < MAX_ERRORS_SHOWN:
+            self.samples.append((row, str(error)))
+
+
+class Importer:
+    """Потоковый импорт задач из CSV/JSONL через очередь отправки.
+
+    Файл читается по строке. Проверенные строки копятся в пачки по темам
+    размером с одно сообщение (chunk_chars), и каждая пачка уходит одним
+    постом: 10 тысяч дедлайнов — это сотни сообщений, а не 10 тысяч, и
+    темп задает TokenBucket очереди, без 429. Задачи пачки и номер
+    последней прочитанной строки пишутся в TaskStore одной транзакцией.
+    Пачки идут массовой очередью отправки (bulk), которая уступает
+    бюджет чата постам форм. Чтение ждет, пока в ней больше max_pending
+    сообщений, поэтому в памяти их немного. После перезапуска импорт
+    продолжается со строки после отметки, а задачи, чьи посты не успели
+    уйти, публикуются заново (под теми же ключами идемпотентности).
+    """
+
+    def __init__(self, tasks, outbox, parser, render, on_added=None, chunk_chars=3500, max_pending=20,
+                 progress_interval=5.0, poll_interval=0.2):
+        self.tasks = tasks
+        self.outbox = outbox
+        self.parser = parser
+        self.render = render  # render(вид, data) -> текст поста
+        self.on_added = on_added  # on_added(task) для каждой сохраненной задачи
+        self.chunk_chars = chunk_chars
+        self.max_pending = max_pending
+        self.progress_interval = progress_interval
+        self.poll_interval = poll_interval
+        self.running = {}  # ключ импорта -> asyncio.Task
+
+    # ==================== ЗАПУСК ====================
+    def spawn(self, key, coro):
+        """Запускает импорт в фоне (один на ключ), чтобы не держать обработчик апдейта"""
+        task = asyncio.create_task(coro)
+        self.running[key] = task
+        task.add_done_callback(lambda _: self.running.pop(key, None))
+        return task
+
+    async def stop(self):
+        """Прерывает импорты: отметка в базе остается, после запуска они продолжатся"""
+        for task in list(self.running.values()):
+            task.cancel()
+        await asyncio.gather(*self.running.values(), return_exceptions=True)
+
+    # ==================== ИМПОРТ ====================
+    async def run(self, state, path, targets, created_by, progress=None):
+        """Импортирует файл path по отметке state (строка imports).
+
+        targets — {вид: (chat_id, thread_id)} тем форума; progress(report)
+        вызывается не чаще progress_interval секунд и в конце.
+        """
+        report = ImportReport(state)
+        await self._repost(report)
+
+        buffers = {}  # тема -> [(задача, текст)]
+        sizes = {}
+        last = state['row']
+        separator = len(Outbox.DIGEST_SEPARATOR)
+        for number, row in read_rows(path):
+            if number <= state['row']:
+                continue
+            try:
+                kind, data = validate(self.parser, row, state['kind'])
+                target = targets.get(kind)
+                if target is None:
+                    raise ImportRowError(f"тема для вида {kind} не настроена")
+            except ImportRowError as e:
+                report.error(number, e)
+                last = number
+                continue
+
+            text = self.render(kind, data).strip()
+            if buffers.get(target) and sizes[target] + separator + len(text) > self.chunk_chars:
+                # Фиксируем все темы сразу: тогда отметка — граница, до которой записано все
+                await self._commit(report, buffers, last)
+                sizes.clear()
+            task = new_task(kind, data, *target, created_by=created_by, source=report.key)
+            buffers.setdefault(target, []).append((task, text))
+            sizes[target] = sizes.get(target, -separator) + separator + len(text)
+            last = number
+            await self._progress(report, progress)
+        await self._commit(report, buffers, last)
+        await self.tasks.finish_import(report.key)
+
+        # Итог — когда очередь разошлась: посты ушли или остались ждать повтора
+        while report.posted < report.added and self.outbox.bulk.qsize():
+            await self._progress(report, progress)
+            await asyncio.sleep(self.poll_interval)
+        report.finished = True
+        await self._progress(report, progress, force=True)
+        logger.info(f"📥 Импорт {report.key}: добавлено {report.added}, ошибок {report.errors}, "
+                    f"сообщений {report.messages}")
+        return report
+
+    async def _commit(self, report, buffers, row):
+        batch = [task for items in buffers.values() for task, _ in items]
+        await self.tasks.add_batch(batch, report.key, row, report.errors)
+        report.row = row
+        report.added += len(batch)
+        if self.on_added is not None:
+            for task in batch:
+                self.on_added(task)
+        for target, items in buffers.items():
+            await self._post(report, target, items)
+        buffers.clear()
+
+    async def _post(self, report, target, items):
+        """Одна пачка — одно сообщение; ждет, пока очередь отправки не разгрузится"""
+        while self.outbox.bulk.qsize() >= self.max_pending:
+            await asyncio.sleep(self.poll_interval)
+        ids = [task['id'] for task, _ in items]
+
+        async def on_sent(message, keys):
+            # Посты, ушедшие раньше другим сообщением, уже отмечены (_repost) и из этого вырезаны
+            sent = [int(key.partition(':')[2]) for key in keys]
+            report.posted += len(sent)
+            await self.tasks.set_message_ids(sent, message.message_id)
+
+        chat_id, thread_id = target
+        texts = [text for _, text in items]
+        await self.outbox.put(chat_id, thread_id, Outbox.DIGEST_SEPARATOR.join(texts),
+                              on_sent=on_sent, keys=[f"task:{task_id}" for task_id in ids], parts=texts, bulk=True)
+        report.messages += 1
+
+    async def _repost(self, report):
+        """Задачи прерванного импорта, чьи посты не ушли: уже отправленные по журналу только отмечаем"""
+        unposted = await self.tasks.unposted(report.key)
+        report.posted = report.added - len(unposted)
+        if not unposted:
+            return
+
+        sent = {}
+        if self.outbox.store is not None:
+            sent = await self.outbox.store.delivered([f"task:{task['id']}" for task in unposted])
+        buffers, posted = {}, {}
+        for task in unposted:
+            message_id = sent.get(f"task:{task['id']}")
+            if message_id is not None:
+                posted.setdefault(message_id, []).append(task['id'])
+                continue
+            text = self.render(task['kind'], json.loads(task['data'])).strip()
+            buffers.setdefault((task['chat_id'], task['thread_id']), []).append((task, text))
+        for message_id, ids in posted.items():
+            report.posted += len(ids)
+            await self.tasks.set_message_ids(ids, message_id)
+
+        for target, items in buffers.items():
+            chunk, size = [], 0
+            for task, text in items:
+                if chunk and size + len(Outbox.DIGEST_SEPARATOR) + len(text) > self.chunk_chars:
+                    await self._post(report, target, chunk)
+                    chunk, size = [], 0
+                size += len(Outbox.DIGEST_SEPARATOR) * bool(chunk) + len(text)
+                chunk.append((task, text))
+            await self._post(report, target, chunk)
+        logger.info(f"📥 Импорт {report.key}: повторно в очереди {sum(map(len, buffers.values()))} задач")
+
+    async def _progress(self, report, progress, force=False):
+        now = time.monotonic()
+        if progress is None or (not force and now - report.reported < self.progress_interval):
+            return
+        report.reported = now
+        try:
+            await progress(report)
+        except Exception as e:
+            logger.error(f"Ошибка сообщения о ходе импорта: {e}")
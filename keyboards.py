@@ -0,0 +1,58 @@
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from pydantic import ConfigDict
+
+from callbacks import FormCallback
+
+
+class FrozenKeyboard(InlineKeyboardMarkup):
+    """Неизменяемая разметка: одну и ту же клавиатуру отдают всем формам"""
+    model_config = ConfigDict(frozen=True)
+
+
+def build_keyboard(items, form, field):
+    """Строит клавиатуру из пар (ключ, текст) по 2 кнопки в ряд"""
+    buttons = []
+    for key, value in items:
+        callback_data = FormCallback(form=form, field=field, value=key).pack()
+        buttons.append(InlineKeyboardButton(text=value, callback_data=callback_data))
+
+    # Разбиваем по 2 кнопки в ряд
+    rows = []
+    for i in range(0, len(buttons), 2):
+        rows.append(buttons[i:i+2])
+
+    return FrozenKeyboard(inline_keyboard=rows)
+
+
+class KeyboardRegistry:
+    """Кэш клавиатур по (справочник, форма, поле).
+
+    Каждая клавиатура строится один раз. Для Catalog из config.py запись
+    сверяется с его version, поэтому изменение справочника на лету
+    пересобирает клавиатуру при следующем запросе; для обычного словаря
+    сверяется его содержимое.
+    """
+
+    def __init__(self):
+        self._cache = {}
+        self.builds = 0
+
+    def get(self, source, form, field, keys=None):
+        """Клавиатура из source; keys ограничивает набор кнопок"""
+        version = getattr(source, 'version', None)
+        if version is None:
+            version = tuple(source.items())
+
+        cache_key = (id(source), form, field, keys)
+        entry = self._cache.get(cache_key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+
+        items = source.items() if keys is None else [(key, source[key]) for key in keys if key in source]
+        markup = build_keyboard(items, form, field)
+        self.builds += 1
+        self._cache[cache_key] = (version, markup)
+        return markup
+
+    def clear(self):
+        self._cache.clear()
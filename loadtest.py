@@ -0,0 +1,373 @@
+"""Нагрузочный тест: бот в отдельном процессе против поддельного Bot API.
+
+Виртуальные пользователи проходят все шесть форм (/deadline, /question,
+/done, /idea, /resource, /report), нажимая кнопки из присланных клавиатур.
+Задержка шага — от отправки апдейта до первого сообщения бота в ответ.
+
+С --flooders N рядом работают N скриптов, которые без остановки шлют
+/deadline и жмут одну и ту же кнопку: задержки обычных пользователей
+не должны от этого расти (--no-flood-control — то же без защиты).
+
+С --pipeline пользователь шлет текстовые шаги подряд, не дожидаясь ответа
+на предыдущий (как быстрый набор или сообщения, накопленные без сети).
+Обработанный не по порядку шаг бот отвергает ответом с "❌" — такие
+ответы считаются; их должно быть 0. --concurrency N задает, сколько
+апдейтов бот обрабатывает одновременно (1 — строго по одному).
+
+Запуск: python loadtest.py --users 500 [--mode polling|webhook|compare] [--workers 4]
+                           [--latency 0.05] [--error-rate 0.01] [--quick] [--classic]
+                           [--flooders 3] [--flood-rate 500] [--no-flood-control]
+                           [--pipeline] [--concurrency 40]
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+from collections import Counter
+from datetime import date, timedelta
+
+from fake_api import FakeBotAPI, SEND_METHODS, serve
+from outbox import percentile
+
+BOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'bot.py')
+DUE = (date.today() + timedelta(days=7)).strftime('%d.%m')
+
+# Шаги форм: ('text', текст сообщения) или ('button', ключ кнопки из последней клавиатуры)
+FLOWS = {
+    'deadline': [('text', '/deadline'), ('button', 'bm'), ('text', DUE), ('text', "Сдать макет"),
+                 ('button', 'high'), ('text', '@ivan'), ('button', 'doing')],
+    'question': [('text', '/question'), ('button', 'ai'), ('text', "Какой стек?"), ('button', 'low'),
+                 ('text', '@petr'), ('text', 'нет')],
+    'done': [('text', '/done'), ('button', 'bm'), ('text', "Сдать макет"), ('button', 'done'),
+             ('text', 'нет'), ('text', "Проверить на стенде")],
+    'idea': [('text', '/idea'), ('button', 'moto'), ('text', "Новый лендинг"), ('button', 'medium'),
+             ('text', "Больше заявок")],
+    'resource': [('text', '/resource'), ('button', 'print'), ('button', 'doc'), ('text', "ТЗ"),
+                 ('text', 'https://example.com/spec')],
+    'report': [('text', '/report'), ('button', 'week'), ('text', "Все по плану")],
+}
+
+# Те же формы одной командой (--quick)
+QUICK_FLOWS = {
+    'deadline': [('text', f'/deadline bm {DUE} high @ivan doing Сдать макет')],
+    'question': [('text', '/question ai low @petr Какой стек?')],
+    'done': [('text', '/done bm done Сдать макет | Проверить на стенде')],
+    'idea': [('text', '/idea moto medium Новый лендинг | Больше заявок')],
+    'resource': [('text', '/resource print doc ТЗ https://example.com/spec')],
+    'report': [('text', '/report week Все по плану')],
+}
+
+
+class LoadStats:
+    def __init__(self):
+        self.latencies = []
+        self.flows = 0
+        self.timeouts = 0
+        self.missing_buttons = 0
+        self.rejected = 0
+
+
+# ==================== ВИРТУАЛЬНЫЙ ПОЛЬЗОВАТЕЛЬ ====================
+def batches(steps):
+    """Шаги формы пачками: кнопка и текст за ней можно отправить, не дожидаясь ответов"""
+    result = []
+    for step in steps:
+        if result and step[0] == 'text':
+            result[-1].append(step)
+        else:
+            result.append([step])
+    return result
+
+
+class VirtualUser:
+    _message_ids = itertools.count(1)
+
+    def __init__(self, api, user_id, stats, timeout):
+        self.api = api
+        self.user = {'id': user_id, 'is_bot': False, 'first_name': f"User{user_id}"}
+        self.chat = {'id': user_id, 'type': 'private'}
+        self.stats = stats
+        self.timeout = timeout
+        self.keyboard = None  # (message_id, reply_markup) последнего сообщения с кнопками
+
+    def message(self, text):
+        return {'message': {'message_id': next(self._message_ids), 'date': int(time.time()),
+                            'chat': self.chat, 'from': self.user, 'text': text}}
+
+    def press(self, key):
+        if self.keyboard is None:
+            return None
+        message_id, markup = self.keyboard
+        for row in markup.get('inline_keyboard', []):
+            for button in row:
+                if button.get('callback_data', '').endswith(':' + key):
+                    return {'callback_query': {
+                        'id': str(next(self._message_ids)), 'from': self.user, 'chat_instance': 'load',
+                        'data': button['callback_data'],
+                        'message': {'message_id': message_id, 'date': 0, 'chat': self.chat, 'text': '…'}
+                    }}
+        return None
+
+    async def step(self, *steps):
+        """Отправляет шаги формы подряд и ждет ответа на каждый; False — ответа нет"""
+        updates = []
+        for kind, value in steps:
+            update = self.message(value) if kind == 'text' else self.press(value)
+            if update is None:
+                self.stats.missing_buttons += 1
+                return False
+            updates.append(update)
+        inbox = self.api.inbox[self.user['id']]
+        while not inbox.empty():
+            self.remember(inbox.get_nowait()[1])
+        sent = time.perf_counter()
+        for update in updates:
+            self.api.push(update)
+        for _ in updates:
+            try:
+                received, message = await asyncio.wait_for(inbox.get(), self.timeout)
+            except asyncio.TimeoutError:
+                self.stats.timeouts += 1
+                return False
+            self.stats.latencies.append(received - sent)
+            self.remember(message)
+            if message.get('text', '').startswith('❌'):
+                self.stats.rejected += 1
+        return True
+
+    def remember(self, message):
+        if message.get('reply_markup', {}).get('inline_keyboard'):
+            self.keyboard = (message['message_id'], message['reply_markup'])
+
+    async def run(self, flows, delay, pipeline=False):
+        await asyncio.sleep(delay)
+        for name, steps in flows:
+            for batch in (batches(steps) if pipeline else [[step] for step in steps]):
+                if not await self.step(*batch):
+                    break
+            else:
+                self.stats.flows += 1
+
+
+class Flooder(VirtualUser):
+    """Скрипт-флудер: rate апдейтов в секунду (/deadline и нажатия одной кнопки), пока не остановят"""
+
+    def __init__(self, api, user_id, stats, timeout):
+        super().__init__(api, user_id, stats, timeout)
+        self.sent = 0
+
+    def spam_press(self):
+        return {'callback_query': {
+            'id': str(next(self._message_ids)), 'from': self.user, 'chat_instance': 'flood',
+            'data': 'f:deadline:project:bm', 'message': {'message_id': 1, 'date': 0, 'chat': self.chat, 'text': '…'}
+        }}
+
+    async def flood(self, rate, stop):
+        inbox = self.api.inbox[self.user['id']]
+        while not stop.is_set():
+            for i in range(max(1, int(rate / 100))):
+                self.api.push(self.message('/deadline') if i % 2 else self.spam_press())
+                self.sent += 1
+            while not inbox.empty():
+                inbox.get_nowait()
+            await asyncio.sleep(0.01)
+
+
+# ==================== ПРОЦЕСС БОТА ====================
+def rss_kb(pid):
+    """RSS процесса и всех его потомков (воркеров), КБ"""
+    total = 0
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    total += int(line.split()[1])
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            children = [int(child) for child in f.read().split()]
+    except (FileNotFoundError, ProcessLookupError):
+        return total
+    return total + sum(rss_kb(child) for child in children)
+
+
+def start_bot(workdir, mode, workers, api_port, webhook_port, wizard=True, flood_control=True, concurrency=None):
+    env = dict(
+        os.environ,
+        BOT_TOKEN='123:FAKE',
+        BOT_API_URL=f'http://127.0.0.1:{api_port}',
+        ADMIN_ID='1',
+        FSM_STORAGE_FILE=os.path.join(workdir, 'fsm.db'),
+        TASKS_DB_FILE=os.path.join(workdir, 'tasks.db'),
+        TENANTS_DB_FILE=os.path.join(workdir, 'tenants.db'),
+        OUTBOX_DB_FILE=os.path.join(workdir, 'outbox.db'),
+        SEARCH_DB_FILE=os.path.join(workdir, 'search.db'),
+        PEOPLE_DB_FILE=os.path.join(workdir, 'people.db'),
+        CATALOGS_FILE=os.path.join(workdir, 'catalogs.json'),
+        CONFIG_WATCH_INTERVAL='0',
+        FORM_WIZARD='1' if wizard else '0',
+        # Лимиты Telegram на посты в темы здесь не проверяются — не даем им тормозить очередь
+        OUTBOX_RATE_PER_MINUTE='600000',
+        OUTBOX_BURST='1000',
+        OUTBOX_GLOBAL_RATE='100000',
+        # Виртуальные пользователи отвечают без пауз, быстрее людей: лимит выше обычного, флудеры его все равно превышают
+        FLOOD_USER_RATE='10' if flood_control else '0',
+        FLOOD_USER_BURST='30',
+        WEBHOOK_URL=f'http://127.0.0.1:{webhook_port}/webhook',
+        WEBHOOK_HOST='127.0.0.1',
+        WEBHOOK_PORT=str(webhook_port),
+        WEBHOOK_SECRET='loadtest',
+    )
+    if concurrency:
+        env['UPDATE_CONCURRENCY'] = str(concurrency)
+    log = open(os.path.join(workdir, 'bot.log'), 'w')
+    process = subprocess.Popen([sys.executable, BOT_PATH, '--mode', mode, '--workers', str(workers)],
+                               cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    return process, log
+
+
+async def stop_bot(process, timeout=30):
+    """Останавливает бота как Ctrl+C; ждем в потоке, чтобы API продолжал отвечать на его отправки"""
+    process.send_signal(signal.SIGINT)
+    loop = asyncio.get_running_loop()
+    try:
+        await loop.run_in_executor(None, process.wait, timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        await loop.run_in_executor(None, process.wait)
+
+
+def tail(path, lines=20):
+    with open(path, encoding='utf-8', errors='replace') as f:
+        return ''.join(f.readlines()[-lines:])
+
+
+# ==================== ПРОГОН ====================
+async def run_load(mode='polling', users=200, workers=1, latency=0.0, error_rate=0.0,
+                   ramp=2.0, timeout=15.0, api_port=8081, webhook_port=8082, quick=False, wizard=True,
+                   flooders=0, flood_rate=500, flood_control=True, pipeline=False, concurrency=None):
+    api = FakeBotAPI(latency=latency, error_rate=error_rate)
+    runner = await serve(api, port=api_port)
+    with tempfile.TemporaryDirectory() as workdir:
+        process, log = start_bot(workdir, mode, workers, api_port, webhook_port, wizard,
+                                  flood_control, concurrency)
+        try:
+            try:
+                await asyncio.wait_for(api.ready.wait(), 60)
+            except asyncio.TimeoutError:
+                print(f"❌ Бот не запустился:\n{tail(os.path.join(workdir, 'bot.log'))}")
+                return None
+            if mode == 'webhook':
+                # Бот регистрирует вебхук сразу после старта сервера — даем ему подняться
+                await asyncio.sleep(0.5)
+            rss_start = rss_kb(process.pid)
+
+            stats = LoadStats()
+            flows = list((QUICK_FLOWS if quick else FLOWS).items())
+            crowd = [VirtualUser(api, 10000 + i, stats, timeout) for i in range(users)]
+            spammers = [Flooder(api, 90000 + i, LoadStats(), timeout) for i in range(flooders)]
+            stop = asyncio.Event()
+            flooding = [asyncio.create_task(spammer.flood(flood_rate, stop)) for spammer in spammers]
+            started = time.perf_counter()
+            await asyncio.gather(*(user.run(flows, ramp * i / users, pipeline) for i, user in enumerate(crowd)))
+            elapsed = time.perf_counter() - started
+            stop.set()
+            await asyncio.gather(*flooding)
+            rss_end = rss_kb(process.pid)
+        finally:
+            await stop_bot(process)
+            log.close()
+        await runner.cleanup()
+
+    latencies = sorted(stats.latencies)
+    mode = mode if workers == 1 else f"{mode} x{workers}"
+    mode = f"{mode} quick" if quick else mode
+    mode = mode if wizard else f"{mode} classic"
+    if flooders:
+        mode = f"{mode} +{flooders} флуд" + ("" if flood_control else " без защиты")
+    mode = f"{mode} конвейер" if pipeline else mode
+    mode = f"{mode} по {concurrency}" if concurrency else mode
+    return {
+        'mode': mode,
+        'users': users,
+        'steps': len(latencies),
+        'flows': stats.flows,
+        'flows_total': users * len(flows),
+        'timeouts': stats.timeouts,
+        'missing_buttons': stats.missing_buttons,
+        'rejected': stats.rejected,
+        'throughput': len(latencies) / elapsed,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99),
+        'rss_start': rss_start,
+        'rss_end': rss_end,
+        'calls': dict(api.calls),
+        'throttled': api.throttled,
+        'flood_sent': sum(spammer.sent for spammer in spammers),
+    }
+
+
+def print_result(result):
+    print(f"\n=== {result['mode']}: {result['users']} пользователей ===")
+    print(f"Форм пройдено: {result['flows']}/{result['flows_total']}, шагов: {result['steps']}, "
+          f"без ответа: {result['timeouts']}, кнопка не найдена: {result['missing_buttons']}, "
+          f"отвергнуто шагов: {result['rejected']}")
+    print(f"Пропускная способность: {result['throughput']:.0f} шагов/с")
+    if result['flood_sent']:
+        print(f"Флудеры прислали апдейтов: {result['flood_sent']}")
+    print(f"Задержка шага: p50 {result['p50'] * 1000:.1f} мс, p95 {result['p95'] * 1000:.1f} мс, "
+          f"p99 {result['p99'] * 1000:.1f} мс")
+    print(f"Память бота: {result['rss_start'] / 1024:.1f} → {result['rss_end'] / 1024:.1f} МБ "
+          f"(+{(result['rss_end'] - result['rss_start']) / 1024:.1f} МБ)")
+    calls = ', '.join(f"{method} {count}" for method, count in Counter(result['calls']).most_common())
+    print(f"Вызовы API: {calls}; ответов 429: {result['throttled']}")
+    sends = sum(count for method, count in result['calls'].items() if method in SEND_METHODS | {'answerCallbackQuery'})
+    flows = max(1, result['flows'])
+    edits = result['calls'].get('editMessageText', 0) + result['calls'].get('editMessageReplyMarkup', 0)
+    print(f"Вызовов API на форму: {sends / flows:.1f} (новых сообщений {result['calls'].get('sendMessage', 0) / flows:.1f}, "
+          f"правок {edits / flows:.1f})")
+
+
+async def main(args):
+    modes = ['polling', 'webhook'] if args.mode == 'compare' else [args.mode]
+    results = []
+    for mode in modes:
+        result = await run_load(mode, args.users, args.workers, args.latency, args.error_rate,
+                                args.ramp, args.timeout, args.api_port, args.webhook_port, args.quick,
+                                not args.classic, args.flooders, args.flood_rate, not args.no_flood_control,
+                                args.pipeline, args.concurrency)
+        if result is None:
+            sys.exit(1)
+        print_result(result)
+        results.append(result)
+
+    if len(results) > 1:
+        print("\nРежим        шагов/с   p50, мс   p95, мс   p99, мс")
+        for result in results:
+            print(f"{result['mode']:<12} {result['throughput']:>7.0f} {result['p50'] * 1000:>9.1f} "
+                  f"{result['p95'] * 1000:>9.1f} {result['p99'] * 1000:>9.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Нагрузочный тест бота на поддельном Bot API")
+    parser.add_argument('--users', type=int, default=200, help="сколько пользователей проходят все формы")
+    parser.add_argument('--mode', choices=['polling', 'webhook', 'compare'], default='polling')
+    parser.add_argument('--workers', type=int, default=1, help="процессов-воркеров у бота")
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка ответа API, с")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="доля отправок с ответом 429")
+    parser.add_argument('--ramp', type=float, default=2.0, help="за сколько секунд подключаются все пользователи")
+    parser.add_argument('--timeout', type=float, default=15.0, help="сколько ждать ответа бота на шаг, с")
+    parser.add_argument('--quick', action='store_true', help="формы одной командой вместо диалога")
+    parser.add_argument('--classic', action='store_true', help="каждый шаг формы новым сообщением (FORM_WIZARD=0)")
+    parser.add_argument('--flooders', type=int, default=0, help="сколько скриптов флудят командами и кнопками")
+    parser.add_argument('--flood-rate', type=float, default=500, help="апдейтов в секунду от каждого флудера")
+    parser.add_argument('--no-flood-control', action='store_true', help="без защиты от флуда (FLOOD_USER_RATE=0)")
+    parser.add_argument('--pipeline', action='store_true', help="слать текстовые шаги подряд, не дожидаясь ответов")
+    parser.add_argument('--concurrency', type=int, help="апдейтов одновременно в боте (UPDATE_CONCURRENCY)")
+    parser.add_argument('--api-port', type=int, default=8081)
+    parser.add_argument('--webhook-port', type=int, default=8082)
+    asyncio.run(main(parser.parse_args()))
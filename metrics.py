@@ -0,0 +1,170 @@
+import logging
+import time
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограмм задержки, секунды
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    """Гистограмма с заранее заданными корзинами: observe — bisect и три сложения.
+
+    Бот работает в одном потоке цикла событий, поэтому счетчики — обычные
+    числа без блокировок.
+    """
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # последняя корзина — больше всех границ
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        """Оценка квантиля по корзинам (линейно внутри корзины)"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if seen + count >= rank and count:
+                lower = self.buckets[index - 1] if index else 0.0
+                upper = self.buckets[index] if index < len(self.buckets) else self.buckets[-1]
+                return lower + (upper - lower) * (rank - seen) / count
+            seen += count
+        return self.buckets[-1]
+
+
+class Metrics:
+    """Счетчики и гистограммы бота в памяти процесса.
+
+    Обработчики — по имени и по состоянию FSM, вызовы Bot API — по методу.
+    Значения, которые дешевле посчитать при чтении (глубина очереди,
+    живые диалоги), регистрируются как gauge(имя, описание, функция).
+    """
+
+    def __init__(self):
+        self.handlers = defaultdict(Histogram)
+        self.states = defaultdict(Histogram)
+        self.handler_errors = Counter()
+        self.api = defaultdict(Histogram)
+        self.api_errors = Counter()
+        self.gauges = {}  # имя -> (тип, описание, функция)
+        self.started = time.monotonic()
+
+    def gauge(self, name, help_text, func, kind='gauge'):
+        self.gauges[name] = (kind, help_text, func)
+
+    # ==================== ФОРМАТ PROMETHEUS ====================
+    def render(self):
+        lines = []
+        self._histograms(lines, 'bot_handler_seconds', "Время обработчика апдейта", 'handler', self.handlers)
+        self._histograms(lines, 'bot_state_seconds', "Время обработки шага формы по состоянию FSM", 'state',
+                         self.states)
+        self._counters(lines, 'bot_handler_errors_total', "Исключения в обработчиках", 'handler',
+                       self.handler_errors)
+        self._histograms(lines, 'bot_api_seconds', "Время вызова Bot API", 'method', self.api)
+        self._counters(lines, 'bot_api_errors_total', "Ошибки вызовов Bot API", 'method', self.api_errors)
+        for name, (kind, help_text, func) in self.gauges.items():
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}", f"{name} {func()}"]
+        lines += ["# HELP bot_uptime_seconds Время работы процесса", "# TYPE bot_uptime_seconds gauge",
+                  f"bot_uptime_seconds {time.monotonic() - self.started:.0f}"]
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _histograms(lines, name, help_text, label, histograms):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for value, histogram in sorted(histograms.items()):
+            label_value = escape(value)
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{label}="{label_value}",le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{label}="{label_value}",le="+Inf"}} {histogram.count}')
+            lines.append(f'{name}_sum{{{label}="{label_value}"}} {histogram.sum:.6f}')
+            lines.append(f'{name}_count{{{label}="{label_value}"}} {histogram.count}')
+
+    @staticmethod
+    def _counters(lines, name, help_text, label, counter):
+        lines += [f"# HELP {name} {help_text}", f"# TYPE {name} counter"]
+        for value, count in sorted(counter.items()):
+            lines.append(f'{name}{{{label}="{escape(value)}"}} {count}')
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+# ==================== MIDDLEWARE ====================
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Внутренний middleware: время каждого обработчика и шага формы.
+
+    label(event, data) — имя для метрик вместо имени обработчика aiogram,
+    если тот сам раздает события дальше (как кнопки форм).
+    """
+
+    def __init__(self, metrics, label=None):
+        self.metrics = metrics
+        self.label = label
+
+    async def __call__(self, handler, event, data):
+        name = (self.label and self.label(event, data)) or data['handler'].callback.__name__
+        state = data.get('raw_state') or '-'
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            self.metrics.handler_errors[name] += 1
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            self.metrics.handlers[name].observe(elapsed)
+            self.metrics.states[state].observe(elapsed)
+
+
+class ApiMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: время и ошибки вызовов Bot API по методам"""
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+
+    async def __call__(self, make_request, bot, method):
+        name = method.__api_method__
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception:
+            self.metrics.api_errors[name] += 1
+            raise
+        finally:
+            # getUpdates — long polling, его время — ожидание апдейтов, а не задержка API
+            if name != 'getUpdates':
+                self.metrics.api[name].observe(time.perf_counter() - started)
+
+
+# ==================== HTTP ====================
+async def serve_metrics(metrics, host='127.0.0.1', port=9090):
+    """Отдает метрики в текстовом формате Prometheus на http://host:port/metrics"""
+    async def handle(request):
+        return web.Response(text=metrics.render(), headers={'Content-Type': CONTENT_TYPE})
+
+    app = web.Application()
+    app.router.add_get('/metrics', handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"📈 Метрики: http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,444 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import random
+import time
+import uuid
+from collections import deque
+
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramServerError
+
+logger = logging.getLogger(__name__)
+
+# Ошибки, после которых отправку есть смысл повторить; остальные (BadRequest, Forbidden) — нет
+RETRYABLE = (TelegramRetryAfter, TelegramNetworkError, TelegramServerError, asyncio.TimeoutError)
+
+
+def backoff_delay(attempt, base=2.0, cap=300.0):
+    """Пауза перед попыткой attempt: экспонента с джиттером (от половины до полной)"""
+    delay = min(cap, base * 2 ** (attempt - 1))
+    return delay / 2 + random.random() * delay / 2
+
+
+# ==================== TOKEN BUCKET ====================
+class TokenBucket:
+    """Token bucket: rate токенов в секунду, не больше capacity за раз"""
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated', 'waiting')
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.waiting = 0  # сколько обычных (не low) acquire ждут токена
+
+    def consume(self, now=None):
+        """Забирает токен. Возвращает 0, если токен есть, иначе сколько секунд ждать"""
+        now = time.monotonic() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def pause(self, seconds):
+        """Не выдавать токены ближайшие seconds секунд (после 429 с retry_after)"""
+        self.consume()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    async def acquire(self, low=False):
+        """Ждет, пока в ведре появится токен; low — только когда его не ждет никто без low"""
+        if low:
+            while True:
+                wait = min(1 / self.rate, 0.5) if self.waiting else self.consume()
+                if not wait:
+                    return
+                await asyncio.sleep(wait)
+        self.waiting += 1
+        try:
+            while True:
+                wait = self.consume()
+                if not wait:
+                    return
+                await asyncio.sleep(wait)
+        finally:
+            self.waiting -= 1
+
+
+# ==================== ОЧЕРЕДЬ ОТПРАВКИ ====================
+class OutboxJob:
+    """Одно сообщение, ожидающее отправки в тему.
+
+    keys — ключи идемпотентности постов в сообщении (у дайджеста их
+    несколько), key — первый из них, под ним сообщение лежит в журнале.
+    parts — тексты постов по порядку keys, если сообщение склеено из
+    нескольких (у восстановленных из журнала их нет). on_sent(message, keys)
+    получает ключи постов, которые действительно ушли в этом сообщении.
+    """
+    __slots__ = ('chat_id', 'thread_id', 'text', 'parts', 'on_sent', 'created', 'keys', 'key', 'attempts',
+                 'next_at', 'restored', 'bulk')
+
+    def __init__(self, chat_id, thread_id, text, on_sent=None, keys=None, parts=None, bulk=False):
+        self.chat_id = chat_id
+        self.thread_id = thread_id
+        self.text = text
+        self.parts = parts
+        self.on_sent = on_sent
+        self.created = time.monotonic()
+        self.keys = tuple(keys) if keys else (uuid.uuid4().hex,)
+        self.key = self.keys[0]
+        self.attempts = 0
+        self.next_at = 0.0
+        self.restored = False
+        self.bulk = bulk
+
+
+def single(on_sent):
+    """on_sent(message) одного поста в виде on_sent(message, keys)"""
+    if on_sent is None:
+        return None
+
+    async def callback(message, keys):
+        await on_sent(message)
+    return callback
+
+
+class Digest:
+    """Посты в одну тему, которые ждут склейки в одно сообщение"""
+    __slots__ = ('parts', 'size', 'handle')
+
+    def __init__(self):
+        self.parts = []  # [(текст, on_sent, key)]
+        self.size = 0
+        self.handle = None
+
+
+class Outbox:
+    """Очередь сообщений в темы форума с воркерами и лимитом на каждый чат.
+
+    Обработчики только кладут сообщение в очередь и сразу отвечают
+    пользователю, а воркеры отправляют его, не превышая лимит Telegram
+    (~20 сообщений в минуту в группу). Все темы одного форума делят
+    лимит своего chat_id, поэтому ведро заводится на chat_id — у каждого
+    форума (команды) свой бюджет. Поверх них общее ведро global_rate
+    сообщений в секунду держит общий лимит бота (~30 в секунду).
+
+    Если для темы задано окно склейки, посты, пришедшие в нее за window
+    секунд, уходят одним сообщением-дайджестом (не длиннее max_chars).
+
+    Массовые сообщения (bulk, например пачки /import) идут отдельной
+    очередью через bulk_workers воркеров и берут токены ведер, только
+    когда их не ждут обычные посты: импорт занимает свободный бюджет
+    чата, но не задерживает посты форм.
+
+    Сообщение, которое не ушло из-за 429, сети или 5xx, повторяется с
+    экспоненциальной паузой и джиттером (после 429 — не раньше
+    retry_after, и весь чат ждет вместе с ним), но не больше
+    max_attempts раз. Повторы возвращаются в очередь через отдельное
+    ведро retry_rate в секунду, чтобы после сбоя накопившиеся сообщения
+    не вызвали новый флуд-бан. С store (OutboxStore) повторы хранятся
+    на диске и отправляются после перезапуска; on_restored(key, message)
+    вызывается для каждого поста такого сообщения вместо потерянного on_sent.
+    """
+
+    DIGEST_SEPARATOR = "\n➖➖➖➖➖➖➖➖\n"
+
+    def __init__(self, workers=4, rate_per_minute=20, burst=3, maxsize=0, global_rate=30, store=None,
+                 max_attempts=8, retry_rate=1, retry_base=2.0, retry_cap=300.0, bulk_workers=2):
+        self.workers = workers
+        self.bulk_workers = bulk_workers
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.queue = asyncio.Queue(maxsize)
+        self.bulk = asyncio.Queue()
+        self.buckets = {}
+        self.bot = None
+        self._tasks = []
+        self.digests = {}  # (chat_id, thread_id, group) -> Digest
+        self.inflight = set()  # взяты воркерами из очереди и еще не отправлены
+
+        self.store = store
+        self.on_restored = None
+        self.max_attempts = max_attempts
+        self.retry_bucket = TokenBucket(retry_rate, 1)
+        self.retry_base = retry_base
+        self.retry_cap = retry_cap
+        self.retries = []  # куча (next_at, номер, job)
+        self._retry_seq = itertools.count()
+        self._retry_wakeup = asyncio.Event()
+
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.skipped = 0
+        self.coalesced = 0
+        self.started_at = None
+        self.latencies = deque(maxlen=10000)
+
+    def bucket(self, chat_id):
+        bucket = self.buckets.get(chat_id)
+        if bucket is None:
+            bucket = self.buckets[chat_id] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    async def load(self):
+        """Поднимает из журнала сообщения, не отправленные до перезапуска"""
+        if self.store is None:
+            return
+        for key, keys, chat_id, thread_id, text, attempts, next_at in await self.store.load():
+            job = OutboxJob(chat_id, thread_id, text, keys=keys)
+            job.attempts = attempts
+            job.restored = True
+            self._schedule(job, next_at)
+        if self.retries:
+            logger.info(f"📤 Из журнала восстановлено неотправленных сообщений: {len(self.retries)}")
+
+    def start(self, bot):
+        """Запускает воркеры очереди и повторы"""
+        self.bot = bot
+        self.started_at = time.monotonic()
+        self._tasks = [asyncio.create_task(self._worker(self.queue)) for _ in range(self.workers)]
+        self._tasks += [asyncio.create_task(self._worker(self.bulk)) for _ in range(self.bulk_workers)]
+        self._tasks.append(asyncio.create_task(self._retry_loop()))
+        logger.info(f"📤 Очередь отправки запущена: {self.workers} воркеров, "
+                    f"{self.rate * 60:g} сообщ./мин на чат")
+
+    async def stop(self, timeout=10):
+        """Дожидается отправки очереди (не дольше timeout) и останавливает воркеры.
+
+        Что не успело уйти, остается в журнале до следующего запуска — и
+        сообщения, чья отправка прервана на полпути (они уйдут повторно).
+        """
+        for topic in list(self.digests):
+            self._flush_digest(topic)
+        try:
+            await asyncio.wait_for(asyncio.gather(self.queue.join(), self.bulk.join()), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ Очередь не успела опустеть, осталось: {self.queue.qsize() + self.bulk.qsize()}")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        left = list(self.inflight)
+        self.inflight.clear()
+        for queue in (self.queue, self.bulk):
+            while not queue.empty():
+                left.append(queue.get_nowait())
+                queue.task_done()
+        if self.store is not None:
+            for job in left:
+                await self.store.save(job)
+            if self.retries or left:
+                logger.info(f"📤 Отложено до следующего запуска: {len(self.retries) + len(left)}")
+        elif self.retries or left:
+            logger.warning(f"⚠️ Потеряно неотправленных сообщений: {len(self.retries) + len(left)}")
+
+    async def put(self, chat_id, thread_id, text, on_sent=None, coalesce=None, key=None, keys=None, parts=None,
+                  bulk=False, group=None):
+        """Ставит сообщение в очередь. on_sent(message) вызывается после отправки.
+
+        coalesce — настройки склейки темы {'window': секунды, 'max_chars': символы};
+        без них (или с window=0) сообщение уходит отдельно; посты разных
+        group в один дайджест не склеиваются. key — ключ
+        идемпотентности: пост с уже отправленным ключом второй раз не уходит.
+        keys — ключи постов, уже склеенных в text вызывающим через
+        DIGEST_SEPARATOR (без склейки очередью), parts — их тексты; тогда
+        on_sent(message, keys) получает ключи постов, которые ушли (уже
+        отправленные раньше вырезаются). bulk — в очередь массовых сообщений.
+        """
+        if keys:
+            job = OutboxJob(chat_id, thread_id, text, on_sent, keys=keys, parts=parts, bulk=bulk)
+            await (self.bulk if bulk else self.queue).put(job)
+            return
+        key = key or uuid.uuid4().hex
+        if not coalesce or not coalesce.get('window') or bulk:
+            job = OutboxJob(chat_id, thread_id, text, single(on_sent), keys=(key,), bulk=bulk)
+            await (self.bulk if bulk else self.queue).put(job)
+            return
+
+        topic = (chat_id, thread_id, group)
+        digest = self.digests.get(topic)
+        extra = len(self.DIGEST_SEPARATOR) if digest else 0
+        if digest and digest.size + extra + len(text) > coalesce['max_chars']:
+            self._flush_digest(topic)
+            digest = None
+        if digest is None:
+            digest = self.digests[topic] = Digest()
+            loop = asyncio.get_running_loop()
+            digest.handle = loop.call_later(coalesce['window'], self._flush_digest, topic)
+            extra = 0
+        digest.parts.append((text, on_sent, key))
+        digest.size += extra + len(text)
+
+    def _flush_digest(self, topic):
+        """Отправляет накопленные посты темы одним сообщением"""
+        digest = self.digests.pop(topic, None)
+        if digest is None:
+            return
+        digest.handle.cancel()
+        texts = [text.strip() for text, _, _ in digest.parts]
+        callbacks = {key: on_sent for _, on_sent, key in digest.parts if on_sent is not None}
+
+        async def on_sent(message, keys):
+            for key in keys:
+                if key in callbacks:
+                    await callbacks[key](message)
+
+        self.coalesced += len(texts) - 1
+        chat_id, thread_id, _ = topic
+        self.queue.put_nowait(OutboxJob(chat_id, thread_id, self.DIGEST_SEPARATOR.join(texts),
+                                        on_sent if callbacks else None, keys=[key for _, _, key in digest.parts],
+                                        parts=texts))
+
+    async def _worker(self, queue):
+        while True:
+            job = await queue.get()
+            self.inflight.add(job)
+            try:
+                await self._deliver(job)
+            except asyncio.CancelledError:
+                # Остановка посреди отправки: сообщение остается в inflight, stop() запишет его в журнал
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка очереди отправки в тему {job.thread_id}: {e}")
+            finally:
+                queue.task_done()
+            self.inflight.discard(job)
+
+    async def _deliver(self, job):
+        if self.store is not None:
+            delivered = await self.store.delivered(job.keys)
+            if delivered.keys() >= set(job.keys):
+                # Сообщение уже ушло (повтор после частичного успеха) — второй раз не публикуем
+                self.skipped += 1
+                await self.store.drop(job)
+                return
+            if delivered:
+                self._trim(job, delivered)
+
+        await self.bucket(job.chat_id).acquire(low=job.bulk)
+        await self.global_bucket.acquire(low=job.bulk)
+        try:
+            message = await self.bot.send_message(
+                chat_id=job.chat_id,
+                message_thread_id=job.thread_id,
+                text=job.text
+            )
+        except RETRYABLE as e:
+            await self._retry(job, e)
+            return
+        except Exception as e:
+            self.failed += 1
+            logger.error(f"Ошибка отправки в тему {job.thread_id}: {e}")
+            if job.attempts and self.store is not None:
+                await self.store.drop(job)
+            return
+
+        # Сообщение ушло: прерванная дальше остановка не должна отправить его еще раз
+        self.inflight.discard(job)
+        self.sent += 1
+        self.latencies.append(time.monotonic() - job.created)
+        if self.store is not None:
+            await self.store.mark_delivered(job, getattr(message, 'message_id', None))
+        try:
+            if job.on_sent is not None:
+                await job.on_sent(message, job.keys)
+            elif job.restored and self.on_restored is not None:
+                for key in job.keys:
+                    await self.on_restored(key, message)
+        except Exception as e:
+            logger.error(f"Ошибка обработки отправленного сообщения: {e}")
+
+    def _trim(self, job, delivered):
+        """Вырезает из сообщения посты, уже отправленные другим сообщением (пачки пересекаются)"""
+        parts = job.parts or job.text.split(self.DIGEST_SEPARATOR)
+        if len(parts) != len(job.keys):
+            # Текст не делится на посты по ключам: лучше повтор части, чем потеря остальных
+            logger.warning(f"⚠️ Сообщение {job.key} частично уже отправлено, но не делится на посты — "
+                           f"отправляется целиком")
+            return
+        kept = [(key, text) for key, text in zip(job.keys, parts) if key not in delivered]
+        self.skipped += len(job.keys) - len(kept)
+        job.keys = tuple(key for key, _ in kept)
+        job.parts = [text for _, text in kept]
+        job.text = self.DIGEST_SEPARATOR.join(job.parts)
+
+    # ==================== ПОВТОРЫ ====================
+    async def _retry(self, job, error):
+        """Откладывает сообщение после временной ошибки или сдается после max_attempts"""
+        job.attempts += 1
+        if job.attempts >= self.max_attempts:
+            self.failed += 1
+            logger.error(f"Не удалось отправить в тему {job.thread_id} за {job.attempts} попыток: {error}")
+            if self.store is not None:
+                await self.store.drop(job)
+            return
+
+        if isinstance(error, TelegramRetryAfter):
+            # Telegram сам сказал, сколько ждать: чат молчит это время, повтор — не раньше
+            self.bucket(job.chat_id).pause(error.retry_after)
+            delay = error.retry_after + random.random() * self.retry_base
+        else:
+            delay = backoff_delay(job.attempts, self.retry_base, self.retry_cap)
+        self.retried += 1
+        logger.warning(f"⚠️ Отправка в тему {job.thread_id} не удалась ({error}), "
+                       f"попытка {job.attempts + 1} через {delay:.1f} с")
+        next_at = time.time() + delay
+        job.next_at = next_at
+        if self.store is not None:
+            await self.store.save(job)
+        self._schedule(job, next_at)
+
+    def _schedule(self, job, next_at):
+        job.next_at = next_at
+        heapq.heappush(self.retries, (next_at, next(self._retry_seq), job))
+        self._retry_wakeup.set()
+
+    async def _retry_loop(self):
+        """Возвращает отложенные сообщения в очередь в их время, не быстрее retry_bucket"""
+        while True:
+            if not self.retries:
+                self._retry_wakeup.clear()
+                await self._retry_wakeup.wait()
+                continue
+            wait = self.retries[0][0] - time.time()
+            if wait > 0:
+                self._retry_wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._retry_wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self.retry_bucket.acquire()
+            _, _, job = heapq.heappop(self.retries)
+            await (self.bulk if job.bulk else self.queue).put(job)
+
+    def stats(self):
+        """Счетчики очереди: отправлено, ошибки, повторы, сэкономлено склейкой, глубина, задержки"""
+        latencies = sorted(self.latencies)
+        elapsed = time.monotonic() - self.started_at if self.started_at else 0
+        return {
+            'sent': self.sent,
+            'failed': self.failed,
+            'retried': self.retried,
+            'pending_retries': len(self.retries),
+            'skipped_duplicates': self.skipped,
+            'saved_calls': self.coalesced,
+            'depth': self.queue.qsize(),
+            'bulk_depth': self.bulk.qsize(),
+            'throughput': self.sent / elapsed if elapsed else 0.0,
+            'p50': percentile(latencies, 50),
+            'p99': percentile(latencies, 99),
+        }
+
+
+def percentile(sorted_values, p):
+    """Перцентиль по уже отсортированному списку"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))
+    return sorted_values[index]
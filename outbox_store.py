@@ -0,0 +1,121 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Ключей в одном IN (...): у старых сборок SQLite не больше 999 переменных на запрос
+IN_CHUNK = 500
+
+
+class OutboxStore:
+    """Журнал очереди отправки на диске.
+
+    В pending лежат посты, которые не удалось отправить, со временем
+    следующей попытки — они переживают перезапуск бота. В delivered
+    записывается ключ идемпотентности каждого отправленного поста вместе
+    с message_id: если пост уже ушел, а бот упал до того, как убрал его
+    из pending, при повторе он будет пропущен, а не опубликован дважды.
+    Воркеры в режиме нескольких процессов делят один файл, у каждого
+    свои строки pending (shard).
+    """
+
+    def __init__(self, path='outbox.db', shard=0, shards=1, keep_days=7):
+        self.path = path
+        self.shard = shard
+        self.shards = shards
+        self.keep_days = keep_days
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='outbox-store')
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS pending (
+                key TEXT PRIMARY KEY,
+                keys TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                thread_id INTEGER,
+                text TEXT NOT NULL,
+                attempts INTEGER NOT NULL,
+                next_at REAL NOT NULL,
+                shard INTEGER NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS delivered (
+                key TEXT PRIMARY KEY,
+                message_id INTEGER,
+                delivered_at REAL NOT NULL
+            );
+        """)
+        self._conn.commit()
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def close(self):
+        await self._run(self._conn.close)
+        self._executor.shutdown()
+
+    async def load(self):
+        """Неотправленные посты этого процесса: [(key, keys, chat_id, thread_id, text, attempts, next_at)].
+
+        Нулевой воркер забирает и строки воркеров, которых больше нет
+        (если число процессов уменьшили).
+        """
+        return await self._run(self._load)
+
+    def _load(self):
+        with self._conn:
+            self._conn.execute("DELETE FROM delivered WHERE delivered_at < ?",
+                               (time.time() - self.keep_days * 86400,))
+            if self.shard == 0:
+                self._conn.execute("UPDATE pending SET shard = 0 WHERE shard >= ?", (self.shards,))
+        rows = self._conn.execute(
+            "SELECT key, keys, chat_id, thread_id, text, attempts, next_at FROM pending WHERE shard = ? "
+            "ORDER BY next_at", (self.shard,)
+        ).fetchall()
+        return [(key, tuple(json.loads(keys)), *rest) for key, keys, *rest in rows]
+
+    async def save(self, job):
+        """Записывает (или обновляет) неотправленный пост"""
+        await self._run(self._execute_many, [(
+            "INSERT OR REPLACE INTO pending VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (job.key, json.dumps(job.keys), job.chat_id, job.thread_id, job.text, job.attempts,
+             job.next_at, self.shard)
+        )])
+
+    async def drop(self, job):
+        """Убирает пост из журнала без отметки об отправке (ошибка без повтора)"""
+        await self._run(self._execute_many, [("DELETE FROM pending WHERE key = ?", (job.key,))])
+
+    async def delivered(self, keys):
+        """Какие из ключей уже отправлены: {ключ: message_id} (по IN_CHUNK ключей на запрос)"""
+        return await self._run(self._delivered, list(keys))
+
+    def _delivered(self, keys):
+        found = {}
+        for start in range(0, len(keys), IN_CHUNK):
+            chunk = keys[start:start + IN_CHUNK]
+            placeholders = ', '.join('?' * len(chunk))
+            found.update(self._conn.execute(
+                f"SELECT key, message_id FROM delivered WHERE key IN ({placeholders})", chunk
+            ).fetchall())
+        return found
+
+    async def mark_delivered(self, job, message_id):
+        """Отмечает ключи поста отправленными и убирает его из pending одной транзакцией"""
+        now = time.time()
+        await self._run(self._execute_many, [
+            *(("INSERT OR REPLACE INTO delivered VALUES (?, ?, ?)", (key, message_id, now)) for key in job.keys),
+            ("DELETE FROM pending WHERE key = ?", (job.key,)),
+        ])
+
+    def _execute_many(self, statements):
+        with self._conn:
+            for sql, params in statements:
+                self._conn.execute(sql, params)
+
+    def _fetch(self, sql, params=()):
+        return self._conn.execute(sql, params).fetchall()
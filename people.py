@@ -0,0 +1,301 @@
+import asyncio
+import bisect
+import heapq
+import logging
+import sqlite3
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from aiogram import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+# Кириллица -> латиница, чтобы "иван" находил и @ivan, и Ivan Petrov (и наоборот)
+TRANSLIT = str.maketrans({
+    'а': 'a', 'б': 'b', 'в': 'v', 'г': 'g', 'д': 'd', 'е': 'e', 'ж': 'zh', 'з': 'z', 'и': 'i', 'й': 'i',
+    'к': 'k', 'л': 'l', 'м': 'm', 'н': 'n', 'о': 'o', 'п': 'p', 'р': 'r', 'с': 's', 'т': 't', 'у': 'u',
+    'ф': 'f', 'х': 'h', 'ц': 'ts', 'ч': 'ch', 'ш': 'sh', 'щ': 'sch', 'ъ': '', 'ы': 'y', 'ь': '', 'э': 'e',
+    'ю': 'yu', 'я': 'ya',
+})
+
+
+def name_key(text):
+    """Имя для сравнения: нижний регистр, ё -> е, без @, подчеркивания как пробелы"""
+    return ' '.join(text.lower().replace('ё', 'е').replace('_', ' ').lstrip('@').split())
+
+
+def person_handle(person):
+    """Как записать человека в форму: @username, иначе Имя_Фамилия"""
+    if person['username']:
+        return f"@{person['username']}"
+    return '_'.join(person['full_name'].split())
+
+
+def person_keys(person):
+    """Ключи префиксного индекса: username, полное имя, каждое слово имени и их латиница"""
+    keys = set()
+    if person['username']:
+        keys.add(name_key(person['username']))
+    full_name = name_key(person['full_name'])
+    if full_name:
+        keys.add(full_name)
+        keys.update(full_name.split())
+    keys.update([key.translate(TRANSLIT) for key in keys])
+    return tuple(sorted(keys))
+
+
+class PeopleDirectory:
+    """Участники форумов команд по отправителям сообщений.
+
+    Каждое сообщение в группе (see) обновляет запись человека в памяти:
+    имя, username и число сообщений. В базу пишутся пачкой раз в
+    flush_interval секунд только изменившиеся записи. Поиск по первым
+    буквам (suggest) идет по отсортированному списку ключей форума
+    (username, имя целиком, отдельные слова имени и их латиница) через
+    bisect: совпадения — срез списка, из которого heapq берет limit
+    самых активных. Если префикс подходит больше чем к scan_limit ключам
+    (одна-две буквы в большом форуме), вместо разбора всех совпадений
+    участники перебираются от самых активных (порядок пересобирается раз
+    в фоне, при записи в базу, раз в rank_interval секунд) до первых
+    limit подходящих — их среди первых
+    же встречается много. Так и на тысячах участников подсказка стоит
+    доли миллисекунды. Апдейты одного форума с несколькими
+    воркерами расходятся по разным процессам — refresh дочитывает чужие
+    записи, если базу менял другой процесс (PRAGMA data_version).
+    """
+
+    def __init__(self, path='people.db', flush_interval=5.0, scan_limit=400, rank_interval=60.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.scan_limit = scan_limit
+        self.rank_interval = rank_interval
+        self.people = {}                # (chat_id, user_id) -> человек
+        self.members = defaultdict(dict)  # chat_id -> {user_id: человек}
+        self.keys = defaultdict(list)   # chat_id -> [(ключ, user_id)] по порядку
+        self.ranked = {}                # chat_id -> (когда собран, [user_id] от самых активных)
+        self.data_version = None
+        self.loaded_until = 0
+        self._dirty = set()
+        self._flush_handle = None
+        self._flushing = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='people')
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS people (
+                chat_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                username TEXT,
+                full_name TEXT NOT NULL,
+                messages INTEGER NOT NULL DEFAULT 0,
+                updated REAL NOT NULL,
+                PRIMARY KEY (chat_id, user_id)
+            );
+            CREATE INDEX IF NOT EXISTS people_updated ON people (updated);
+        """)
+        self._conn.commit()
+
+    def __len__(self):
+        return len(self.people)
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def load(self):
+        """Все известные участники из базы"""
+        started = time.perf_counter()
+        self.data_version, rows = await self._run(self._load_since, 0)
+        self._merge(rows, keep_order=False)
+        for entries in self.keys.values():
+            entries.sort()
+        for chat_id in self.members:
+            self._rank(chat_id)
+        logger.info(f"👥 Участников форумов: {len(self)} за {(time.perf_counter() - started) * 1000:.1f} мс")
+
+    async def refresh(self):
+        """Дочитывает участников, записанных другими процессами"""
+        version = await self._run(self._data_version)
+        if version == self.data_version:
+            return
+        # Немного назад: запись другого процесса могла закоммититься чуть позже своего updated
+        self.data_version, rows = await self._run(self._load_since, self.loaded_until - self.flush_interval - 1)
+        self._merge(rows)
+
+    def _merge(self, rows, keep_order=True):
+        for chat_id, user_id, username, full_name, messages, updated in rows:
+            key = (chat_id, user_id)
+            person = self.people.get(key)
+            # Свои еще не записанные изменения имени важнее прочитанных
+            if person is None or (key not in self._dirty and
+                                  (person['username'], person['full_name']) != (username, full_name)):
+                person = self._set(chat_id, user_id, username, full_name, keep_order)
+            person['messages'] = max(person['messages'], messages)
+            self.loaded_until = max(self.loaded_until, updated)
+
+    def _data_version(self):
+        # Меняется только после коммитов других соединений, свои записи его не трогают
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _load_since(self, since):
+        rows = self._conn.execute("SELECT chat_id, user_id, username, full_name, messages, updated FROM people "
+                                  "WHERE updated > ?", (since,)).fetchall()
+        return self._data_version(), rows
+
+    async def close(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        await self.flush()
+        await self._run(self._conn.close)
+        self._executor.shutdown()
+
+    # ==================== ИЗМЕНЕНИЯ ====================
+    def see(self, chat_id, user):
+        """Человек написал в форум chat_id: новый — в справочник, сменил имя — переиндексировать"""
+        if user is None or user.is_bot:
+            return
+        key = (chat_id, user.id)
+        person = self.people.get(key)
+        if person is None or person['username'] != user.username or person['full_name'] != user.full_name:
+            person = self._set(chat_id, user.id, user.username, user.full_name)
+        person['messages'] += 1
+        self._dirty.add(key)
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.flush_interval, self._schedule_flush)
+
+    def forget(self, chat_id, user_id):
+        """Человек вышел из форума: больше не предлагать"""
+        person = self.people.pop((chat_id, user_id), None)
+        if person is not None:
+            self._unindex(chat_id, user_id, person)
+            del self.members[chat_id][user_id]
+            self._dirty.discard((chat_id, user_id))
+            asyncio.ensure_future(self._run(self._delete, chat_id, user_id))
+
+    def _set(self, chat_id, user_id, username, full_name, keep_order=True):
+        key = (chat_id, user_id)
+        old = self.people.get(key)
+        if old is not None:
+            self._unindex(chat_id, user_id, old)
+        person = {'user_id': user_id, 'username': username, 'full_name': full_name,
+                  'messages': old['messages'] if old else 0}
+        person['keys'] = person_keys(person)
+        # Ключи одной строкой: проверка префикса при переборе — поиск подстроки "\nпрефикс"
+        person['terms'] = '\n' + '\n'.join(person['keys'])
+        if old is None and chat_id in self.ranked:
+            # Новичок — в конец порядка по активности, до его пересборки
+            self.ranked[chat_id][1].append(user_id)
+        self.people[key] = person
+        self.members[chat_id][user_id] = person
+        entries = self.keys[chat_id]
+        for name in person['keys']:
+            if keep_order:
+                bisect.insort(entries, (name, user_id))
+            else:
+                entries.append((name, user_id))
+        return person
+
+    def _unindex(self, chat_id, user_id, person):
+        entries = self.keys[chat_id]
+        for name in person['keys']:
+            i = bisect.bisect_left(entries, (name, user_id))
+            if i < len(entries) and entries[i] == (name, user_id):
+                del entries[i]
+
+    def _schedule_flush(self):
+        self._flush_handle = None
+        asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        if self._flushing is not None:
+            await self._flushing
+        if not self._dirty:
+            return
+
+        dirty, self._dirty = self._dirty, set()
+        # Порядок по активности пересобирается здесь, в фоне, а не на подсказке
+        ranked_before = time.monotonic() - self.rank_interval
+        for chat_id in {chat_id for chat_id, _ in dirty}:
+            if self.ranked.get(chat_id, (0,))[0] < ranked_before:
+                self._rank(chat_id)
+        now = time.time()
+        rows = [(chat_id, user_id, person['username'], person['full_name'], person['messages'], now)
+                for chat_id, user_id in dirty
+                if (person := self.people.get((chat_id, user_id))) is not None]
+        self._flushing = asyncio.get_running_loop().run_in_executor(self._executor, self._write, rows)
+        try:
+            await self._flushing
+        except Exception as e:
+            logger.error(f"Ошибка записи справочника участников {self.path}: {e}")
+        finally:
+            self._flushing = None
+
+    def _write(self, rows):
+        # Счетчик сообщений — наибольший из своего и записанного другим процессом
+        with self._conn:
+            self._conn.executemany("""
+                INSERT INTO people VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT (chat_id, user_id) DO UPDATE SET username = excluded.username,
+                    full_name = excluded.full_name, messages = MAX(messages, excluded.messages),
+                    updated = excluded.updated
+            """, rows)
+
+    def _delete(self, chat_id, user_id):
+        with self._conn:
+            self._conn.execute("DELETE FROM people WHERE chat_id = ? AND user_id = ?", (chat_id, user_id))
+
+    # ==================== ПОИСК ====================
+    def suggest(self, chat_id, text, limit=6):
+        """Участники форума, у которых username или слово имени начинается с text, самые активные первыми"""
+        prefix = name_key(text)
+        if not prefix:
+            return []
+        entries = self.keys.get(chat_id, ())
+        queries = tuple({prefix, prefix.translate(TRANSLIT)})
+        ranges = [(bisect.bisect_left(entries, (query,)), bisect.bisect_left(entries, (query + '\U0010ffff',)))
+                  for query in queries]
+        if sum(end - start for start, end in ranges) <= self.scan_limit:
+            found = {user_id for start, end in ranges for _, user_id in entries[start:end]}
+            people = [self.people[(chat_id, user_id)] for user_id in found]
+            return heapq.nsmallest(limit, people, key=lambda person: (-person['messages'], person['user_id']))
+
+        # Совпадений много: первые limit подходящих среди самых активных
+        first, last = ('\n' + queries[0], '\n' + queries[-1])
+        people = []
+        ranked = self.ranked.get(chat_id) or self._rank(chat_id)
+        for user_id in ranked[1]:
+            person = self.people.get((chat_id, user_id))
+            if person is not None and (first in person['terms'] or last in person['terms']):
+                people.append(person)
+                if len(people) == limit:
+                    break
+        return people
+
+    def _rank(self, chat_id):
+        """Участники форума от самых активных"""
+        members = self.members[chat_id]
+        order = sorted(members, key=lambda user_id: -members[user_id]['messages'])
+        self.ranked[chat_id] = (time.monotonic(), order)
+        return self.ranked[chat_id]
+
+    def get(self, chat_id, user_id):
+        return self.people.get((chat_id, user_id))
+
+
+class PeopleMiddleware(BaseMiddleware):
+    """Внешний middleware сообщений: отправители (и новые участники) групп — в справочник"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    async def __call__(self, handler, event, data):
+        if event.chat.type in ('group', 'supergroup'):
+            self.directory.see(event.chat.id, event.from_user)
+            for user in event.new_chat_members or ():
+                self.directory.see(event.chat.id, user)
+            if event.left_chat_member is not None:
+                self.directory.forget(event.chat.id, event.left_chat_member.id)
+        return await handler(event, data)
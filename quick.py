@@ -0,0 +1,140 @@
+import re
+
+from config import PROJECTS, STATUSES, PRIORITIES, RESOURCE_TYPES
+from task_store import parse_due_date
+from reports import parse_period
+
+PERSON_RE = re.compile(r'^@\w{3,}$')
+LINK_RE = re.compile(r'^(?:https?://|www\.|t\.me/)\S+$', re.IGNORECASE)
+PERIOD_RE = re.compile(r'^\d{1,2}\.\d{1,2}(?:\.\d{2,4})?-\d{1,2}\.\d{1,2}(?:\.\d{2,4})?$')
+# Текстовые поля разделяются " | " или переносом строки
+TEXT_SPLIT_RE = re.compile(r'\s*(?:\||\n)\s*')
+
+REPORT_PERIOD_KEYS = {'day': 'day', 'week': 'week', 'month': 'month',
+                      'день': 'day', 'неделя': 'week', 'месяц': 'month'}
+
+# Что можно указать в команде для каждой формы: справочники (с ограничением ключей),
+# поле даты, человека (@username), ссылки и текстовые поля по порядку.
+QUICK_FORMS = {
+    'deadline': {'catalogs': [('project', PROJECTS, None), ('priority', PRIORITIES, None),
+                              ('status', STATUSES, None)],
+                 'date': 'date', 'person': 'responsible', 'text': ['task']},
+    'question': {'catalogs': [('project', PROJECTS, None), ('priority', PRIORITIES, None)],
+                 'person': 'to_who', 'text': ['question', 'context']},
+    'done': {'catalogs': [('project', PROJECTS, None), ('status', STATUSES, ('done', 'review'))],
+             'link': 'link', 'text': ['task', 'check']},
+    'idea': {'catalogs': [('project', PROJECTS, None), ('priority', PRIORITIES, None)],
+             'text': ['idea', 'benefit']},
+    'resource': {'catalogs': [('project', PROJECTS, None), ('resource_type', RESOURCE_TYPES, None)],
+                 'link': 'link', 'text': ['description']},
+    'report': {'catalogs': [], 'period': 'period', 'text': ['comment']},
+    'status': {'catalogs': [('project', PROJECTS, None), ('status', STATUSES, None)],
+               'person': 'responsible', 'text': ['query']},
+    'search': {'catalogs': [('project', PROJECTS, None), ('status', STATUSES, None), ('priority', PRIORITIES, None)],
+               'text': ['query']},
+}
+
+# Необязательные поля: если в команде есть основной текст, а их нет, — значение по умолчанию
+# вместо лишнего вопроса (в диалоге на них отвечают "нет")
+QUICK_DEFAULTS = {
+    'question': {'context': 'не указан'},
+    'done': {'link': 'не указана'},
+    'resource': {'link': 'не указана'},
+}
+
+
+def aliases(key, name):
+    """Как можно написать значение справочника: ключ, хэштег без # или слово без эмодзи"""
+    name = name.lower().lstrip('#')
+    return {key.lower(), name, name.split()[-1]}
+
+
+class QuickParser:
+    """Разбор формы из одного сообщения: /deadline bm 30.04 high @ivan doing Сдать макет.
+
+    Для каждой формы один раз строится таблица "слово -> (поле, значение)"
+    из ключей и хэштегов справочников, поэтому разбор — один проход по
+    словам со словарным поиском. Параметры идут в начале в любом порядке,
+    первое нераспознанное слово начинает текст. Таблица перестраивается,
+    когда меняется version любого справочника (правка catalogs.json на лету).
+    """
+
+    def __init__(self, forms=QUICK_FORMS, defaults=QUICK_DEFAULTS):
+        self.forms = forms
+        self.defaults = defaults
+        self._tables = {}  # форма -> (версии справочников, таблица, таблицы по полям)
+        self.builds = 0
+
+    def table(self, form):
+        return self._build(form)[1]
+
+    def _build(self, form):
+        spec = self.forms[form]
+        versions = tuple(getattr(catalog, 'version', None) for _, catalog, _ in spec['catalogs'])
+        entry = self._tables.get(form)
+        if entry is not None and entry[0] == versions:
+            return entry
+
+        table = {}
+        fields = {}
+        for field, catalog, keys in spec['catalogs']:
+            values = fields[field] = {}
+            for key, name in catalog.items():
+                if keys is None or key in keys:
+                    for alias in aliases(key, name):
+                        # При совпадении у двух полей слово достается первому
+                        table.setdefault(alias, (field, name))
+                        values.setdefault(alias, name)
+        entry = self._tables[form] = (versions, table, fields)
+        self.builds += 1
+        return entry
+
+    def resolve(self, form, field, value):
+        """Значение справочника для поля формы по ключу, хэштегу или слову; None, если такого нет"""
+        values = self._build(form)[2].get(field, {})
+        return values.get(str(value).strip().lower().lstrip('#'))
+
+    def parse(self, form, text):
+        """Поля формы из текста после команды; нераспознанного поля в результате нет"""
+        spec = self.forms[form]
+        table = self.table(form)
+        parts = TEXT_SPLIT_RE.split(text.strip())
+        words = parts[0].split()
+        data = {}
+        index = 0
+        for index, word in enumerate(words):
+            found = table.get(word.lower().lstrip('#'))
+            if found is None:
+                found = self._special(spec, word)
+            if found is None or found[0] in data:
+                break
+            data[found[0]] = found[1]
+        else:
+            index = len(words)
+
+        first = ' '.join(words[index:])
+        texts = [first] + parts[1:] if first else parts[1:]
+        for field, value in zip(spec['text'], texts):
+            if value:
+                data[field] = value
+        if spec['text'][0] in data:
+            for field, value in self.defaults.get(form, {}).items():
+                data.setdefault(field, value)
+        return data
+
+    @staticmethod
+    def _special(spec, word):
+        """Дата, @человек, ссылка или период отчета"""
+        if 'date' in spec and word[0].isdigit() and parse_due_date(word):
+            return spec['date'], word
+        if 'person' in spec and PERSON_RE.match(word):
+            return spec['person'], word
+        if 'link' in spec and LINK_RE.match(word):
+            return spec['link'], word
+        if 'period' in spec:
+            period = REPORT_PERIOD_KEYS.get(word.lower())
+            if period:
+                return spec['period'], period
+            if PERIOD_RE.match(word) and parse_period(word):
+                return spec['period'], word
+        return None
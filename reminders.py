@@ -0,0 +1,142 @@
+import asyncio
+import heapq
+import logging
+import time
+from datetime import date, datetime
+
+logger = logging.getLogger(__name__)
+
+# Этапы напоминаний о дедлайне: за день, в день срока, на следующий день после срока
+TOMORROW, TODAY, OVERDUE = 1, 2, 3
+STAGE_OFFSETS = {TOMORROW: -1, TODAY: 0, OVERDUE: 1}
+DAY = 24 * 60 * 60
+
+
+class ReminderScheduler:
+    """Напоминания о дедлайнах на одной куче таймеров.
+
+    Для каждого незакрытого дедлайна в куче лежит только ближайший этап
+    (fire_at, task_id, stage). Одна задача asyncio спит до вершины кучи
+    и просыпается раньше, только если добавлен более ранний элемент, —
+    без опроса и без отдельной задачи на каждый дедлайн. Срабатывает
+    только запись, поставленная для дедлайна последней: старые (дедлайн
+    закрыли и открыли снова, этап переставили) из кучи не удаляются,
+    а пропускаются, когда до них дойдет очередь.
+    notify(task, stage) отправляет напоминание и сохраняет этап.
+    """
+
+    def __init__(self, notify, hour=10):
+        self.notify = notify
+        self.hour = hour
+        self.heap = []
+        self.tasks = {}        # task_id -> данные дедлайна; нет в словаре — напоминания сняты
+        self.entries = {}      # task_id -> актуальная запись кучи
+        self._wakeup = asyncio.Event()
+        self._runner = None
+        self.fired = 0
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def start(self):
+        self._runner = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._runner:
+            self._runner.cancel()
+            await asyncio.gather(self._runner, return_exceptions=True)
+            self._runner = None
+
+    # ==================== ПЛАНИРОВАНИЕ ====================
+    def schedule(self, task, catch_up=False, now=None):
+        """Ставит ближайший этап напоминания для дедлайна.
+
+        task — строка хранилища с id, due_date и reminder_stage. Пропущенные
+        этапы (бот был выключен) при catch_up=True сводятся к одному
+        напоминанию — самому позднему; иначе пропускаются молча.
+        """
+        entry = self._entry(task, catch_up, time.time() if now is None else now)
+        if entry is None:
+            return False
+        heapq.heappush(self.heap, entry)
+        if self.heap[0] is entry:
+            self._wakeup.set()
+        return True
+
+    def _entry(self, task, catch_up, now):
+        due = date.fromisoformat(task['due_date'])
+        base = datetime(due.year, due.month, due.day, self.hour).timestamp()
+        stored = task.get('reminder_stage', 0)
+        stage = missed = None
+        for candidate, offset in STAGE_OFFSETS.items():
+            if candidate <= stored:
+                continue
+            fire_at = base + offset * DAY
+            if fire_at > now:
+                stage = candidate
+                break
+            missed = candidate
+
+        if missed and catch_up:
+            # Срок уже прошел — сразу "просрочен", даже если его час еще не настал
+            stage = OVERDUE if due < date.fromtimestamp(now) else missed
+            fire_at = now
+        elif stage is None:
+            return None
+
+        entry = (fire_at, task['id'], stage)
+        self.tasks[task['id']] = task
+        self.entries[task['id']] = entry
+        return entry
+
+    def cancel(self, task_id):
+        """Снимает напоминания (дедлайн закрыт); запись уйдет из кучи при срабатывании"""
+        self.tasks.pop(task_id, None)
+        self.entries.pop(task_id, None)
+
+    def rebuild(self, deadlines):
+        """Собирает кучу заново из сохраненных незакрытых дедлайнов (при старте)"""
+        started = time.perf_counter()
+        now = time.time()
+        self.heap, self.tasks, self.entries = [], {}, {}
+        for task in deadlines:
+            entry = self._entry(task, True, now)
+            if entry is not None:
+                self.heap.append(entry)
+        heapq.heapify(self.heap)
+        self._wakeup.set()
+        logger.info(f"⏰ Запланировано напоминаний: {len(self.heap)} "
+                    f"за {(time.perf_counter() - started) * 1000:.1f} мс")
+
+    # ==================== ЦИКЛ ====================
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            if not self.heap:
+                await self._wakeup.wait()
+                continue
+
+            delay = self.heap[0][0] - time.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            entry = heapq.heappop(self.heap)
+            _, task_id, stage = entry
+            if self.entries.get(task_id) is not entry:
+                continue  # дедлайн закрыт или для него поставлена запись новее
+            del self.entries[task_id]
+            task = self.tasks.pop(task_id)
+            if task.get('reminder_stage', 0) >= stage:
+                continue
+
+            try:
+                await self.notify(task, stage)
+                self.fired += 1
+            except Exception as e:
+                logger.error(f"Ошибка напоминания о дедлайне {task_id}: {e}")
+            task['reminder_stage'] = stage
+            self.schedule(task)
@@ -0,0 +1,171 @@
+import logging
+import time
+from collections import Counter, defaultdict
+from datetime import date, timedelta
+
+from task_store import DATE_RE, rollup_keys
+
+logger = logging.getLogger(__name__)
+
+# Сколько дней готовых задач держать в памяти (самый длинный отчет — месяц)
+DONE_DAYS = 31
+# Сколько готовых задач одного проекта перечислять в отчете и сколько символов от каждой
+DONE_LIMIT = 10
+TITLE_LIMIT = 60
+
+KIND_LABELS = {
+    'deadline': "📅 Дедлайнов",
+    'question': "❓ Вопросов",
+    'idea': "💡 Идей",
+    'resource': "🗃 Ресурсов",
+}
+
+
+def period_range(period, today=None):
+    """Даты (первый день, последний день) для периода отчета: day, week, month"""
+    today = today or date.today()
+    if period == 'day':
+        return today, today
+    if period == 'week':
+        return today - timedelta(days=6), today
+    if period == 'month':
+        return today.replace(day=1), today
+    raise ValueError(f"Неизвестный период: {period}")
+
+
+def parse_period(text, today=None):
+    """Разбирает "ДД.ММ-ДД.ММ" в (первый день, последний день), None если не получилось.
+
+    Без года даты считаются прошедшими: 20.12 в январе — декабрь прошлого года.
+    """
+    today = today or date.today()
+    parts = (text or '').replace('–', '-').split('-')
+    if len(parts) != 2:
+        return None
+    days = []
+    for part in parts:
+        match = DATE_RE.match(part)
+        if not match:
+            return None
+        day, month, year = int(match[1]), int(match[2]), match[3]
+        try:
+            if year:
+                value = date(int(year) + (2000 if len(year) == 2 else 0), month, day)
+            else:
+                value = date(today.year, month, day)
+                if value > today:
+                    value = date(today.year - 1, month, day)
+        except ValueError:
+            return None
+        days.append(value)
+    start, end = days
+    return (start, end) if start <= end else None
+
+
+def forum_days(factory):
+    """Словарь форум -> день -> factory() (Counter или list)"""
+    return defaultdict(lambda: defaultdict(factory))
+
+
+def short(text, limit=TITLE_LIMIT):
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+class ReportEngine:
+    """Автоматический отчет из дневных счетчиков по проектам.
+
+    Каждая сохраненная задача сразу увеличивает счетчики своего дня
+    (TaskStore пишет их в таблицу rollups той же транзакцией), поэтому
+    отчет за день, неделю или месяц складывается из не более чем 31
+    готовой корзины, без просмотра истории задач. Счетчики и готовые
+    задачи разложены по форумам: отчет команды видит только свой форум.
+    """
+
+    def __init__(self):
+        self.counts = forum_days(Counter)    # форум -> день -> Counter[(проект, метрика)]
+        self.due_open = forum_days(Counter)  # форум -> день срока -> Counter[проект] незакрытых дедлайнов
+        self.done = forum_days(list)         # форум -> день -> [(проект, задача)] за последние DONE_DAYS
+
+    async def load(self, store, today=None):
+        """Загружает счетчики и недавние готовые задачи из хранилища (повторный вызов — перечитывает)"""
+        started = time.perf_counter()
+        counts, due_open, done = forum_days(Counter), forum_days(Counter), forum_days(list)
+        for day, chat_id, project, metric, count in await store.rollups():
+            if metric == 'due_open':
+                due_open[chat_id][day][project] = count
+            else:
+                counts[chat_id][day][(project, metric)] = count
+        since = (today or date.today()) - timedelta(days=DONE_DAYS)
+        for item in await store.done_since(since):
+            done[item['chat_id'] or 0][item['created_at'][:10]].append((item['project'], item['title']))
+        self.counts, self.due_open, self.done = counts, due_open, done
+        logger.info(f"📊 Загружено дней статистики: {sum(map(len, self.counts.values()))} "
+                    f"за {(time.perf_counter() - started) * 1000:.1f} мс")
+
+    def record(self, task, delta=1):
+        """Учитывает новую задачу (delta=-1 — отменяет учет)"""
+        if not task['project']:
+            return
+        chat_id = task['chat_id'] or 0
+        for day, metric in rollup_keys(task):
+            if metric == 'due_open':
+                self.due_open[chat_id][day][task['project']] += delta
+            else:
+                self.counts[chat_id][day][(task['project'], metric)] += delta
+        if task['kind'] == 'done' and delta > 0:
+            done = self.done[chat_id]
+            done[task['created_at'][:10]].append((task['project'], task['title']))
+            if len(done) > DONE_DAYS + 1:
+                del done[min(done)]
+
+    def summary(self, chat_id, start, end, today=None):
+        """Сводка форума chat_id за [start, end]: {проект: Counter метрик}, готовые задачи и просрочка"""
+        today = today or date.today()
+        counts, done_days = self.counts.get(chat_id, {}), self.done.get(chat_id, {})
+        totals = defaultdict(Counter)
+        done = defaultdict(list)
+        day = start
+        while day <= end:
+            key = day.isoformat()
+            for (project, metric), count in counts.get(key, {}).items():
+                totals[project][metric] += count
+            for project, title in done_days.get(key, ()):
+                done[project].append(title)
+            day += timedelta(days=1)
+
+        # Просрочено: незакрытые дедлайны со сроком до сегодняшнего дня
+        overdue = Counter()
+        today_key = today.isoformat()
+        for key, counter in self.due_open.get(chat_id, {}).items():
+            if key < today_key:
+                overdue.update(counter)
+        return totals, done, +overdue
+
+    def build(self, chat_id, title, start, end, projects, today=None):
+        """Текст отчета форума chat_id; projects задает порядок проектов (значения PROJECTS)"""
+        totals, done, overdue = self.summary(chat_id, start, end, today)
+        lines = [f"📊 <b>ОТЧЕТ:</b> {title}", ""]
+        for project in projects:
+            counter = totals.get(project, Counter())
+            if not counter and not overdue.get(project):
+                continue
+            lines.append(f"<b>{project}</b>")
+            titles = done.get(project, [])
+            if titles:
+                shown = "; ".join(short(title) for title in titles[-DONE_LIMIT:])
+                more = f" и еще {len(titles) - DONE_LIMIT}" if len(titles) > DONE_LIMIT else ""
+                lines.append(f"✅ Сделано: {len(titles)} — {shown}{more}")
+            created = [f"{label}: {counter[kind]}" for kind, label in KIND_LABELS.items() if counter.get(kind)]
+            if created:
+                lines.append(" · ".join(created))
+            statuses = [f"{metric[7:]} {count}" for metric, count in counter.items()
+                        if metric.startswith('status:') and count]
+            if statuses:
+                lines.append("🔄 " + ", ".join(statuses))
+            if overdue.get(project):
+                lines.append(f"⚠️ Просрочено дедлайнов: {overdue[project]}")
+            lines.append("")
+
+        if len(lines) == 2:
+            lines.append("Нет активности за период")
+        return "\n".join(lines).rstrip()
@@ -0,0 +1,147 @@
+import asyncio
+import logging
+import signal
+from collections import deque
+from contextlib import suppress
+
+logger = logging.getLogger(__name__)
+
+
+def event_key(update):
+    """Ключ очереди апдейта aiogram: id пользователя, иначе id чата, иначе update_id"""
+    try:
+        event = update.event
+    except LookupError:
+        # Тип апдейта, неизвестный этой версии aiogram
+        return update.update_id
+    user = getattr(event, 'from_user', None) or getattr(event, 'user', None)
+    if user is not None:
+        return user.id
+    chat = getattr(event, 'chat', None)
+    if chat is not None:
+        return chat.id
+    return update.update_id
+
+
+class UpdateScheduler:
+    """Параллельная обработка апдейтов с порядком внутри пользователя.
+
+    Апдейты разных пользователей обрабатываются одновременно, но не больше
+    max_concurrency сразу. Апдейты одного ключа (пользователь, иначе чат)
+    идут строго по очереди: следующий начинается, когда предыдущий
+    обработан целиком, поэтому видит уже сохраненное им состояние FSM.
+    Очередь ключа есть, только пока в ней что-то ждет: опустев, она
+    удаляется вместе со своей задачей. В очереди одного ключа — не больше
+    max_queue апдейтов (лишние отбрасываются), а всего принятых и не
+    обработанных — не больше max_pending: сверх этого submit ждет, и
+    getUpdates или вебхук притормаживают вместо роста памяти.
+    """
+
+    def __init__(self, handle, max_concurrency=40, max_pending=1000, max_queue=100, key=event_key):
+        self.handle = handle  # handle(update) — корутина обработки одного апдейта
+        self.max_concurrency = max_concurrency
+        self.max_pending = max_pending
+        self.max_queue = max_queue
+        self.key = key
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.queues = {}  # ключ -> deque апдейтов, ждущих за обрабатываемым
+        self.tasks = set()
+        self.pending = 0
+        self.running = 0
+        self._room = asyncio.Event()
+        self.processed = 0
+        self.failed = 0
+        self.queued = 0
+        self.overflow = 0
+        self.max_depth = 0
+
+    def stats(self):
+        return {'processed': self.processed, 'failed': self.failed, 'running': self.running,
+                'pending': self.pending, 'queues': len(self.queues), 'queued': self.queued,
+                'overflow': self.overflow, 'max_depth': self.max_depth}
+
+    async def submit(self, update):
+        """Ставит апдейт в очередь его ключа (ждет, если принято слишком много)"""
+        while self.pending >= self.max_pending:
+            self._room.clear()
+            await self._room.wait()
+        key = self.key(update)
+        queue = self.queues.get(key)
+        if queue is None:
+            self.queues[key] = deque()
+            task = asyncio.create_task(self._drain(key, update))
+            self.tasks.add(task)
+            task.add_done_callback(self.tasks.discard)
+        elif len(queue) >= self.max_queue:
+            self.overflow += 1
+            if self.overflow % 100 == 1:
+                logger.warning(f"🚦 Очередь {key} переполнена, апдейт {update.update_id} отброшен")
+            return
+        else:
+            queue.append(update)
+            self.queued += 1
+            self.max_depth = max(self.max_depth, len(queue))
+        self.pending += 1
+
+    async def _drain(self, key, update):
+        queue = self.queues[key]
+        while True:
+            async with self.semaphore:
+                self.running += 1
+                try:
+                    await self.handle(update)
+                except Exception as e:
+                    self.failed += 1
+                    logger.error(f"Ошибка обработки апдейта {update.update_id}: {e}")
+                finally:
+                    self.running -= 1
+            self.processed += 1
+            self.pending -= 1
+            self._room.set()
+            if not queue:
+                del self.queues[key]
+                return
+            update = queue.popleft()
+
+    async def join(self):
+        """Ждет, пока обработаются все принятые апдейты"""
+        while self.tasks:
+            await asyncio.gather(*self.tasks)
+
+
+async def poll(bot, scheduler, allowed_updates, timeout=30):
+    """Забирает апдейты из getUpdates в планировщик, пока задачу не отменят"""
+    offset, backoff = None, 1
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=timeout, allowed_updates=allowed_updates,
+                                            request_timeout=int(bot.session.timeout + timeout))
+        except Exception as e:
+            logger.error(f"Ошибка getUpdates, повтор через {backoff} с: {e}")
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+            continue
+        backoff = 1
+        for update in updates:
+            await scheduler.submit(update)
+            offset = update.update_id + 1
+
+
+async def run_polling(dp, bot, scheduler, timeout=30):
+    """Long polling до Ctrl+C или SIGTERM; при остановке принятые апдейты дорабатываются"""
+    loop = asyncio.get_running_loop()
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    logger.info(f"📡 Long polling, одновременно до {scheduler.max_concurrency} апдейтов")
+    polling = asyncio.create_task(poll(bot, scheduler, dp.resolve_used_update_types(), timeout))
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, polling.cancel)
+    try:
+        with suppress(asyncio.CancelledError):
+            await polling
+    finally:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.remove_signal_handler(sig)
+        logger.info("📡 Polling остановлен, дорабатываем очереди")
+        await scheduler.join()
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()
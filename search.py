@@ -0,0 +1,174 @@
+import asyncio
+import json
+import logging
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+# Поля форм, по которым ищет /search
+SEARCH_FIELDS = ('task', 'question', 'idea', 'benefit', 'description', 'link', 'check')
+WORD_RE = re.compile(r'[0-9a-zа-я]+')
+# Слова, которые есть почти в каждой ссылке или фразе и ничего не находят
+STOP_WORDS = {'http', 'https', 'www', 'com', 'ru', 'org', 'html', 'the', 'and', 'for', 'of', 'to',
+              'не', 'на', 'по', 'для', 'что', 'как', 'это'}
+# Окончания существительных и прилагательных (и инфинитива), которые отрезает стеммер, — сначала длинные.
+# Личных окончаний глаголов нет: иначе "макет" и "бюджет" теряли бы "ет"
+RU_ENDINGS = sorted((
+    'иями', 'ями', 'ами', 'ией', 'иям', 'ием', 'иях', 'ого', 'его', 'ому', 'ему', 'ыми', 'ими', 'ать', 'ять',
+    'ить', 'еть', 'уть', 'ая', 'яя', 'ое', 'ее', 'ые', 'ие', 'ый', 'ий', 'ой', 'ей', 'ом', 'ем', 'ах', 'ях',
+    'ам', 'ям', 'ов', 'ев', 'ию', 'ью', 'ия', 'ья', 'им', 'ым', 'ть', 'а', 'я', 'о', 'е', 'ы', 'и', 'у', 'ю',
+    'ь', 'й',
+), key=len, reverse=True)
+EN_ENDINGS = ('ings', 'ing', 'ies', 'ied', 'ed', 'ly', 's')
+MIN_STEM = 3
+
+
+@lru_cache(maxsize=65536)
+def stem(word):
+    """Легкий стеммер: отрезает одно окончание, оставляя основу не короче MIN_STEM (словарь слов невелик — кэшируем)"""
+    if word[-1].isdigit():
+        # Окончаний на цифру нет: числа и "версия2" остаются как есть
+        return word
+    if 'а' <= word[0] <= 'я':
+        if word.endswith(('ся', 'сь')) and len(word) - 2 >= MIN_STEM:
+            word = word[:-2]
+        endings = RU_ENDINGS
+    else:
+        endings = EN_ENDINGS
+    for ending in endings:
+        if word.endswith(ending) and len(word) - len(ending) >= MIN_STEM:
+            return word[:-len(ending)]
+    return word
+
+
+def normalize(text):
+    """Основы слов текста: нижний регистр, ё -> е, без стоп-слов и однобуквенных"""
+    words = WORD_RE.findall(text.lower().replace('ё', 'е'))
+    return [stem(word) for word in words if len(word) > 1 and word not in STOP_WORDS]
+
+
+def item_terms(task):
+    """Текст для индекса: основы слов из полей формы задачи"""
+    data = task['data']
+    if isinstance(data, str):
+        data = json.loads(data)
+    return ' '.join(normalize(' '.join(str(data[field]) for field in SEARCH_FIELDS if data.get(field))))
+
+
+class SearchIndex:
+    """Инвертированный индекс по всему, что опубликовали формы и /import.
+
+    Основы слов лежат в таблице FTS5 (rowid — id задачи), рядом — форум,
+    проект, статус и приоритет для фильтров. Форма при публикации только кладет
+    задачу в список (add), а разбор слов и запись идут пачкой в отдельном
+    потоке раз в flush_interval секунд, поэтому отправка формы не ждет
+    индекса. Поиск сначала дописывает накопленное.
+    """
+
+    def __init__(self, path='search.db', flush_interval=0.5):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._pending = []
+        self._flush_handle = None
+        self._flushing = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='search')
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript("""
+            CREATE VIRTUAL TABLE IF NOT EXISTS terms USING fts5(words, tokenize = 'unicode61 remove_diacritics 0');
+            CREATE TABLE IF NOT EXISTS items (
+                id INTEGER PRIMARY KEY,
+                chat_id INTEGER,
+                project TEXT,
+                status TEXT,
+                priority TEXT
+            );
+        """)
+        self._conn.commit()
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def load(self, tasks, batch=5000):
+        """Дописывает в индекс задачи, которых в нем еще нет (первый запуск или файл индекса удален)"""
+        last = await self._run(self._last_id)
+        added = 0
+        while True:
+            rows = await tasks.after(last, batch)
+            if not rows:
+                break
+            await self._run(self._write, rows)
+            last = rows[-1]['id']
+            added += len(rows)
+        if added:
+            logger.info(f"🔎 Проиндексировано задач: {added}")
+
+    async def close(self):
+        await self.flush()
+        await self._run(self._conn.close)
+        self._executor.shutdown()
+
+    # ==================== ЗАПИСЬ ====================
+    def add(self, task):
+        """Ставит задачу в индекс или обновляет ее там (запись — в фоне, пачкой)"""
+        self._pending.append(task)
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.flush_interval, self._schedule_flush)
+
+    def _schedule_flush(self):
+        self._flush_handle = None
+        asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        if self._flushing is not None:
+            await self._flushing
+        if not self._pending:
+            return
+
+        rows, self._pending = self._pending, []
+        self._flushing = asyncio.get_running_loop().run_in_executor(self._executor, self._write, rows)
+        try:
+            await self._flushing
+        except Exception as e:
+            logger.error(f"Ошибка записи индекса поиска {self.path}: {e}")
+        finally:
+            self._flushing = None
+
+    def _write(self, rows):
+        with self._conn:
+            self._conn.executemany("INSERT OR REPLACE INTO terms (rowid, words) VALUES (?, ?)",
+                                   [(task['id'], item_terms(task)) for task in rows])
+            self._conn.executemany("INSERT OR REPLACE INTO items VALUES (?, ?, ?, ?, ?)",
+                                   [(task['id'], task['chat_id'], task['project'], task['status'],
+                                     task['priority']) for task in rows])
+
+    def _last_id(self):
+        return self._conn.execute("SELECT COALESCE(MAX(id), 0) FROM items").fetchone()[0]
+
+    # ==================== ПОИСК ====================
+    async def search(self, text, chat_id=None, project=None, status=None, priority=None, limit=10):
+        """id задач форума chat_id, где есть все слова запроса (по началу основы), новые сверху"""
+        words = normalize(text)
+        if not words:
+            return []
+        await self.flush()
+        query = ' '.join(f'"{word}"*' for word in dict.fromkeys(words))
+        sql = "SELECT terms.rowid FROM terms JOIN items ON items.id = terms.rowid WHERE terms MATCH ?"
+        params = [query]
+        for column, value in (('chat_id', chat_id), ('project', project), ('status', status),
+                              ('priority', priority)):
+            if value:
+                sql += f" AND items.{column} = ?"
+                params.append(value)
+        sql += " ORDER BY terms.rowid DESC LIMIT ?"
+        params.append(limit)
+        rows = await self._run(self._fetch, sql, params)
+        return [row[0] for row in rows]
+
+    def _fetch(self, sql, params=()):
+        return self._conn.execute(sql, params).fetchall()
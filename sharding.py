@@ -0,0 +1,239 @@
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import secrets
+import signal
+import sys
+import threading
+
+import aiohttp
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+def shard_of(key, count):
+    """Номер воркера для пользователя (или чата): все его апдейты идут в один процесс"""
+    return hash(key or 0) % count
+
+
+def update_key(update):
+    """Ключ маршрутизации сырого апдейта: id пользователя, иначе id чата, иначе update_id"""
+    for value in update.values():
+        if isinstance(value, dict):
+            user = value.get('from') or value.get('user')
+            if user:
+                return user['id']
+            chat = value.get('chat')
+            if chat:
+                return chat['id']
+    return update.get('update_id', 0)
+
+
+# ==================== ВОРКЕР ====================
+def worker_main(index, count, conn):
+    """Точка входа процесса-воркера: свой Dispatcher, апдейты из трубы conn"""
+    # Ctrl+C ловит супервизор и закрывает трубы, воркер завершается сам
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # При запуске python bot.py модуль бота уже загружен в процесс как __mp_main__
+    app = sys.modules.get('__mp_main__')
+    if getattr(app, 'dp', None) is None:
+        import bot as app
+    asyncio.run(run_worker(app.dp, app.bot, app.scheduler, conn))
+
+
+async def run_worker(dp, bot, scheduler, conn):
+    from aiogram.types import Update
+
+    loop = asyncio.get_running_loop()
+    updates = asyncio.Queue()
+
+    def reader():
+        while True:
+            try:
+                data = conn.recv_bytes()
+            except (EOFError, OSError):
+                break
+            loop.call_soon_threadsafe(updates.put_nowait, data)
+        loop.call_soon_threadsafe(updates.put_nowait, None)
+
+    await dp.emit_startup(bot=bot, dispatcher=dp)
+    # Готовность: какие типы апдейтов нужны обработчикам
+    conn.send(dp.resolve_used_update_types())
+    threading.Thread(target=reader, name='shard-reader', daemon=True).start()
+
+    try:
+        while True:
+            data = await updates.get()
+            if data is None:
+                break
+            await scheduler.submit(Update.model_validate_json(data, context={'bot': bot}))
+        await scheduler.join()
+    finally:
+        await dp.emit_shutdown(bot=bot, dispatcher=dp)
+        await bot.session.close()
+
+
+# ==================== СУПЕРВИЗОР ====================
+class Supervisor:
+    """Раздает апдейты N процессам-воркерам по хэшу id пользователя.
+
+    Каждый воркер — отдельный процесс со своим Dispatcher и циклом
+    событий, связанный с супервизором трубой multiprocessing. Апдейты
+    одного пользователя всегда попадают в один воркер, поэтому его
+    диалог FSM не переезжает между процессами. Сам супервизор апдейты
+    не разбирает: только находит ключ и пересылает байты; запись в трубу
+    идет из отдельного потока на воркер, чтобы не блокировать цикл.
+    """
+
+    def __init__(self, workers, target=worker_main):
+        self.workers = workers
+        self.target = target
+        self.processes = []
+        self.conns = []
+        self.outboxes = []
+        self._threads = []
+        self.routed = [0] * workers
+
+    def start(self):
+        context = multiprocessing.get_context('spawn')
+        for index in range(self.workers):
+            parent, child = context.Pipe()
+            # Окружение наследуется при старте: по нему воркер знает свой номер
+            os.environ['SHARD_INDEX'] = str(index)
+            os.environ['SHARD_COUNT'] = str(self.workers)
+            process = context.Process(target=self.target, args=(index, self.workers, child),
+                                      name=f'bot-worker-{index}')
+            process.start()
+            child.close()
+            outbox = queue.SimpleQueue()
+            thread = threading.Thread(target=self._sender, args=(parent, outbox),
+                                      name=f'shard-sender-{index}', daemon=True)
+            thread.start()
+            self.processes.append(process)
+            self.conns.append(parent)
+            self.outboxes.append(outbox)
+            self._threads.append(thread)
+        del os.environ['SHARD_INDEX'], os.environ['SHARD_COUNT']
+        logger.info(f"🧩 Запущено воркеров: {self.workers}")
+
+    @staticmethod
+    def _sender(conn, outbox):
+        while True:
+            data = outbox.get()
+            if data is None:
+                break
+            try:
+                conn.send_bytes(data)
+            except OSError as e:
+                logger.error(f"Воркер недоступен: {e}")
+                break
+        conn.close()
+
+    async def wait_ready(self):
+        """Ждет готовности всех воркеров, возвращает нужные им типы апдейтов"""
+        loop = asyncio.get_running_loop()
+        allowed = set()
+        for conn in self.conns:
+            allowed.update(await loop.run_in_executor(None, conn.recv))
+        return sorted(allowed)
+
+    def route(self, update, data=None):
+        """Отправляет апдейт (dict) воркеру его пользователя; data — он же в JSON, если уже есть"""
+        index = shard_of(update_key(update), self.workers)
+        self.routed[index] += 1
+        self.outboxes[index].put(data or json.dumps(update).encode())
+
+    async def stop(self, timeout=30):
+        """Закрывает трубы и ждет, пока воркеры доработают и выйдут"""
+        for outbox in self.outboxes:
+            outbox.put(None)
+        loop = asyncio.get_running_loop()
+        for process in self.processes:
+            await loop.run_in_executor(None, process.join, timeout)
+            if process.is_alive():
+                logger.warning(f"⚠️ {process.name} не завершился, останавливаем")
+                process.terminate()
+        logger.info(f"🧩 Апдейтов по воркерам: {self.routed}")
+
+
+async def poll_updates(supervisor, bot, allowed_updates, timeout=30):
+    """Long polling без разбора апдейтов в модели aiogram: сразу в воркеры"""
+    url = bot.session.api.api_url(token=bot.token, method='getUpdates')
+    offset, backoff = None, 1
+    async with aiohttp.ClientSession() as session:
+        while True:
+            params = {'timeout': timeout, 'allowed_updates': allowed_updates}
+            if offset is not None:
+                params['offset'] = offset
+            try:
+                async with session.post(url, json=params, timeout=aiohttp.ClientTimeout(total=timeout + 10)) as response:
+                    payload = await response.json()
+                if not payload.get('ok'):
+                    raise RuntimeError(payload.get('description'))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ошибка getUpdates, повтор через {backoff} с: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+                continue
+            backoff = 1
+            for update in payload['result']:
+                supervisor.route(update)
+                offset = update['update_id'] + 1
+
+
+class ShardedWebhookHandler:
+    """Вебхук супервизора: проверяет секрет и пересылает тело запроса воркеру"""
+
+    def __init__(self, supervisor, secret_token=None):
+        self.supervisor = supervisor
+        self.secret_token = secret_token
+
+    async def handle(self, request):
+        if self.secret_token and not secrets.compare_digest(
+                request.headers.get(SECRET_HEADER, ''), self.secret_token):
+            return web.Response(status=401)
+        data = await request.read()
+        try:
+            update = json.loads(data)
+        except ValueError as e:
+            logger.error(f"Некорректный апдейт в вебхуке: {e}")
+            return web.Response(status=400)
+        self.supervisor.route(update, data)
+        return web.Response()
+
+
+async def run_supervisor(bot, workers, mode='polling', url=None, path='/webhook', host='127.0.0.1',
+                         port=8080, secret_token=None, max_concurrency=40):
+    """Режим нескольких процессов: супервизор принимает апдейты и раздает их воркерам"""
+    supervisor = Supervisor(workers)
+    supervisor.start()
+    runner = None
+    try:
+        allowed_updates = await supervisor.wait_ready()
+        if mode == 'webhook':
+            app = web.Application()
+            app.router.add_post(path, ShardedWebhookHandler(supervisor, secret_token).handle)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            await web.TCPSite(runner, host, port).start()
+            logger.info(f"🌐 Вебхук слушает http://{host}:{port}{path}")
+            await bot.set_webhook(url=url, secret_token=secret_token, max_connections=max_concurrency,
+                                  allowed_updates=allowed_updates)
+            await asyncio.Event().wait()
+        else:
+            # getUpdates не работает, пока у бота установлен вебхук
+            await bot.delete_webhook()
+            await poll_updates(supervisor, bot, allowed_updates)
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+        await supervisor.stop()
+        await bot.session.close()
@@ -0,0 +1,277 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в локальном файле SQLite.
+
+    Состояния и данные форм держатся в памяти и записываются в базу
+    в фоне: изменения, сделанные за flush_interval секунд (несколько шагов
+    формы подряд), уходят на диск одной транзакцией в режиме WAL.
+    После перезапуска все незаконченные диалоги загружаются из файла.
+
+    Брошенные формы не копятся: ttl — сколько секунд диалог может
+    молчать, по группе состояний ({'DeadlineForm': 86400, ...}, ключ
+    'default' — для остальных). Записи лежат в порядке последнего
+    обращения, поэтому сверх max_entries диалогов или max_bytes данных
+    вытесняются самые давние. on_expire(key, state, data) вызывается
+    для каждого удаленного черновика (например, чтобы предупредить
+    пользователя).
+
+    С несколькими воркерами у всех один файл: owns(key) отбирает при
+    загрузке только диалоги этого процесса, поэтому уборка и вытеснение
+    не трогают чужие записи.
+    """
+
+    def __init__(self, path='fsm.db', flush_interval=0.05, ttl=None, max_entries=0, max_bytes=0,
+                 on_expire=None, sweep_interval=60, owns=None):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.ttl = ttl or {}
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.on_expire = on_expire
+        self.sweep_interval = sweep_interval
+        self.owns = owns  # owns(key) — диалог ведет этот процесс (для нескольких воркеров)
+        self._records = OrderedDict()  # StorageKey -> [state, data, время обращения, размер data]
+        self._bytes = 0
+        self.expired = 0
+        self.evicted = 0
+        self._dirty = set()
+        self.retry_interval = max(flush_interval, 1.0)
+        self._flush_handle = None
+        self._flushing = None
+        self._sweeper = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='fsm-sqlite')
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS fsm (
+                bot_id INTEGER NOT NULL,
+                chat_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                thread_id INTEGER NOT NULL DEFAULT 0,
+                business_connection_id TEXT NOT NULL DEFAULT '',
+                destiny TEXT NOT NULL,
+                state TEXT,
+                data TEXT NOT NULL,
+                PRIMARY KEY (bot_id, chat_id, user_id, thread_id, business_connection_id, destiny)
+            )
+        """)
+        self._conn.commit()
+        self._load()
+
+    def _load(self):
+        started = time.perf_counter()
+        for bot_id, chat_id, user_id, thread_id, bc_id, destiny, state, data in self._conn.execute("SELECT * FROM fsm"):
+            key = StorageKey(bot_id=bot_id, chat_id=chat_id, user_id=user_id,
+                             thread_id=thread_id or None, business_connection_id=bc_id or None,
+                             destiny=destiny)
+            if self.owns is not None and not self.owns(key):
+                continue
+            self._records[key] = [state, json.loads(data), time.monotonic(), len(data)]
+            self._bytes += len(data)
+        if self._records:
+            logger.info(f"💾 Загружено FSM-диалогов: {len(self._records)} "
+                        f"за {(time.perf_counter() - started) * 1000:.1f} мс")
+
+    # ==================== ИНТЕРФЕЙС BaseStorage ====================
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        record = self._record(key)
+        record[0] = state.state if isinstance(state, State) else state
+        self._touch(key)
+
+    async def get_state(self, key: StorageKey):
+        record = self._records.get(key)
+        if record is None:
+            return None
+        # Любой апдейт пользователя читает состояние — это и есть активность диалога
+        record[2] = time.monotonic()
+        self._records.move_to_end(key)
+        return record[0]
+
+    async def set_data(self, key: StorageKey, data) -> None:
+        record = self._record(key)
+        record[1] = dict(data)
+        if self.max_bytes:
+            size = len(json.dumps(record[1], ensure_ascii=False))
+            self._bytes += size - record[3]
+            record[3] = size
+            if self._bytes > self.max_bytes:
+                self._evict_lru()
+        self._touch(key)
+
+    async def get_data(self, key: StorageKey):
+        record = self._records.get(key)
+        return dict(record[1]) if record else {}
+
+    def active(self):
+        """Сколько диалогов сейчас посреди формы (с состоянием FSM)"""
+        return sum(1 for record in self._records.values() if record[0] is not None)
+
+    async def close(self) -> None:
+        await self.stop()
+        await self.flush()
+        if self._flush_handle is not None:
+            # Запись не удалась и при закрытии — повторять уже некому
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        self._executor.submit(self._conn.close).result()
+        self._executor.shutdown()
+
+    # ==================== ВЫТЕСНЕНИЕ ====================
+    def _record(self, key):
+        record = self._records.get(key)
+        if record is None:
+            record = self._records[key] = [None, {}, time.monotonic(), 0]
+            if self.max_entries and len(self._records) > self.max_entries:
+                self._evict_lru()
+        else:
+            record[2] = time.monotonic()
+            self._records.move_to_end(key)
+        return record
+
+    def _evict_lru(self):
+        """Вытесняет самые давние диалоги, пока не уложимся в max_entries и max_bytes"""
+        removed = []
+        while len(self._records) > 1 and (
+                (self.max_entries and len(self._records) > self.max_entries)
+                or (self.max_bytes and self._bytes > self.max_bytes)):
+            key = next(iter(self._records))
+            removed.append((key, self._remove(key)))
+        self.evicted += len(removed)
+        if removed and self.on_expire is not None:
+            asyncio.ensure_future(self._notify(removed))
+
+    def _remove(self, key):
+        record = self._records.pop(key)
+        self._bytes -= record[3]
+        self._touch(key)
+        return record
+
+    def ttl_of(self, state):
+        group = state.split(':', 1)[0] if state else None
+        return self.ttl.get(group, self.ttl.get('default', 0))
+
+    def expire(self, now=None):
+        """Удаляет диалоги, молчащие дольше TTL своей формы; возвращает [(key, record)]"""
+        now = time.monotonic() if now is None else now
+        ttls = [ttl for ttl in self.ttl.values() if ttl]
+        if not ttls:
+            return []
+        # Записи идут от самых давних: дальше min(ttl) назад смотреть незачем
+        horizon = now - min(ttls)
+        expired = []
+        for key, record in self._records.items():
+            if record[2] > horizon:
+                break
+            ttl = self.ttl_of(record[0])
+            if ttl and now - record[2] > ttl:
+                expired.append(key)
+        removed = [(key, self._remove(key)) for key in expired]
+        self.expired += len(removed)
+        return removed
+
+    async def _notify(self, removed):
+        for key, (state, data, _, _) in removed:
+            if state is None:
+                continue
+            try:
+                await self.on_expire(key, state, data)
+            except Exception as e:
+                logger.error(f"Ошибка уведомления об истекшем черновике: {e}")
+
+    def start(self):
+        """Запускает периодическую уборку брошенных диалогов"""
+        if self.ttl or self.max_bytes:
+            self._sweeper = asyncio.create_task(self._sweep())
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            await asyncio.gather(self._sweeper, return_exceptions=True)
+            self._sweeper = None
+
+    async def _sweep(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            removed = self.expire()
+            if self.max_bytes and self._bytes > self.max_bytes:
+                self._evict_lru()
+            if removed:
+                logger.info(f"🧹 Удалено брошенных черновиков: {len(removed)}")
+                if self.on_expire is not None:
+                    await self._notify(removed)
+
+    # ==================== ЗАПИСЬ НА ДИСК ====================
+    def _touch(self, key):
+        self._dirty.add(key)
+        if self._flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self._flush_handle = loop.call_later(self.flush_interval, self._schedule_flush)
+
+    def _schedule_flush(self):
+        self._flush_handle = None
+        asyncio.ensure_future(self.flush())
+
+    async def flush(self):
+        """Записывает все накопленные изменения одной транзакцией"""
+        if self._flushing is not None:
+            await self._flushing
+        if not self._dirty:
+            return
+
+        dirty = self._dirty
+        upserts, deletes = [], []
+        for key in dirty:
+            row = (key.bot_id, key.chat_id, key.user_id, key.thread_id or 0,
+                   key.business_connection_id or '', key.destiny)
+            record = self._records.get(key)
+            if record is None or (record[0] is None and not record[1]):
+                # Пустой диалог (после state.clear()) не храним ни в памяти, ни на диске
+                if record is not None:
+                    del self._records[key]
+                    self._bytes -= record[3]
+                deletes.append(row)
+            else:
+                upserts.append(row + (record[0], record[1]))
+        self._dirty = set()
+
+        loop = asyncio.get_running_loop()
+        self._flushing = loop.run_in_executor(self._executor, self._write, upserts, deletes)
+        try:
+            await self._flushing
+        except Exception as e:
+            # Ключи возвращаются в очередь записи: на повторе запишется их текущее состояние
+            logger.error(f"Ошибка записи FSM в {self.path}, повтор через {self.retry_interval:g} с: {e}")
+            self._dirty |= dirty
+            if self._flush_handle is None:
+                self._flush_handle = loop.call_later(self.retry_interval, self._schedule_flush)
+        finally:
+            self._flushing = None
+
+    def _write(self, upserts, deletes):
+        with self._conn:
+            if upserts:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO fsm VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [row[:7] + (json.dumps(row[7], ensure_ascii=False),) for row in upserts]
+                )
+            if deletes:
+                self._conn.executemany(
+                    "DELETE FROM fsm WHERE bot_id = ? AND chat_id = ? AND user_id = ? "
+                    "AND thread_id = ? AND business_connection_id = ? AND destiny = ?",
+                    deletes
+                )
@@ -0,0 +1,408 @@
+import asyncio
+import json
+import logging
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+from config import STATUSES
+
+logger = logging.getLogger(__name__)
+
+# id в одном IN (...): у старых сборок SQLite не больше 999 переменных на запрос
+IN_CHUNK = 500
+
+DATE_RE = re.compile(r'^\s*(\d{1,2})\.(\d{1,2})(?:\.(\d{2}|\d{4}))?\s*$')
+
+# Какое поле формы становится заголовком и ответственным у элементов каждого вида
+TITLE_FIELDS = {
+    'deadline': 'task',
+    'question': 'question',
+    'done': 'task',
+    'idea': 'idea',
+    'resource': 'description',
+}
+RESPONSIBLE_FIELDS = {
+    'deadline': 'responsible',
+    'question': 'to_who',
+}
+
+
+def parse_due_date(text, today=None):
+    """Разбирает ДД.ММ (или ДД.ММ.ГГГГ) в date, None если дата некорректна.
+
+    Без года берется ближайшая такая дата: 05.01, введенное в декабре,
+    означает январь следующего года.
+    """
+    match = DATE_RE.match(text or '')
+    if not match:
+        return None
+    today = today or date.today()
+    day, month, year = int(match[1]), int(match[2]), match[3]
+    try:
+        if year:
+            return date(int(year) + (2000 if len(year) == 2 else 0), month, day)
+        due = date(today.year, month, day)
+        if due < today - timedelta(days=60):
+            due = date(today.year + 1, month, day)
+        return due
+    except ValueError:
+        return None
+
+
+def new_task(kind, data, chat_id=None, thread_id=None, created_by=None, source=None):
+    """Строка задачи из полей заполненной формы (еще без id)"""
+    due = parse_due_date(data['date']) if kind == 'deadline' else None
+    return {
+        'kind': kind,
+        'project': data.get('project'),
+        'status': data.get('status'),
+        'priority': data.get('priority'),
+        'responsible': data.get(RESPONSIBLE_FIELDS.get(kind, ''), None),
+        'title': data.get(TITLE_FIELDS[kind], ''),
+        'due_date': due.isoformat() if due else None,
+        'chat_id': chat_id,
+        'thread_id': thread_id,
+        'message_id': None,
+        'created_by': created_by,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'data': json.dumps(data, ensure_ascii=False),
+        'reminder_stage': 0,
+        'source': source,
+    }
+
+
+# Дневные счетчики: день, форум (0 — задача без форума), проект, метрика
+ROLLUPS_TABLE = """
+    CREATE TABLE IF NOT EXISTS rollups (
+        day TEXT NOT NULL,
+        chat_id INTEGER NOT NULL,
+        project TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (day, chat_id, project, metric)
+    );
+"""
+
+
+def rollup_keys(task):
+    """Дневные счетчики, которые увеличивает задача: [(день, метрика)].
+
+    Считаются элементы каждого вида и каждого статуса по дню создания,
+    а незакрытые дедлайны — по дню срока (из них складываются просроченные).
+    """
+    day = task['created_at'][:10]
+    keys = [(day, task['kind'])]
+    if task['status']:
+        keys.append((day, f"status:{task['status']}"))
+    if task['kind'] == 'deadline' and task['due_date'] and task['status'] != STATUSES['done']:
+        keys.append((task['due_date'], 'due_open'))
+    return keys
+
+
+class TaskStore:
+    """Хранилище всего, что собрали формы: дедлайны, вопросы, готовые задачи, идеи, ресурсы.
+
+    Каждая заполненная форма — строка с типизированными колонками
+    (проект, статус, приоритет, ответственный, срок, message_id
+    опубликованного сообщения). Запросы идут по индексам
+    (chat_id, project, status) и due_date в отдельном потоке, не блокируя бота.
+    """
+
+    def __init__(self, path='tasks.db'):
+        self.path = path
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='task-store')
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(ROLLUPS_TABLE + """
+            CREATE TABLE IF NOT EXISTS tasks (
+                id INTEGER PRIMARY KEY,
+                kind TEXT NOT NULL,
+                project TEXT,
+                status TEXT,
+                priority TEXT,
+                responsible TEXT,
+                title TEXT NOT NULL,
+                due_date TEXT,
+                chat_id INTEGER,
+                thread_id INTEGER,
+                message_id INTEGER,
+                created_by INTEGER,
+                created_at TEXT NOT NULL,
+                data TEXT NOT NULL,
+                reminder_stage INTEGER NOT NULL DEFAULT 0,
+                source TEXT
+            );
+            DROP INDEX IF EXISTS tasks_project_status;
+            CREATE INDEX IF NOT EXISTS tasks_chat_project_status ON tasks (chat_id, project, status);
+            CREATE INDEX IF NOT EXISTS tasks_due_date ON tasks (due_date);
+            CREATE INDEX IF NOT EXISTS tasks_kind_created ON tasks (kind, created_at);
+            CREATE TABLE IF NOT EXISTS imports (
+                key TEXT PRIMARY KEY,
+                file_id TEXT NOT NULL,
+                file_name TEXT,
+                kind TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                user_id INTEGER NOT NULL,
+                row INTEGER NOT NULL DEFAULT 0,
+                added INTEGER NOT NULL DEFAULT 0,
+                errors INTEGER NOT NULL DEFAULT 0,
+                finished INTEGER NOT NULL DEFAULT 0,
+                started_at TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS boards (
+                chat_id INTEGER NOT NULL,
+                thread_id INTEGER NOT NULL,
+                kind TEXT,
+                message_id INTEGER NOT NULL,
+                text_hash INTEGER NOT NULL,
+                PRIMARY KEY (chat_id, thread_id)
+            );
+        """)
+        if 'chat_id' not in {row['name'] for row in self._conn.execute("PRAGMA table_info(rollups)")}:
+            self._rebuild_rollups()
+        columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(tasks)")}
+        if 'reminder_stage' not in columns:
+            self._conn.execute("ALTER TABLE tasks ADD COLUMN reminder_stage INTEGER NOT NULL DEFAULT 0")
+        if 'source' not in columns:
+            self._conn.execute("ALTER TABLE tasks ADD COLUMN source TEXT")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS tasks_source ON tasks (source) WHERE source IS NOT NULL")
+        # Какие задачи в посте: правка статуса пересобирает пост (бывает пачкой) по его message_id
+        self._conn.execute("CREATE INDEX IF NOT EXISTS tasks_message ON tasks (chat_id, message_id) "
+                           "WHERE message_id IS NOT NULL")
+        self._conn.commit()
+
+    def _rebuild_rollups(self):
+        """Счетчики без форума (старая схема): пересчитываются из задач уже по форумам"""
+        logger.info("📊 Пересчет дневных счетчиков по форумам...")
+        # DDL в sqlite3 сам транзакцию не открывает: без BEGIN сбой оставил бы пустую таблицу
+        self._conn.execute("BEGIN")
+        try:
+            self._conn.execute("DROP TABLE rollups")
+            self._conn.execute(ROLLUPS_TABLE)
+            rows = self._conn.execute("SELECT kind, project, status, due_date, chat_id, created_at FROM tasks")
+            for row in rows.fetchall():
+                self._bump_rollups(dict(row), 1)
+            self._conn.commit()
+        except BaseException:
+            self._conn.rollback()
+            raise
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def close(self):
+        await self._run(self._conn.close)
+        self._executor.shutdown()
+
+    # ==================== ЗАПИСЬ ====================
+    async def add(self, kind, data, chat_id=None, thread_id=None, created_by=None):
+        """Сохраняет заполненную форму и обновляет дневные счетчики, возвращает строку задачи"""
+        task = new_task(kind, data, chat_id, thread_id, created_by)
+        task['id'] = await self._run(self._insert, task)
+        return task
+
+    def _insert(self, task):
+        with self._conn:
+            task_id = self._insert_row(task)
+        return task_id
+
+    def _insert_row(self, task):
+        cursor = self._conn.execute(
+            "INSERT INTO tasks (kind, project, status, priority, responsible, title, due_date, chat_id, "
+            "thread_id, message_id, created_by, created_at, data, source) VALUES (:kind, :project, :status, "
+            ":priority, :responsible, :title, :due_date, :chat_id, :thread_id, :message_id, "
+            ":created_by, :created_at, :data, :source)",
+            task
+        )
+        self._bump_rollups(task, 1)
+        return cursor.lastrowid
+
+    async def add_batch(self, tasks, source, row, errors):
+        """Сохраняет пачку импортированных задач и отметку импорта (строка файла, ошибки) одной транзакцией.
+
+        После сбоя импорт продолжается со строки row + 1: задачи пачки
+        либо записаны вместе с отметкой, либо не записаны вовсе.
+        """
+        await self._run(self._insert_batch, tasks, source, row, errors)
+        return tasks
+
+    def _insert_batch(self, tasks, source, row, errors):
+        with self._conn:
+            for task in tasks:
+                task['id'] = self._insert_row(task)
+            self._conn.execute(
+                "UPDATE imports SET row = ?, added = added + ?, errors = ? WHERE key = ?",
+                (row, len(tasks), errors, source)
+            )
+
+    def _bump_rollups(self, task, delta):
+        if not task['project']:
+            return
+        self._conn.executemany(
+            "INSERT INTO rollups VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (day, chat_id, project, metric) DO UPDATE SET count = count + excluded.count",
+            [(day, task['chat_id'] or 0, task['project'], metric, delta) for day, metric in rollup_keys(task)]
+        )
+
+    async def set_message_id(self, task_id, message_id):
+        await self._run(self._execute, "UPDATE tasks SET message_id = ? WHERE id = ?", (message_id, task_id))
+
+    async def set_message_ids(self, task_ids, message_id):
+        """Один message_id у нескольких задач (пост-пачка импорта), по IN_CHUNK id на запрос"""
+        await self._run(self._set_message_ids, list(task_ids), message_id)
+
+    def _set_message_ids(self, task_ids, message_id):
+        with self._conn:
+            for start in range(0, len(task_ids), IN_CHUNK):
+                chunk = task_ids[start:start + IN_CHUNK]
+                placeholders = ', '.join('?' * len(chunk))
+                self._conn.execute(f"UPDATE tasks SET message_id = ? WHERE id IN ({placeholders})",
+                                   (message_id, *chunk))
+
+    async def set_status(self, task_id, status):
+        """Меняет статус задачи (колонку, данные формы и дневные счетчики): (было, стало) или None"""
+        return await self._run(self._set_status, task_id, status)
+
+    def _set_status(self, task_id, status):
+        with self._conn:
+            row = self._conn.execute("SELECT * FROM tasks WHERE id = ?", (task_id,)).fetchone()
+            if row is None:
+                return None
+            old = dict(row)
+            data = json.loads(old['data'])
+            data['status'] = status
+            new = dict(old, status=status, data=json.dumps(data, ensure_ascii=False))
+            self._bump_rollups(old, -1)
+            self._conn.execute("UPDATE tasks SET status = ?, data = ? WHERE id = ?", (status, new['data'], task_id))
+            self._bump_rollups(new, 1)
+        return old, new
+
+    async def set_reminder_stage(self, task_id, stage):
+        await self._run(self._execute, "UPDATE tasks SET reminder_stage = ? WHERE id = ?", (stage, task_id))
+
+    def _execute(self, sql, params=()):
+        with self._conn:
+            self._conn.execute(sql, params)
+
+    # ==================== ЗАПРОСЫ ====================
+    async def list(self, chat_id, project, statuses, limit=30):
+        """Элементы проекта форума chat_id с одним из статусов, новые сверху"""
+        placeholders = ', '.join('?' * len(statuses))
+        return await self._run(
+            self._fetch,
+            f"SELECT * FROM tasks WHERE chat_id = ? AND project = ? AND status IN ({placeholders}) "
+            f"ORDER BY id DESC LIMIT ?",
+            (chat_id, project, *statuses, limit)
+        )
+
+    async def count(self, chat_id, project, statuses):
+        placeholders = ', '.join('?' * len(statuses))
+        rows = await self._run(
+            self._fetch,
+            f"SELECT COUNT(*) AS n FROM tasks WHERE chat_id = ? AND project = ? AND status IN ({placeholders})",
+            (chat_id, project, *statuses)
+        )
+        return rows[0]['n']
+
+    async def open_deadlines(self):
+        """Незакрытые дедлайны с распознанной датой (по индексу due_date)"""
+        return await self._run(
+            self._fetch,
+            "SELECT id, project, title, responsible, due_date, chat_id, thread_id, created_by, reminder_stage "
+            "FROM tasks WHERE due_date IS NOT NULL AND kind = 'deadline' AND status != ? ORDER BY due_date",
+            (STATUSES['done'],)
+        )
+
+    async def open_items(self, kinds):
+        """Незакрытые задачи этих видов, опубликованные в темы (для сводок)"""
+        placeholders = ', '.join('?' * len(kinds))
+        return await self._run(
+            self._fetch,
+            f"SELECT id, kind, project, status, title, due_date, responsible, chat_id, thread_id FROM tasks "
+            f"WHERE kind IN ({placeholders}) AND status != ? AND thread_id IS NOT NULL",
+            (*kinds, STATUSES['done'])
+        )
+
+    async def after(self, task_id, limit=5000):
+        """Задачи с id больше task_id по порядку (для догоняющей индексации)"""
+        return await self._run(self._fetch, "SELECT * FROM tasks WHERE id > ? ORDER BY id LIMIT ?",
+                               (task_id, limit))
+
+    async def by_ids(self, task_ids):
+        """Задачи по id в том же порядке (по IN_CHUNK id на запрос)"""
+        task_ids = list(task_ids)
+        found = {}
+        for start in range(0, len(task_ids), IN_CHUNK):
+            chunk = task_ids[start:start + IN_CHUNK]
+            placeholders = ', '.join('?' * len(chunk))
+            rows = await self._run(self._fetch, f"SELECT * FROM tasks WHERE id IN ({placeholders})", tuple(chunk))
+            found.update((row['id'], row) for row in rows)
+        return [found[task_id] for task_id in task_ids if task_id in found]
+
+    async def by_message(self, chat_id, message_id):
+        """Задачи одного поста по порядку (по частичному индексу message_id)"""
+        return await self._run(self._fetch, "SELECT * FROM tasks WHERE chat_id = ? AND message_id = ? ORDER BY id",
+                               (chat_id, message_id))
+
+    async def data_version(self):
+        """Меняется, когда базу изменил другой процесс (свои записи его не трогают)"""
+        rows = await self._run(self._fetch_tuples, "PRAGMA data_version")
+        return rows[0][0]
+
+    async def rollups(self):
+        """Все дневные счетчики: [(день, форум, проект, метрика, значение)]"""
+        return await self._run(self._fetch_tuples, "SELECT day, chat_id, project, metric, count FROM rollups")
+
+    async def done_since(self, day):
+        """Готовые задачи, созданные начиная с day (по индексу kind, created_at)"""
+        return await self._run(
+            self._fetch,
+            "SELECT chat_id, project, title, created_at FROM tasks WHERE kind = 'done' AND created_at >= ? "
+            "ORDER BY id",
+            (day.isoformat(),)
+        )
+
+    # ==================== СВОДКИ ====================
+    async def boards(self):
+        """Опубликованные сводки тем: [(chat_id, thread_id, вид, message_id, хэш текста)]"""
+        return await self._run(self._fetch_tuples,
+                               "SELECT chat_id, thread_id, kind, message_id, text_hash FROM boards")
+
+    async def set_board(self, chat_id, thread_id, kind, message_id, text_hash):
+        await self._run(self._execute, "INSERT OR REPLACE INTO boards VALUES (?, ?, ?, ?, ?)",
+                        (chat_id, thread_id, kind, message_id, text_hash))
+
+    # ==================== ИМПОРТ ====================
+    async def start_import(self, key, file_id, file_name, kind, chat_id, user_id):
+        """Отметка импорта файла: новая или уже существующая (тогда импорт продолжается с нее)"""
+        await self._run(
+            self._execute,
+            "INSERT OR IGNORE INTO imports (key, file_id, file_name, kind, chat_id, user_id, started_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (key, file_id, file_name, kind, chat_id, user_id, datetime.now().isoformat(timespec='seconds'))
+        )
+        rows = await self._run(self._fetch, "SELECT * FROM imports WHERE key = ?", (key,))
+        return rows[0]
+
+    async def finish_import(self, key):
+        await self._run(self._execute, "UPDATE imports SET finished = 1 WHERE key = ?", (key,))
+
+    async def unfinished_imports(self):
+        """Импорты, прерванные остановкой бота"""
+        return await self._run(self._fetch, "SELECT * FROM imports WHERE finished = 0 ORDER BY started_at")
+
+    async def unposted(self, source):
+        """Импортированные задачи, чьи посты еще не отправлены (по частичному индексу source)"""
+        return await self._run(
+            self._fetch, "SELECT * FROM tasks WHERE source = ? AND message_id IS NULL ORDER BY id", (source,)
+        )
+
+    def _fetch_tuples(self, sql, params=()):
+        return [tuple(row) for row in self._conn.execute(sql, params)]
+
+    def _fetch(self, sql, params=()):
+        return [dict(row) for row in self._conn.execute(sql, params)]
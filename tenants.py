@@ -0,0 +1,156 @@
+import asyncio
+import json
+import logging
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from config import DEFAULT_CHATS
+
+logger = logging.getLogger(__name__)
+
+
+def empty_chats(forum_id):
+    """Настройки нового форума: chat_id и ни одной настроенной темы"""
+    chats = {key: 0 for key in DEFAULT_CHATS}
+    chats['chat_id'] = forum_id
+    return chats
+
+
+class TenantRegistry:
+    """Форумы разных команд в одном процессе бота.
+
+    У каждой команды свой словарь настроек того же вида, что CHATS
+    ({'chat_id': форум, 'deadlines': тема, ...}). В памяти всегда лежит
+    только индекс "чат или пользователь -> форум", поэтому поиск форума
+    для апдейта — один-два словарных доступа. Темы форума читаются из
+    базы при первом обращении и дальше живут в кэше. Чаты и пользователи,
+    не привязанные ни к одному форуму, работают с default (CHATS).
+    """
+
+    def __init__(self, path='tenants.db', default=None):
+        self.path = path
+        self.default = default
+        self.sources = {}   # chat_id или user_id -> forum_id
+        self.forums = {}    # forum_id -> настройки, загруженные по требованию
+        self.loads = 0
+        self.data_version = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='tenants')
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS forums (
+                forum_id INTEGER PRIMARY KEY,
+                title TEXT,
+                chats TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS sources (
+                source_id INTEGER PRIMARY KEY,
+                forum_id INTEGER NOT NULL
+            );
+        """)
+        self._conn.commit()
+
+    def __len__(self):
+        return len(set(self.sources.values()))
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, func, *args)
+
+    async def load(self):
+        """Загружает индекс источников (сами темы форумов грузятся лениво)"""
+        self.data_version, rows = await self._run(self._load_index)
+        self.sources = dict(rows)
+        logger.info(f"🏢 Форумов команд: {len(self)}, привязанных чатов и людей: {len(self.sources)}")
+
+    async def refresh(self):
+        """Перечитывает индекс и сбрасывает кэш тем, если базу изменил другой процесс"""
+        version = await self._run(self._data_version)
+        if version == self.data_version:
+            return
+        self.data_version, rows = await self._run(self._load_index)
+        self.sources = dict(rows)
+        self.forums = {}
+
+    def _data_version(self):
+        # Меняется только после коммитов других соединений, свои записи его не трогают
+        return self._conn.execute("PRAGMA data_version").fetchone()[0]
+
+    def _load_index(self):
+        return self._data_version(), self._fetch("SELECT source_id, forum_id FROM sources")
+
+    async def close(self):
+        await self._run(self._conn.close)
+        self._executor.shutdown()
+
+    # ==================== ПОИСК ====================
+    def forum_of(self, chat_id, user_id=None):
+        """Форум, к которому относится чат (или пользователь в личке), None — основной"""
+        forum_id = self.sources.get(chat_id)
+        if forum_id is None and user_id is not None:
+            forum_id = self.sources.get(user_id)
+        return forum_id
+
+    async def resolve(self, chat_id, user_id=None):
+        """Настройки форума для апдейта из chat_id от user_id"""
+        forum_id = self.forum_of(chat_id, user_id)
+        if forum_id is None:
+            return self.default
+        chats = self.forums.get(forum_id)
+        if chats is None:
+            chats = await self._run(self._load_forum, forum_id)
+            chats = self.forums.setdefault(forum_id, chats)
+            self.loads += 1
+        return chats
+
+    def _load_forum(self, forum_id):
+        rows = self._fetch("SELECT chats FROM forums WHERE forum_id = ?", (forum_id,))
+        chats = empty_chats(forum_id)
+        if rows:
+            chats.update(json.loads(rows[0][0]))
+        return chats
+
+    # ==================== ИЗМЕНЕНИЯ ====================
+    async def bind(self, forum_id, title=None):
+        """Регистрирует форум команды; повторная привязка темы не сбрасывает.
+
+        Основной форум (default) начинает с уже настроенных в нем тем.
+        """
+        if forum_id in self.sources:
+            chats = await self.resolve(forum_id)
+        elif self.default is not None and self.default['chat_id'] == forum_id:
+            chats = dict(self.default)
+        else:
+            chats = empty_chats(forum_id)
+        await self._run(self._execute_many, [
+            ("INSERT INTO forums VALUES (?, ?, ?) ON CONFLICT (forum_id) DO UPDATE SET title = excluded.title",
+             (forum_id, title, json.dumps(chats))),
+            ("INSERT OR REPLACE INTO sources VALUES (?, ?)", (forum_id, forum_id)),
+        ])
+        self.sources[forum_id] = forum_id
+        self.forums.setdefault(forum_id, chats)
+        return chats
+
+    async def join(self, source_id, forum_id):
+        """Привязывает личку пользователя (или другой чат) к форуму"""
+        await self._run(self._execute_many, [
+            ("INSERT OR REPLACE INTO sources VALUES (?, ?)", (source_id, forum_id)),
+        ])
+        self.sources[source_id] = forum_id
+
+    async def set_topic(self, forum_id, chat_type, thread_id):
+        """Назначает тему форума для chat_type (deadlines, questions...)"""
+        chats = await self.resolve(forum_id)
+        updated = dict(chats, **{chat_type: thread_id})
+        await self._run(self._execute_many, [
+            ("UPDATE forums SET chats = ? WHERE forum_id = ?", (json.dumps(updated), forum_id)),
+        ])
+        chats[chat_type] = thread_id
+        return chats
+
+    def _execute_many(self, statements):
+        with self._conn:
+            for sql, params in statements:
+                self._conn.execute(sql, params)
+
+    def _fetch(self, sql, params=()):
+        return self._conn.execute(sql, params).fetchall()
@@ -0,0 +1,75 @@
+import asyncio
+import logging
+import secrets
+
+from aiohttp import web
+from aiogram.types import Update
+from aiogram.webhook.aiohttp_server import setup_application
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class WebhookHandler:
+    """Принимает апдейты от Telegram и ставит их в очередь планировщика.
+
+    Сервер слушает обычный HTTP: TLS снимает обратный прокси (nginx,
+    caddy), который проксирует https://<домен><path> на host:port.
+    Ответ уходит, как только апдейт принят: порядок апдейтов одного
+    пользователя и число одновременно обрабатываемых держит
+    UpdateScheduler, а если в нем скопилось слишком много, запрос ждет.
+    """
+
+    def __init__(self, scheduler, bot, secret_token=None):
+        self.scheduler = scheduler
+        self.bot = bot
+        self.secret_token = secret_token
+
+    async def handle(self, request):
+        if self.secret_token and not secrets.compare_digest(
+                request.headers.get(SECRET_HEADER, ''), self.secret_token):
+            return web.Response(status=401)
+
+        try:
+            update = Update.model_validate(await request.json(), context={'bot': self.bot})
+        except Exception as e:
+            logger.error(f"Некорректный апдейт в вебхуке: {e}")
+            return web.Response(status=400)
+
+        await self.scheduler.submit(update)
+        return web.Response()
+
+    def register(self, app, path):
+        app.router.add_post(path, self.handle)
+
+
+async def run_webhook(dp, bot, scheduler, url, path='/webhook', host='127.0.0.1', port=8080,
+                      secret_token=None, max_concurrency=40):
+    """Запускает aiohttp-сервер вебхука и регистрирует url в Telegram"""
+    app = web.Application()
+    WebhookHandler(scheduler, bot, secret_token).register(app, path)
+
+    async def drain(app):
+        await scheduler.join()
+
+    # Принятые апдейты дорабатываются до остановки Dispatcher
+    app.on_shutdown.append(drain)
+    setup_application(app, dp, bot=bot)
+
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f"🌐 Вебхук слушает http://{host}:{port}{path}")
+
+    try:
+        await bot.set_webhook(
+            url=url,
+            secret_token=secret_token,
+            max_connections=max_concurrency,
+            allowed_updates=dp.resolve_used_update_types()
+        )
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+        await bot.session.close()
@@ -0,0 +1,70 @@
+import logging
+import zlib
+
+from aiogram import types
+from aiogram.exceptions import TelegramBadRequest
+
+logger = logging.getLogger(__name__)
+
+# Ключ в данных FSM: [chat_id, message_id, хэш текста, хэш клавиатуры] сообщения формы
+WIZARD_KEY = '_wizard'
+
+
+def content_hash(value):
+    """Хэш текста или клавиатуры; одинаковый между перезапусками (в отличие от hash())"""
+    if value is None:
+        return 0
+    if not isinstance(value, str):
+        value = value.model_dump_json(exclude_none=True)
+    return zlib.crc32(value.encode())
+
+
+class Wizard:
+    """Форма в одном сообщении: каждый шаг правит его, а не присылает новое.
+
+    Первый шаг формы отправляет сообщение, следующие меняют в нем текст
+    и кнопки (editMessageText) или только кнопки (editMessageReplyMarkup).
+    Хэши показанного текста и клавиатуры лежат в данных FSM, поэтому
+    то, что не изменилось, повторно не отправляется вовсе. Если сообщение
+    уже нельзя править (удалено, слишком старое), шаг уходит новым.
+    С enabled=False каждый шаг, как раньше, — отдельное сообщение.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.sent = 0
+        self.edited = 0
+        self.skipped = 0
+
+    async def show(self, event, state, text, reply_markup=None):
+        """Показывает шаг формы пользователю, от которого пришло сообщение или нажатие"""
+        message = event.message if isinstance(event, types.CallbackQuery) else event
+        if not self.enabled:
+            await message.answer(text, reply_markup=reply_markup)
+            return
+
+        data = await state.get_data()
+        entry = data.get(WIZARD_KEY)
+        text_hash, markup_hash = content_hash(text), content_hash(reply_markup)
+        if entry is not None:
+            chat_id, message_id, shown_text, shown_markup = entry
+            if text_hash == shown_text and markup_hash == shown_markup:
+                self.skipped += 1
+                return
+            try:
+                if text_hash != shown_text:
+                    await message.bot.edit_message_text(text, chat_id=chat_id, message_id=message_id,
+                                                        reply_markup=reply_markup)
+                else:
+                    await message.bot.edit_message_reply_markup(chat_id=chat_id, message_id=message_id,
+                                                                reply_markup=reply_markup)
+                self.edited += 1
+            except TelegramBadRequest as e:
+                if 'not modified' not in str(e):
+                    logger.warning(f"Сообщение формы не обновить, отправляем новое: {e}")
+                    entry = None
+        if entry is None:
+            sent = await message.answer(text, reply_markup=reply_markup)
+            chat_id, message_id = sent.chat.id, sent.message_id
+            self.sent += 1
+        await state.update_data({WIZARD_KEY: [chat_id, message_id, text_hash, markup_hash]})